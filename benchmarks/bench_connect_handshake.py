@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark the room-joining part of the socket connect handshake against a
+real MongoDB, for users with a growing number of conversations.
+
+legacy: get_user_conversations() + one enter_room per conversation
+lazy:   get_user_conversation_ids(limit=CONNECT_ROOM_JOIN_LIMIT) + bulk join
+
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/bench_connect_handshake.py
+"""
+import asyncio
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import socketio
+from config import settings
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", default="10,100,500,2000")
+    parser.add_argument("--connects", type=int, default=200)
+    args = parser.parse_args()
+
+    settings.DATABASE_NAME = f"chat_bench_{os.getpid()}"
+
+    import database
+    from chat_service import ChatService
+    from socket_handlers import SocketHandler
+
+    await database.connect_to_mongo()
+    db = database.db.database
+    sio = socketio.AsyncServer(async_mode='asgi')
+    handler = SocketHandler(sio)
+    results = []
+    try:
+        for count in (int(c) for c in args.counts.split(",")):
+            email = f"power{count}@example.com"
+            now = datetime.utcnow()
+            await db.conversations.insert_many([
+                {
+                    "participants": [email, f"peer{i}@example.com"],
+                    "conversation_type": "direct",
+                    "created_at": now,
+                    "last_message_time": now - timedelta(seconds=i)
+                }
+                for i in range(count)
+            ])
+
+            async def legacy(sid):
+                conversations = await ChatService.get_user_conversations(email)
+                for conv in conversations:
+                    await sio.enter_room(sid, f"conversation:{conv.conversation_id}")
+
+            async def lazy(sid):
+                conversation_ids = await ChatService.get_user_conversation_ids(
+                    email, limit=settings.CONNECT_ROOM_JOIN_LIMIT
+                )
+                handler._enter_rooms(sid, [f"conversation:{conversation_id}" for conversation_id in conversation_ids])
+
+            for name, join in (("legacy", legacy), ("lazy", lazy)):
+                latencies = []
+                for i in range(args.connects):
+                    sid = await sio.manager.connect(f"eio-{name}-{count}-{i}", "/")
+                    start = time.perf_counter()
+                    await join(sid)
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    sio.manager.basic_disconnect(sid, "/")
+                results.append({
+                    "case": name,
+                    "conversations": count,
+                    "p50_ms": round(percentile(latencies, 50), 3),
+                    "p99_ms": round(percentile(latencies, 99), 3),
+                })
+        print(json.dumps(results, indent=2))
+    finally:
+        await database.db.client.drop_database(settings.DATABASE_NAME)
+        await database.close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cold-tier archive (message_archive.py) against a real MongoDB:
+a year of history per conversation is written to chat_messages, then
+everything older than --archive-days is archived. Reports, before and after
+archiving (and after `compact`, since MongoDB does not give deleted space
+back on its own):
+
+- hot collection size and index sizes (collStats)
+- RAM residency: bytes of chat_messages and its indexes in the WiredTiger
+  cache after a warm-up of recent history pages
+- page latency for recent pages and for pages read through the archive
+
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/bench_message_archive.py
+
+With --mongo memory it runs on the in-memory stand-in instead, which only
+reports document counts and BSON data sizes:
+
+    python benchmarks/bench_message_archive.py --mongo memory
+"""
+import asyncio
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+
+from config import settings
+
+CACHE_BYTES = "bytes currently in the cache"
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def hot_stats(db, name="chat_messages"):
+    stats = await db.command("collStats", name, indexDetails=True)
+    return {
+        "documents": stats["count"],
+        "data_bytes": stats["size"],
+        "storage_bytes": stats.get("storageSize"),
+        "index_bytes": stats.get("totalIndexSize"),
+        "indexes": stats.get("indexSizes"),
+        "cache_bytes": stats.get("wiredTiger", {}).get("cache", {}).get(CACHE_BYTES),
+        "index_cache_bytes": {
+            index: details.get("cache", {}).get(CACHE_BYTES)
+            for index, details in stats.get("indexDetails", {}).items()
+        },
+    }
+
+async def time_pages(read_page, conversations, pages, limit, oldest):
+    """Latency of the newest page, or with `oldest` of keyset pages starting
+    in the oldest tenth of history"""
+    from pagination import encode_cursor
+
+    latencies = []
+    for _ in range(pages):
+        conversation_id, keys = random.choice(conversations)
+        before = None
+        if oldest:
+            timestamp, message_id = random.choice(keys[:len(keys) // 10])
+            before = encode_cursor(timestamp, message_id)
+        start = time.perf_counter()
+        await read_page(conversation_id, 0, limit, before, None)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return {"p50_ms": round(percentile(latencies, 50), 3), "p99_ms": round(percentile(latencies, 99), 3)}
+
+async def measure(db, read_page, conversations, args):
+    # Warm the cache with the pages clients actually read
+    await time_pages(read_page, conversations, args.pages, args.limit, oldest=False)
+    return {
+        "hot": await hot_stats(db),
+        "recent_page": await time_pages(read_page, conversations, args.pages, args.limit, oldest=False),
+        "old_page": await time_pages(read_page, conversations, args.pages, args.limit, oldest=True),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20000, help="messages per conversation, spread over a year")
+    parser.add_argument("--archive-days", type=float, default=30)
+    parser.add_argument("--pages", type=int, default=500, help="pages timed per case")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--mongo", choices=("mongodb", "memory"), default="mongodb",
+                        help="MONGODB_URL (throwaway database) or the in-memory stand-in, "
+                             "which reports no storage, index or cache sizes")
+    args = parser.parse_args()
+
+    settings.DATABASE_NAME = f"chat_bench_{os.getpid()}"
+    settings.INDEX_BUILD_ON_STARTUP = False
+
+    import database
+    from indexes import build_indexes
+    from message_archive import MessageArchive
+    from message_store import FlatMessageStore
+
+    if args.mongo == "memory":
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from memory_mongo import MemoryDatabase
+        database.db.database = MemoryDatabase()
+    else:
+        await database.connect_to_mongo()
+    db = database.db.database
+    try:
+        await build_indexes(db)
+        now = datetime.utcnow().replace(microsecond=0)
+        # Whole milliseconds, like BSON datetimes and cursors
+        step = timedelta(milliseconds=365 * 86400 * 1000 // args.messages)
+        conversations = []
+        for c in range(args.conversations):
+            result = await db.conversations.insert_one({
+                "participants": [f"user{c}@example.com", f"peer{c}@example.com"],
+                "conversation_type": "direct",
+                "created_at": now - timedelta(days=365)
+            })
+            conversation_id = str(result.inserted_id)
+            messages = [
+                {
+                    "_id": ObjectId(),
+                    "conversation_id": conversation_id,
+                    "sender_email": f"user{c}@example.com" if i % 2 else f"peer{c}@example.com",
+                    "sender_name": "Bench",
+                    "message": f"Message number {i} about the upcoming exam and study notes",
+                    "timestamp": now - timedelta(days=365) + i * step,
+                    "message_type": "text",
+                    "edited": False,
+                    "reply_to": None,
+                }
+                for i in range(args.messages)
+            ]
+            for offset in range(0, len(messages), 5000):
+                await db.chat_messages.insert_many(messages[offset:offset + 5000])
+            conversations.append((conversation_id, [(m["timestamp"], m["_id"]) for m in messages]))
+
+        store = FlatMessageStore()
+        archive = MessageArchive(args.archive_days, settings.MESSAGE_ARCHIVE_BLOB_MESSAGES,
+                                 settings.MESSAGE_ARCHIVE_COMPRESSION_LEVEL)
+
+        async def read_through(*page_args):
+            return await archive.read_through(store, *page_args)
+
+        report = {
+            "config": {
+                "conversations": args.conversations,
+                "messages_per_conversation": args.messages,
+                "archive_days": args.archive_days,
+                "blob_messages": settings.MESSAGE_ARCHIVE_BLOB_MESSAGES,
+                "compression_level": settings.MESSAGE_ARCHIVE_COMPRESSION_LEVEL,
+            },
+            "before": await measure(db, store.page, conversations, args),
+        }
+
+        started = time.perf_counter()
+        result = await archive.run(store)
+        report["archive_run"] = {"messages": result["messages"], "seconds": round(time.perf_counter() - started, 2)}
+        archive_stats = await db.command("collStats", "chat_message_archive")
+        report["archive"] = {
+            "blobs": archive_stats["count"],
+            "data_bytes": archive_stats["size"],
+            "storage_bytes": archive_stats.get("storageSize"),
+            "index_bytes": archive_stats.get("totalIndexSize"),
+        }
+
+        report["after"] = await measure(db, read_through, conversations, args)
+        try:
+            await db.command("compact", "chat_messages", force=True)
+            report["after_compact"] = await measure(db, read_through, conversations, args)
+        except Exception as e:
+            report["after_compact"] = {"error": str(e)}
+        print(json.dumps(report, indent=2))
+    finally:
+        if args.mongo == "mongodb":
+            await database.db.client.drop_database(settings.DATABASE_NAME)
+            await database.close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark write-behind batching of ChatService.send_message against a real
+MongoDB: a burst of concurrent senders spread over several conversations,
+with batching off and with a few batch size / delay settings.
+
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/bench_message_batching.py
+"""
+import asyncio
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def run_case(name, conversation_ids, messages, concurrency):
+    from chat_service import ChatService
+
+    latencies = []
+    counter = iter(range(messages))
+
+    async def sender(worker_id):
+        for i in counter:
+            conversation_id = conversation_ids[i % len(conversation_ids)]
+            start = time.perf_counter()
+            await ChatService.send_message(conversation_id, f"user{worker_id}@example.com", "Bench", f"message {i}")
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(sender(w) for w in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    await ChatService.flush_message_batches()
+    return {
+        "case": name,
+        "messages": messages,
+        "messages_per_sec": round(messages / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--conversations", type=int, default=50)
+    args = parser.parse_args()
+
+    settings.DATABASE_NAME = f"chat_bench_{os.getpid()}"
+
+    import database
+    import chat_service
+    from chat_service import ChatService
+    from message_batcher import WriteBehindBatcher
+
+    await database.connect_to_mongo()
+    db = database.db.database
+    try:
+        result = await db.conversations.insert_many([
+            {
+                "participants": [f"user{i}@example.com", f"peer{i}@example.com"],
+                "conversation_type": "direct",
+                "created_at": datetime.utcnow()
+            }
+            for i in range(args.conversations)
+        ])
+        conversation_ids = [str(_id) for _id in result.inserted_ids]
+
+        cases = [("unbatched", None), ("batch_50_2ms", (50, 2)), ("batch_100_5ms", (100, 5)), ("batch_500_10ms", (500, 10))]
+        results = []
+        for name, config in cases:
+            chat_service._message_batcher = (
+                WriteBehindBatcher(ChatService._write_message_batch, max_batch_size=config[0], max_delay_ms=config[1])
+                if config else None
+            )
+            results.append(await run_case(name, conversation_ids, args.messages, args.concurrency))
+        print(json.dumps(results, indent=2))
+    finally:
+        await database.db.client.drop_database(settings.DATABASE_NAME)
+        await database.close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark the flat and bucketed message layouts (message_store.py) against a
+real MongoDB: the same history is written to chat_messages and, through the
+bucket-messages migration, to chat_message_buckets. Reports document count,
+storage and index size of each collection (collStats) and history page
+latency for the newest page, offset pages and keyset pages deep in history.
+
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/bench_message_buckets.py
+
+With --mongo memory it runs on the in-memory stand-in instead, which only
+reports document counts and BSON data sizes:
+
+    python benchmarks/bench_message_buckets.py --mongo memory
+"""
+import asyncio
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+
+from config import settings
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def collection_stats(db, name):
+    stats = await db.command("collStats", name)
+    return {
+        "documents": stats["count"],
+        "data_bytes": stats["size"],
+        "storage_bytes": stats.get("storageSize"),
+        "index_bytes": stats.get("totalIndexSize"),
+        "indexes": stats.get("indexSizes"),
+    }
+
+async def time_pages(store, conversations, pages, limit):
+    from pagination import encode_cursor
+
+    results = {}
+    for case in ("newest", "offset", "keyset"):
+        latencies = []
+        for _ in range(pages):
+            conversation_id, timestamps = random.choice(conversations)
+            skip, before = 0, None
+            if case == "offset":
+                skip = random.randrange(len(timestamps))
+            elif case == "keyset":
+                timestamp, message_id = random.choice(timestamps)
+                before = encode_cursor(timestamp, message_id)
+            start = time.perf_counter()
+            await store.page(conversation_id, skip, limit, before, None)
+            latencies.append((time.perf_counter() - start) * 1000)
+        results[case] = {
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+        }
+    return results
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10000, help="messages per conversation")
+    parser.add_argument("--pages", type=int, default=500, help="pages timed per case and layout")
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--mongo", choices=("mongodb", "memory"), default="mongodb",
+                        help="MONGODB_URL (throwaway database) or the in-memory stand-in, "
+                             "which reports no storage, index or cache sizes")
+    args = parser.parse_args()
+
+    settings.DATABASE_NAME = f"chat_bench_{os.getpid()}"
+    settings.INDEX_BUILD_ON_STARTUP = False
+
+    import database
+    from indexes import build_indexes
+    from message_store import FlatMessageStore, BucketedMessageStore
+    from migrations import bucket_flat_messages
+
+    if args.mongo == "memory":
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        from memory_mongo import MemoryDatabase
+        database.db.database = MemoryDatabase()
+    else:
+        await database.connect_to_mongo()
+    db = database.db.database
+    try:
+        await build_indexes(db)
+        conversations = []
+        start_time = datetime(2024, 1, 1)
+        for c in range(args.conversations):
+            result = await db.conversations.insert_one({
+                "participants": [f"user{c}@example.com", f"peer{c}@example.com"],
+                "conversation_type": "direct",
+                "created_at": start_time
+            })
+            conversation_id = str(result.inserted_id)
+            messages = [
+                {
+                    "_id": ObjectId(),
+                    "conversation_id": conversation_id,
+                    "sender_email": f"user{c}@example.com" if i % 2 else f"peer{c}@example.com",
+                    "sender_name": "Bench",
+                    "message": f"Message number {i} about the upcoming exam and study notes",
+                    "timestamp": start_time + timedelta(seconds=i * 30),
+                    "message_type": "text",
+                    "edited": False,
+                    "reply_to": None,
+                }
+                for i in range(args.messages)
+            ]
+            for offset in range(0, len(messages), 5000):
+                await db.chat_messages.insert_many(messages[offset:offset + 5000])
+            # BSON datetimes have millisecond precision, like the cursors
+            conversations.append((conversation_id, [(m["timestamp"], m["_id"]) for m in messages]))
+
+        started = time.perf_counter()
+        await bucket_flat_messages()
+        migration_seconds = time.perf_counter() - started
+
+        report = {
+            "config": {
+                "conversations": args.conversations,
+                "messages_per_conversation": args.messages,
+                "bucket_size": settings.MESSAGE_BUCKET_SIZE,
+                "bucket_span_seconds": settings.MESSAGE_BUCKET_SPAN_SECONDS,
+                "page_limit": args.limit,
+            },
+            "migration_seconds": round(migration_seconds, 2),
+            "flat": {
+                "collection": await collection_stats(db, "chat_messages"),
+                "pages": await time_pages(FlatMessageStore(), conversations, args.pages, args.limit),
+            },
+            "bucketed": {
+                "collection": await collection_stats(db, "chat_message_buckets"),
+                "pages": await time_pages(
+                    BucketedMessageStore(settings.MESSAGE_BUCKET_SIZE, settings.MESSAGE_BUCKET_SPAN_SECONDS),
+                    conversations, args.pages, args.limit
+                ),
+            },
+        }
+        print(json.dumps(report, indent=2))
+    finally:
+        if args.mongo == "mongodb":
+            await database.db.client.drop_database(settings.DATABASE_NAME)
+            await database.close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
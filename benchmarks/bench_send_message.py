@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark the message write path against a real MongoDB.
+
+Compares the legacy 3+N round trip write (insert, update, find, one update
+per recipient) with ChatService.send_message. Uses MONGODB_URL and writes to
+a throwaway database that is dropped afterwards.
+
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/bench_send_message.py
+"""
+import asyncio
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+from config import settings
+
+async def legacy_send_message(db, conversation_id, sender_email, message_content):
+    message_data = {
+        "conversation_id": conversation_id,
+        "sender_email": sender_email,
+        "sender_name": "Bench",
+        "message": message_content,
+        "timestamp": datetime.utcnow(),
+        "message_type": "text",
+        "edited": False,
+        "reply_to": None
+    }
+    await db.chat_messages.insert_one(message_data)
+    await db.conversations.update_one(
+        {"_id": ObjectId(conversation_id)},
+        {
+            "$set": {
+                "last_message": message_content,
+                "last_message_time": message_data["timestamp"],
+                "last_message_sender": sender_email
+            },
+            "$inc": {f"unread_count.{sender_email}": 0}
+        }
+    )
+    conversation = await db.conversations.find_one({"_id": ObjectId(conversation_id)})
+    for participant in conversation["participants"]:
+        if participant != sender_email:
+            await db.conversations.update_one(
+                {"_id": ObjectId(conversation_id)},
+                {"$inc": {f"unread_count.{participant}": 1}}
+            )
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+async def run_case(name, send, messages, concurrency):
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(messages):
+        queue.put_nowait(i)
+
+    async def worker():
+        while not queue.empty():
+            i = queue.get_nowait()
+            start = time.perf_counter()
+            await send(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "case": name,
+        "messages": messages,
+        "messages_per_sec": round(messages / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--participants", type=int, default=2)
+    args = parser.parse_args()
+
+    settings.DATABASE_NAME = f"chat_bench_{os.getpid()}"
+
+    import database
+    from chat_service import ChatService
+
+    await database.connect_to_mongo()
+    db = database.db.database
+    try:
+        participants = [f"user{i}@example.com" for i in range(args.participants)]
+        result = await db.conversations.insert_one({
+            "participants": participants,
+            "conversation_type": "direct",
+            "created_at": datetime.utcnow(),
+            "unread_count": {p: 0 for p in participants}
+        })
+        conversation_id = str(result.inserted_id)
+        sender = participants[0]
+
+        results = [
+            await run_case(
+                "legacy", lambda i: legacy_send_message(db, conversation_id, sender, f"message {i}"),
+                args.messages, args.concurrency
+            ),
+            await run_case(
+                "single_round_trip", lambda i: ChatService.send_message(conversation_id, sender, "Bench", f"message {i}"),
+                args.messages, args.concurrency
+            ),
+        ]
+        print(json.dumps(results, indent=2))
+    finally:
+        await database.db.client.drop_database(settings.DATABASE_NAME)
+        await database.close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Benchmark sid -> email lookups: legacy linear scan vs SessionRegistry
+"""
+import sys
+import os
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_registry import SessionRegistry
+
+LOOKUPS = 2000
+
+def linear_lookup(connected_users, sid):
+    for email, socket_id in connected_users.items():
+        if socket_id == sid:
+            return email
+    return None
+
+def bench(size: int):
+    connected_users = {}
+    registry = SessionRegistry()
+    sids = []
+    for i in range(size):
+        sid = f"sid-{i}"
+        email = f"user{i}@example.com"
+        connected_users[email] = sid
+        registry.add(sid, email)
+        sids.append(sid)
+
+    probe = [random.choice(sids) for _ in range(LOOKUPS)]
+
+    start = time.perf_counter()
+    for sid in probe:
+        linear_lookup(connected_users, sid)
+    linear_us = (time.perf_counter() - start) / LOOKUPS * 1e6
+
+    start = time.perf_counter()
+    for sid in probe:
+        registry.get_email(sid)
+    registry_us = (time.perf_counter() - start) / LOOKUPS * 1e6
+
+    return linear_us, registry_us
+
+def main():
+    print(f"{'connections':>12} {'linear us/op':>14} {'registry us/op':>16}")
+    for size in (1_000, 10_000, 100_000):
+        linear_us, registry_us = bench(size)
+        print(f"{size:>12} {linear_us:>14.2f} {registry_us:>16.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark /users/search keystroke latency against a real MongoDB.
+
+Seeds --users synthetic users (default 1M) and replays the keystrokes of a
+few autocomplete queries, comparing the old unanchored case-insensitive
+$regex over email/name with ChatService.search_users (prefix keys + index).
+The result cache is cleared before each query so every keystroke hits Mongo.
+
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/bench_user_search.py
+"""
+import asyncio
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+
+FIRST_NAMES = ["john", "jane", "maria", "li", "ahmed", "olga", "sam", "priya", "diego", "emma"]
+LAST_NAMES = ["smith", "garcia", "chen", "khan", "ivanova", "brown", "patel", "lopez", "müller", "kim"]
+QUERIES = ["john", "garcia", "priya.p", "user12345"]
+
+async def legacy_search(users_collection, query, current_user):
+    cursor = users_collection.find({
+        "$and": [
+            {"email": {"$ne": current_user}},
+            {"$or": [
+                {"email": {"$regex": query, "$options": "i"}},
+                {"name": {"$regex": query, "$options": "i"}}
+            ]}
+        ]
+    }).limit(10)
+    return [user async for user in cursor]
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    settings.DATABASE_NAME = f"chat_bench_{os.getpid()}"
+
+    import database
+    import chat_service
+    from chat_service import ChatService
+
+    await database.connect_to_mongo()
+    users_collection = database.db.database.users
+    try:
+        batch = []
+        for i in range(args.users):
+            name = f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}".title()
+            email = f"{name.split()[0].lower()}.{name.split()[1][0].lower()}{i}@example.com"
+            if i % 100_000 == 12345:
+                email = f"user{i}@example.com"
+            batch.append({"email": email, "name": name, "search_keys": ChatService.user_search_keys(email, name)})
+            if len(batch) == 10_000:
+                await users_collection.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            await users_collection.insert_many(batch, ordered=False)
+
+        results = []
+        for query in QUERIES:
+            for length in range(1, len(query) + 1):
+                keystroke = query[:length]
+
+                start = time.perf_counter()
+                await legacy_search(users_collection, keystroke, "me@example.com")
+                legacy_ms = (time.perf_counter() - start) * 1000
+
+                chat_service._user_search_cache.clear()
+                start = time.perf_counter()
+                await ChatService.search_users(keystroke, exclude_email="me@example.com")
+                indexed_ms = (time.perf_counter() - start) * 1000
+
+                results.append({
+                    "keystroke": keystroke,
+                    "legacy_ms": round(legacy_ms, 3),
+                    "prefix_index_ms": round(indexed_ms, 3),
+                })
+        print(json.dumps({"users": args.users, "results": results}, indent=2))
+    finally:
+        await database.db.client.drop_database(settings.DATABASE_NAME)
+        await database.close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
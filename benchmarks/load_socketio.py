@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Load test one server worker with simulated Socket.IO clients.
+
+Starts `main:socket_app` under uvicorn in a child process (against MongoDB,
+or the in-memory stand-in from memory_mongo.py with --mongo memory), logs in
+--clients users through /api/auth/login and connects them in pairs. Every
+client sends --messages direct messages to its partner, each preceded by
+typing_start, and emits mark_as_read every --read-every messages it
+receives. Prints one JSON document with the connect rate, messages/sec and
+p50/p95/p99 delivery latency (send_message emitted -> new_message received
+by the partner) that can be compared across commits.
+
+    python benchmarks/load_socketio.py --mongo memory --clients 2000
+    MONGODB_URL=mongodb://localhost:27017 python benchmarks/load_socketio.py --clients 5000 --procs 4
+    python benchmarks/load_socketio.py --url http://127.0.0.1:8000 --clients 1000
+
+The report includes the server's /stats/* counters; against --url they are
+only returned when load0@example.com is listed in the server's ADMIN_EMAILS.
+
+Clients speak Engine.IO 4 / Socket.IO 5 directly over `websockets` (installed
+with uvicorn[standard]), which is far lighter per client than
+socketio.AsyncClient, so one driver process can hold thousands of them.
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from typing import Optional
+from urllib.parse import urlencode, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import websockets
+
+from config import settings
+
+EVENTS = ("new_message", "message_notification", "user_typing", "marked_as_read", "presence_update", "error")
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+def summarize(samples):
+    if not samples:
+        return None
+    return {
+        "p50": round(percentile(samples, 50), 3),
+        "p95": round(percentile(samples, 95), 3),
+        "p99": round(percentile(samples, 99), 3),
+        "max": round(max(samples), 3),
+    }
+
+def raise_fd_limit():
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+
+def user_email(index: int) -> str:
+    return f"load{index}@example.com"
+
+async def http_request(host: str, port: int, method: str, path: str, token: Optional[str] = None):
+    """Minimal HTTP/1.1 request returning (status, decoded JSON body)"""
+    reader, writer = await asyncio.open_connection(host, port)
+    authorization = f"Authorization: Bearer {token}\r\n" if token else ""
+    try:
+        writer.write(
+            f"{method} {path} HTTP/1.1\r\nHost: {host}:{port}\r\n{authorization}"
+            f"Content-Length: 0\r\nConnection: close\r\n\r\n".encode()
+        )
+        await writer.drain()
+        raw = await reader.read()
+    finally:
+        writer.close()
+    head, _, body = raw.partition(b"\r\n\r\n")
+    status = int(head.split()[1])
+    return status, json.loads(body) if body else None
+
+# ---------------------------------------------------------------------------
+# Server process
+# ---------------------------------------------------------------------------
+
+def serve(args):
+    raise_fd_limit()
+    settings.DATABASE_NAME = args.database
+    # /stats/* is admin only; the first load user reads it after the run
+    settings.ADMIN_EMAILS = settings.ADMIN_EMAILS + [user_email(0)]
+
+    import logging
+    import uvicorn
+    import database
+    import main
+
+    if args.mongo == "memory":
+        from memory_mongo import MemoryDatabase
+        from indexes import build_indexes
+
+        async def connect_to_memory():
+            database.db.database = MemoryDatabase()
+            await build_indexes(database.db.database)
+
+        main.connect_to_mongo = connect_to_memory
+
+    if not args.server_logs:
+        # main.py logs every event at INFO, which would dominate the profile
+        logging.getLogger().setLevel(logging.WARNING)
+        main.sio.logger.setLevel(logging.WARNING)
+        main.sio.eio.logger.setLevel(logging.WARNING)
+
+    uvicorn.run(main.socket_app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+# ---------------------------------------------------------------------------
+# Clients
+# ---------------------------------------------------------------------------
+
+class BenchClient:
+    def __init__(self, index: int, run: "ClientRun"):
+        self.index = index
+        self.email = user_email(index)
+        self.partner = user_email(index ^ 1)
+        self.run = run
+        self.ws = None
+        self.reader = None
+        self.conversation_id = None
+        self.received = 0
+
+    async def connect(self, url: str, token: str):
+        self.ws = await websockets.connect(
+            f"{url}/socket.io/?EIO=4&transport=websocket",
+            max_size=None, ping_interval=None, compression=None, open_timeout=60
+        )
+        await self.ws.recv()  # Engine.IO open packet
+        await self.ws.send("40" + json.dumps({"token": token}))
+        while True:
+            packet = await self.ws.recv()
+            if packet.startswith("40"):
+                break
+            if packet.startswith("44"):
+                raise ConnectionError(f"connect rejected: {packet[2:]}")
+            self._handle(packet)
+        self.reader = asyncio.create_task(self._read())
+
+    async def emit(self, event: str, data: dict):
+        await self.ws.send("42" + json.dumps([event, data]))
+
+    async def close(self):
+        if self.reader:
+            self.reader.cancel()
+        if self.ws:
+            await self.ws.close()
+
+    async def _read(self):
+        try:
+            async for packet in self.ws:
+                if packet == "2":
+                    await self.ws.send("3")  # Engine.IO pong
+                else:
+                    self._handle(packet)
+        except websockets.ConnectionClosed:
+            pass
+
+    def _handle(self, packet: str):
+        if not packet.startswith("42"):
+            return
+        event, *payload = json.loads(packet[2:])
+        data = payload[0] if payload else None
+        self.run.events[event] += 1
+        if event != "new_message":
+            return
+        self.conversation_id = data["conversation_id"]
+        if data["sender_email"] != self.partner:
+            return
+        sent_at = self.run.sent.pop(data["message"], None)
+        if sent_at is None:
+            return
+        now = time.perf_counter()
+        self.run.latencies.append((now - sent_at) * 1000)
+        self.run.delivered += 1
+        self.run.last_delivery = now
+        self.received += 1
+        if self.run.args.read_every and self.received % self.run.args.read_every == 0:
+            asyncio.create_task(self.emit("mark_as_read", {"conversation_id": self.conversation_id}))
+
+class ClientRun:
+    """Clients [start, end) of one driver process"""
+
+    def __init__(self, args, start: int, end: int):
+        self.args = args
+        self.clients = [BenchClient(index, self) for index in range(start, end)]
+        self.events = Counter()
+        self.sent = {}
+        self.latencies = []
+        self.connect_latencies = []
+        self.connect_failures = 0
+        self.delivered = 0
+        self.sent_count = 0
+        self.last_delivery = None
+
+    async def connect_all(self, url: str, tokens: dict):
+        semaphore = asyncio.Semaphore(self.args.connect_concurrency)
+
+        async def connect(client):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    await client.connect(url, tokens[client.email])
+                    self.connect_latencies.append((time.perf_counter() - started) * 1000)
+                except Exception:
+                    self.connect_failures += 1
+                    client.ws = None
+
+        started = time.perf_counter()
+        await asyncio.gather(*(connect(client) for client in self.clients))
+        return time.perf_counter() - started
+
+    async def send_all(self):
+        args = self.args
+
+        async def sender(client):
+            await asyncio.sleep(random.uniform(0, args.interval))
+            for n in range(args.messages):
+                if client.conversation_id:
+                    await client.emit("typing_start", {"conversation_id": client.conversation_id})
+                    await asyncio.sleep(args.typing_ms / 1000)
+                text = f"load {client.index}-{n}"
+                self.sent[text] = time.perf_counter()
+                self.sent_count += 1
+                await client.emit("send_message", {"to_email": client.partner, "message": text})
+                await asyncio.sleep(max(args.interval - args.typing_ms / 1000, 0))
+
+        connected = [client for client in self.clients if client.ws is not None]
+        started = time.perf_counter()
+        await asyncio.gather(*(sender(client) for client in connected))
+        deadline = time.perf_counter() + args.drain_timeout
+        while self.sent and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+        return started
+
+    def result(self, connect_seconds: float, send_started: float) -> dict:
+        send_seconds = ((self.last_delivery or send_started) - send_started)
+        return {
+            "connect_seconds": connect_seconds,
+            "connect_latencies": self.connect_latencies,
+            "connect_failures": self.connect_failures,
+            "send_seconds": send_seconds,
+            "sent": self.sent_count,
+            "delivered": self.delivered,
+            "latencies": self.latencies,
+            "events": dict(self.events),
+        }
+
+async def drive(args, start: int, end: int, url: str, tokens: dict, barrier=None) -> dict:
+    raise_fd_limit()
+    run = ClientRun(args, start, end)
+    loop = asyncio.get_running_loop()
+    connect_seconds = await run.connect_all(url, tokens)
+    if barrier is not None:
+        # Every driver process starts sending once all clients are connected
+        await loop.run_in_executor(None, barrier.wait)
+    send_started = await run.send_all()
+    result = run.result(connect_seconds, send_started)
+    await asyncio.gather(*(client.close() for client in run.clients), return_exceptions=True)
+    return result
+
+def drive_process(args, start, end, url, tokens, barrier, queue):
+    queue.put(asyncio.run(drive(args, start, end, url, tokens, barrier)))
+
+async def login_all(host: str, port: int, count: int) -> dict:
+    semaphore = asyncio.Semaphore(50)
+
+    async def login(index):
+        async with semaphore:
+            query = urlencode({"email": user_email(index), "name": f"Load User {index}"})
+            status, body = await http_request(host, port, "POST", f"/api/auth/login?{query}")
+            if status != 200:
+                raise RuntimeError(f"login failed ({status}): {body}")
+            return user_email(index), body["access_token"]
+
+    return dict(await asyncio.gather(*(login(index) for index in range(count))))
+
+async def wait_until_ready(host: str, port: int, server, timeout: float = 60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError("server process exited during startup")
+        try:
+            status, _ = await http_request(host, port, "GET", "/health")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_drivers(args, url: str, tokens: dict) -> list:
+    clients = args.clients - args.clients % 2
+    if args.procs <= 1:
+        return [asyncio.run(drive(args, 0, clients, url, tokens))]
+
+    # Split on pair boundaries so both partners live in the same process
+    pairs = clients // 2
+    bounds = [2 * (pairs * i // args.procs) for i in range(args.procs + 1)]
+    barrier = multiprocessing.Barrier(args.procs)
+    queue = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=drive_process, args=(args, bounds[i], bounds[i + 1], url, tokens, barrier, queue))
+        for i in range(args.procs)
+    ]
+    for process in processes:
+        process.start()
+    results = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+    return results
+
+def report(args, results: list, server_stats: dict) -> dict:
+    connect_latencies = [ms for result in results for ms in result["connect_latencies"]]
+    latencies = [ms for result in results for ms in result["latencies"]]
+    connect_seconds = max(result["connect_seconds"] for result in results)
+    send_seconds = max(result["send_seconds"] for result in results)
+    sent = sum(result["sent"] for result in results)
+    delivered = sum(result["delivered"] for result in results)
+    events = Counter()
+    for result in results:
+        events.update(result["events"])
+    return {
+        "commit": git_commit(),
+        "config": {
+            "clients": args.clients - args.clients % 2,
+            "procs": args.procs,
+            "messages_per_client": args.messages,
+            "interval_s": args.interval,
+            "read_every": args.read_every,
+            "mongo": "external" if args.url else args.mongo,
+        },
+        "connect": {
+            "connected": len(connect_latencies),
+            "failed": sum(result["connect_failures"] for result in results),
+            "seconds": round(connect_seconds, 3),
+            "per_second": round(len(connect_latencies) / connect_seconds, 1) if connect_seconds else None,
+            "latency_ms": summarize(connect_latencies),
+        },
+        "messages": {
+            "sent": sent,
+            "delivered": delivered,
+            "lost": sent - delivered,
+            "seconds": round(send_seconds, 3),
+            "per_second": round(delivered / send_seconds, 1) if send_seconds else None,
+            "latency_ms": summarize(latencies),
+        },
+        "events": {event: events.get(event, 0) for event in EVENTS},
+        "server": server_stats,
+    }
+
+async def fetch_server_stats(host: str, port: int, token: str) -> dict:
+    stats = {}
+    for name in ("caches", "typing", "presence"):
+        try:
+            status, body = await http_request(host, port, "GET", f"/stats/{name}", token)
+            if status == 200:
+                stats[name] = body
+        except OSError:
+            pass
+    return stats
+
+async def drop_database(name: str):
+    from motor.motor_asyncio import AsyncIOMotorClient
+    client = AsyncIOMotorClient(settings.MONGODB_URL)
+    await client.drop_database(name)
+    client.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=1000, help="simulated clients (rounded down to pairs)")
+    parser.add_argument("--messages", type=int, default=10, help="messages sent by each client")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between a client's messages")
+    parser.add_argument("--typing-ms", type=float, default=100, help="delay between typing_start and send_message")
+    parser.add_argument("--read-every", type=int, default=5, help="mark_as_read after this many received messages (0 = never)")
+    parser.add_argument("--connect-concurrency", type=int, default=100, help="handshakes in flight per driver process")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="seconds to wait for outstanding deliveries")
+    parser.add_argument("--procs", type=int, default=1, help="client driver processes")
+    parser.add_argument("--mongo", choices=("mongodb", "memory"), default="mongodb",
+                        help="MONGODB_URL (throwaway database) or the in-memory stand-in")
+    parser.add_argument("--url", help="use an already running server instead of starting one")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--server-logs", action="store_true", help="keep the server's per-event INFO logging")
+    parser.add_argument("--output", help="also write the JSON report to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--database", default=f"chat_load_{os.getpid()}", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        host, port = args.host, args.port
+        command = [
+            sys.executable, os.path.abspath(__file__), "--serve", "--mongo", args.mongo,
+            "--host", host, "--port", str(port), "--database", args.database,
+        ] + (["--server-logs"] if args.server_logs else [])
+        server = subprocess.Popen(command)
+    url = f"ws://{host}:{port}"
+
+    try:
+        asyncio.run(wait_until_ready(host, port, server))
+        tokens = asyncio.run(login_all(host, port, args.clients - args.clients % 2))
+        results = run_drivers(args, url, tokens)
+        server_stats = asyncio.run(fetch_server_stats(host, port, tokens[user_email(0)]))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+            if args.mongo == "mongodb":
+                asyncio.run(drop_database(args.database))
+
+    output = json.dumps(report(args, results, server_stats), indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+
+if __name__ == "__main__":
+    main()
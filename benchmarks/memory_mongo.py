@@ -0,0 +1,486 @@
+"""
+In-memory stand-in for the Motor database, for load tests on machines
+without MongoDB.
+
+Only the operations and operators the socket hot path issues through
+ChatService are supported (find/find_one/insert/update/upsert/count/
+distinct/replace with equality, $in, $ne, $lt/$lte/$gt/$gte, $exists, $all,
+$or/$and, $set/$setOnInsert/$unset/$inc/$min/$max/$push updates, and
+aggregate with $match/$unwind/$limit/$count; collStats reports only count
+and size). Indexes created with create_index become hash indexes on their
+first field, and unique indexes are enforced so upserts behave like Mongo's. Every operation completes
+without yielding to the event loop, so each one is atomic.
+"""
+import copy
+import re
+
+import bson
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+_MISSING = object()
+
+def _get(doc: dict, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+def _compare(value, op: str, operand) -> bool:
+    if value is _MISSING or value is None or operand is None:
+        return False
+    try:
+        if op == "$lt":
+            return value < operand
+        if op == "$lte":
+            return value <= operand
+        if op == "$gt":
+            return value > operand
+        return value >= operand
+    except TypeError:
+        return False
+
+def _match_value(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for op, operand in condition.items():
+            if op == "$exists":
+                if (value is not _MISSING) != bool(operand):
+                    return False
+            elif op == "$ne":
+                if _match_value(value, operand):
+                    return False
+            elif op == "$in":
+                if not any(_match_value(value, item) for item in operand):
+                    return False
+            elif op == "$all":
+                if not isinstance(value, list) or not all(item in value for item in operand):
+                    return False
+            elif op == "$regex":
+                candidates = value if isinstance(value, list) else [value]
+                pattern = re.compile(operand, re.IGNORECASE if "i" in condition.get("$options", "") else 0)
+                if not any(isinstance(item, str) and pattern.search(item) for item in candidates):
+                    return False
+            elif op == "$options":
+                continue
+            elif op in ("$lt", "$lte", "$gt", "$gte"):
+                candidates = value if isinstance(value, list) else [value]
+                if not any(_compare(item, op, operand) for item in candidates):
+                    return False
+            else:
+                raise NotImplementedError(f"memory_mongo: unsupported query operator {op}")
+        return True
+    if value is _MISSING:
+        return condition is None
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, clause) for clause in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(doc, clause) for clause in condition):
+                return False
+        elif key.startswith("$"):
+            raise NotImplementedError(f"memory_mongo: unsupported query operator {key}")
+        elif not _match_value(_get(doc, key), condition):
+            return False
+    return True
+
+def _project(doc: dict, projection: Optional[dict]) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    included = [key for key, value in projection.items() if value and key != "_id"]
+    if included:
+        result = {key: copy.deepcopy(doc[key]) for key in included if key in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    excluded = {key for key, value in projection.items() if not value}
+    return {key: copy.deepcopy(value) for key, value in doc.items() if key not in excluded}
+
+def _sort_key(fields):
+    def key(doc):
+        parts = []
+        for field, direction in fields:
+            value = _get(doc, field)
+            parts.append(_Ordered(None if value is _MISSING else value, direction))
+        return parts
+    return key
+
+class _Ordered:
+    __slots__ = ("value", "direction")
+
+    def __init__(self, value, direction):
+        self.value = value
+        self.direction = direction
+
+    def __lt__(self, other):
+        a, b = self.value, other.value
+        if a is None or b is None:
+            less = a is None and b is not None
+            greater = b is None and a is not None
+        else:
+            less, greater = a < b, b < a
+        return less if self.direction > 0 else greater
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+def _apply_update(doc: dict, update: dict, inserting: bool):
+    for op, fields in update.items():
+        if op == "$set" or (op == "$setOnInsert" and inserting):
+            for key, value in fields.items():
+                doc[key] = copy.deepcopy(value)
+        elif op == "$setOnInsert":
+            continue
+        elif op == "$unset":
+            for key in fields:
+                doc.pop(key, None)
+        elif op == "$inc":
+            for key, value in fields.items():
+                doc[key] = doc.get(key, 0) + value
+        elif op in ("$min", "$max"):
+            for key, value in fields.items():
+                current = doc.get(key, _MISSING)
+                if current is _MISSING or (value < current if op == "$min" else value > current):
+                    doc[key] = copy.deepcopy(value)
+        elif op == "$push":
+            for key, value in fields.items():
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                doc.setdefault(key, []).extend(copy.deepcopy(items))
+        else:
+            raise NotImplementedError(f"memory_mongo: unsupported update operator {op}")
+
+class _Result:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class MemoryCursor:
+    def __init__(self, docs: List[dict], projection: Optional[dict]):
+        self._docs = docs
+        self._projection = projection
+        self._sort = None
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=None):
+        self._sort = [(key, direction or 1)] if isinstance(key, str) else list(key)
+        return self
+
+    def skip(self, skip: int):
+        self._skip = skip
+        return self
+
+    def limit(self, limit: int):
+        self._limit = limit
+        return self
+
+    def batch_size(self, _size: int):
+        return self
+
+    def max_time_ms(self, _ms: int):
+        return self
+
+    def _results(self) -> List[dict]:
+        docs = self._docs
+        if self._sort:
+            docs = sorted(docs, key=_sort_key(self._sort))
+        docs = docs[self._skip:]
+        if self._limit:
+            docs = docs[:self._limit]
+        return [_project(doc, self._projection) for doc in docs]
+
+    async def to_list(self, length: Optional[int] = None) -> List[dict]:
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self._results():
+            yield doc
+
+class MemoryCollection:
+    def __init__(self, name: str):
+        self.name = name
+        self._docs: Dict[Any, dict] = {}
+        self._unique: List[tuple] = []  # (fields, partial filter)
+        # field -> value -> ids, plus ids whose value cannot be hashed
+        self._indexes: Dict[str, Dict[Any, set]] = {}
+        self._unindexed: Dict[str, set] = {}
+        self._index_info: Dict[str, dict] = {"_id_": {"key": [("_id", 1)]}}
+
+    async def create_index(self, keys, unique: bool = False, partialFilterExpression: Optional[dict] = None, **_kwargs):
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        fields = [field for field, _ in keys]
+        self._index_info["_".join(f"{field}_{kind}" for field, kind in keys)] = {"key": keys}
+        if unique:
+            self._unique.append((fields, partialFilterExpression))
+        field, kind = keys[0]
+        if kind != "text" and field not in self._indexes:
+            self._indexes[field] = {}
+            self._unindexed[field] = set()
+            for doc in self._docs.values():
+                self._index_doc(doc, field, add=True)
+        return "_".join(fields)
+
+    async def index_information(self) -> dict:
+        return dict(self._index_info)
+
+    async def drop_index(self, name: str):
+        # Lookups keep using the hash index; only the listing changes
+        self._index_info.pop(name, None)
+
+    def _index_doc(self, doc: dict, field: str, add: bool):
+        value = _get(doc, field)
+        values = value if isinstance(value, list) else [value]
+        buckets = self._indexes[field]
+        for item in values:
+            try:
+                bucket = buckets.setdefault(item, set()) if add else buckets.get(item)
+            except TypeError:
+                bucket = self._unindexed[field]
+            if bucket is None:
+                continue
+            if add:
+                bucket.add(doc["_id"])
+            else:
+                bucket.discard(doc["_id"])
+
+    def _reindex(self, doc: dict, add: bool):
+        for field in self._indexes:
+            self._index_doc(doc, field, add)
+
+    def _candidates(self, query: dict):
+        """Ids that can match the query according to a hash index, or None"""
+        for field, condition in query.items():
+            if field not in self._indexes:
+                continue
+            if isinstance(condition, dict):
+                if set(condition) != {"$in"}:
+                    continue
+                values = condition["$in"]
+            else:
+                values = [condition]
+            ids = set(self._unindexed[field])
+            try:
+                for value in values:
+                    ids |= self._indexes[field].get(value, set())
+            except TypeError:
+                continue
+            return ids
+        return None
+
+    def _check_unique(self, doc: dict):
+        for fields, partial in self._unique:
+            if partial and not matches(doc, partial):
+                continue
+            key = [_get(doc, field) for field in fields]
+            ids = self._candidates({fields[0]: key[0]}) if key[0] is not _MISSING else None
+            others = self._docs.values() if ids is None else [self._docs[_id] for _id in ids if _id in self._docs]
+            for other in others:
+                if other["_id"] != doc["_id"] and (not partial or matches(other, partial)) \
+                        and [_get(other, field) for field in fields] == key:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name}")
+
+    def _insert(self, document: dict):
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._docs:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} index: _id_")
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self._docs[stored["_id"]] = stored
+        self._reindex(stored, add=True)
+        return stored
+
+    def _matching(self, query: dict) -> List[dict]:
+        if set(query) == {"_id"} and not isinstance(query["_id"], dict):
+            doc = self._docs.get(query["_id"])
+            return [doc] if doc is not None else []
+        ids = self._candidates(query)
+        docs = self._docs.values() if ids is None else [self._docs[_id] for _id in ids if _id in self._docs]
+        return [doc for doc in docs if matches(doc, query)]
+
+    def _update(self, query: dict, update, upsert: bool, sort=None):
+        if isinstance(update, list):
+            raise NotImplementedError("memory_mongo: pipeline updates are not supported")
+        found = self._matching(query)
+        if sort:
+            found.sort(key=_sort_key(sort))
+        if found:
+            doc = found[0]
+            before = copy.deepcopy(doc)
+            self._reindex(doc, add=False)
+            _apply_update(doc, update, inserting=False)
+            try:
+                self._check_unique(doc)
+            except DuplicateKeyError:
+                doc.clear()
+                doc.update(before)
+                raise
+            finally:
+                self._reindex(doc, add=True)
+            return before, doc, False
+        if not upsert:
+            return None, None, False
+        seed = {
+            key: value for key, value in query.items()
+            if not key.startswith("$") and not isinstance(value, dict)
+        }
+        _apply_update(seed, update, inserting=True)
+        return None, self._insert(seed), True
+
+    async def insert_one(self, document: dict):
+        self._insert(document)
+        return _Result(inserted_id=document["_id"], acknowledged=True)
+
+    async def insert_many(self, documents: List[dict], ordered: bool = True):
+        errors = []
+        for index, document in enumerate(documents):
+            try:
+                self._insert(document)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return _Result(inserted_ids=[document["_id"] for document in documents], acknowledged=True)
+
+    def find(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs):
+        cursor = MemoryCursor(self._matching(filter or {}), projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        return cursor.skip(kwargs.get("skip", 0)).limit(kwargs.get("limit", 0))
+
+    async def find_one(self, filter: Optional[dict] = None, projection: Optional[dict] = None, **kwargs):
+        results = await self.find(filter, projection, **kwargs).limit(1).to_list(1)
+        return results[0] if results else None
+
+    async def find_one_and_update(self, filter: dict, update, projection: Optional[dict] = None,
+                                  upsert: bool = False, return_document=ReturnDocument.BEFORE,
+                                  sort=None, **_kwargs):
+        before, after, _ = self._update(filter, update, upsert, sort)
+        doc = after if return_document == ReturnDocument.AFTER else before
+        return _project(doc, projection) if doc is not None else None
+
+    async def update_one(self, filter: dict, update, upsert: bool = False, **_kwargs):
+        before, after, inserted = self._update(filter, update, upsert)
+        return _Result(
+            matched_count=1 if before is not None else 0,
+            modified_count=1 if before is not None else 0,
+            upserted_id=after["_id"] if inserted else None
+        )
+
+    async def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **_kwargs):
+        found = self._matching(filter)
+        if found:
+            self._reindex(found[0], add=False)
+            del self._docs[found[0]["_id"]]
+        elif not upsert:
+            return _Result(matched_count=0, modified_count=0, upserted_id=None)
+        stored = self._insert(replacement)
+        return _Result(
+            matched_count=len(found), modified_count=len(found),
+            upserted_id=None if found else stored["_id"]
+        )
+
+    async def update_many(self, filter: dict, update, upsert: bool = False, **_kwargs):
+        found = self._matching(filter)
+        for doc in found:
+            self._reindex(doc, add=False)
+            _apply_update(doc, update, inserting=False)
+            self._reindex(doc, add=True)
+        if not found and upsert:
+            self._update(filter, update, True)
+        return _Result(matched_count=len(found), modified_count=len(found))
+
+    async def bulk_write(self, requests: list, ordered: bool = True):
+        errors = []
+        for index, request in enumerate(requests):
+            try:
+                # pymongo's UpdateOne keeps its arguments in private attributes
+                self._update(request._filter, request._doc, bool(request._upsert))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+        return _Result(acknowledged=True)
+
+    async def delete_one(self, filter: dict):
+        found = self._matching(filter)
+        if found:
+            self._reindex(found[0], add=False)
+            del self._docs[found[0]["_id"]]
+        return _Result(deleted_count=len(found[:1]))
+
+    async def delete_many(self, filter: dict):
+        found = self._matching(filter)
+        for doc in found:
+            self._reindex(doc, add=False)
+            del self._docs[doc["_id"]]
+        return _Result(deleted_count=len(found))
+
+    async def count_documents(self, filter: dict, limit: int = 0, **_kwargs) -> int:
+        count = len(self._matching(filter))
+        return min(count, limit) if limit else count
+
+    async def distinct(self, key: str, filter: Optional[dict] = None) -> list:
+        values = []
+        for doc in self._matching(filter or {}):
+            value = _get(doc, key)
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not _MISSING and item not in values:
+                    values.append(item)
+        return values
+
+    def aggregate(self, pipeline: List[dict]) -> MemoryCursor:
+        docs = None
+        for stage in pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                docs = self._matching(spec) if docs is None else [doc for doc in docs if matches(doc, spec)]
+            elif name == "$unwind":
+                field = spec.lstrip("$")
+                docs = [dict(doc, **{field: item}) for doc in docs for item in doc.get(field) or []]
+            elif name == "$limit":
+                docs = docs[:spec]
+            elif name == "$count":
+                docs = [{spec: len(docs)}] if docs else []
+            else:
+                raise NotImplementedError(f"memory_mongo: unsupported aggregation stage {name}")
+        return MemoryCursor(list(self._docs.values()) if docs is None else docs, None)
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections: Dict[str, MemoryCollection] = {}
+
+    def __getattr__(self, name: str) -> MemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def __getitem__(self, name: str) -> MemoryCollection:
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    async def command(self, name, *args, **_kwargs):
+        if name == "collStats":
+            # Only what is known without a storage engine: the document count
+            # and the uncompressed BSON size MongoDB reports as "size"
+            docs = self[args[0]]._docs.values()
+            return {"ok": 1.0, "count": len(docs), "size": sum(len(bson.encode(doc)) for doc in docs)}
+        return {"ok": 1.0}
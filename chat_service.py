@@ -1,42 +1,137 @@
-from typing import List, Optional
-from datetime import datetime
+from typing import AsyncIterator, List, Optional
+from datetime import datetime, timedelta
+import asyncio
+import logging
+import re
 from bson import ObjectId
-from models import ChatMessage, Conversation, User, MessageResponse, ConversationResponse
-from database import get_chat_messages_collection, get_conversations_collection, get_users_collection
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from models import ChatMessage, Conversation, User, MessageResponse, ConversationResponse, MessageSearchHit, ReadReceipt, GroupMember
+from database import (
+    get_conversations_collection, get_users_collection, get_read_states_collection,
+    get_conversation_members_collection
+)
+from serialization import CONVERSATION_PROJECTION, message_to_dict, conversation_to_dict
+from pagination import decode_search_cursor, encode_cursor, encode_sync_token
+from cache import LRUCache, TTLCache, SingleFlight
+from message_batcher import WriteBehindBatcher
+from message_store import create_message_store
+from message_archive import create_message_archive
+from config import settings
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# pair_key -> conversation_id for direct conversations
+_direct_conversation_cache = LRUCache(settings.CONVERSATION_CACHE_SIZE)
+_direct_conversation_lookups = SingleFlight()
+
+# email -> User, invalidated whenever this process writes the user
+_user_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL_SECONDS)
+
+# normalized search prefix -> ranked user candidates
+_user_search_cache = TTLCache(settings.USER_SEARCH_CACHE_SIZE, settings.USER_SEARCH_CACHE_TTL_SECONDS)
+# Candidates fetched per search query before ranking and excluding the caller
+USER_SEARCH_CANDIDATES = 50
+USER_SEARCH_PROJECTION = {"_id": 0, "email": 1, "name": 1, "profile_image": 1, "is_online": 1}
+
+# email -> emails of everyone sharing a conversation with the user
+_contact_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL_SECONDS)
+
+# (conversation, email) -> conversation type, for users who are in the
+# conversation. Leaving a group only invalidates this worker's entry, so other
+# workers may accept the user for up to the TTL
+_membership_cache = TTLCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL_SECONDS)
+
+# (conversation, user, last message, read watermark) -> unread count. The key
+# changes whenever a message arrives or the watermark moves, so entries never
+# need invalidating
+_unread_cache = LRUCache(settings.UNREAD_CACHE_SIZE)
+
+# Flat or bucketed message layout (MESSAGE_STORAGE)
+_message_store = create_message_store()
+# Compressed archive of old history, None unless MESSAGE_ARCHIVE_AFTER_DAYS is set
+_message_archive = create_message_archive()
 
 class ChatService:
     
+    @staticmethod
+    def direct_pair_key(participant1: str, participant2: str) -> str:
+        """Canonical key of a direct conversation (sorted participant emails)"""
+        return "|".join(sorted((participant1, participant2)))
+    
     @staticmethod
     async def create_or_get_conversation(participant1: str, participant2: str) -> str:
         """Create a new conversation or get existing one between two users"""
-        conversations_collection = await get_conversations_collection()
+        pair_key = ChatService.direct_pair_key(participant1, participant2)
         
-        # Check if conversation already exists
-        existing_conversation = await conversations_collection.find_one({
-            "participants": {"$all": [participant1, participant2]},
-            "conversation_type": "direct"
-        })
+        # Conversation ids never change, so a cached id is always valid
+        conversation_id = _direct_conversation_cache.get(pair_key)
+        if conversation_id:
+            return conversation_id
         
+        # Concurrent callers for the same pair share one lookup
+        conversation_id = await _direct_conversation_lookups.run(
+            pair_key,
+            lambda: ChatService._find_or_create_direct_conversation(participant1, participant2, pair_key)
+        )
+        _direct_conversation_cache.set(pair_key, conversation_id)
+        return conversation_id
+    
+    @staticmethod
+    async def _find_or_create_direct_conversation(participant1: str, participant2: str, pair_key: str) -> str:
+        conversations_collection = await get_conversations_collection()
+        
+        existing_conversation = await conversations_collection.find_one({"pair_key": pair_key}, {"_id": 1})
         if existing_conversation:
             return str(existing_conversation["_id"])
         
-        # Create new conversation
+        # Conversations created before pair keys existed: find and backfill them
+        legacy_conversation = await conversations_collection.find_one({
+            "participants": {"$all": [participant1, participant2]},
+            "conversation_type": "direct",
+            "pair_key": {"$exists": False}
+        }, {"_id": 1})
+        if legacy_conversation:
+            try:
+                await conversations_collection.update_one(
+                    {"_id": legacy_conversation["_id"]},
+                    {"$set": {"pair_key": pair_key}}
+                )
+                return str(legacy_conversation["_id"])
+            except DuplicateKeyError:
+                pass  # Another duplicate already owns the key, use that one
+        
+        # A new conversation may create a new contact pair
+        _contact_cache.pop(participant1)
+        _contact_cache.pop(participant2)
+        
+        # Upsert on the unique pair_key so concurrent first messages (even on
+        # different workers) end up in the same conversation
+        now = datetime.utcnow()
         conversation_data = {
             "participants": [participant1, participant2],
             "conversation_type": "direct", 
-            "created_at": datetime.utcnow(),
-            "unread_count": {participant1: 0, participant2: 0}
+            "created_at": now,
+            "updated_at": now
         }
-        
-        result = await conversations_collection.insert_one(conversation_data)
-        return str(result.inserted_id)
+        try:
+            conversation = await conversations_collection.find_one_and_update(
+                {"pair_key": pair_key},
+                {"$setOnInsert": conversation_data},
+                upsert=True,
+                projection={"_id": 1},
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            conversation = await conversations_collection.find_one({"pair_key": pair_key}, {"_id": 1})
+        return str(conversation["_id"])
     
     @staticmethod
     async def send_message(conversation_id: str, sender_email: str, sender_name: str, 
                           message_content: str, message_type: str = "text", 
                           reply_to: Optional[str] = None) -> ChatMessage:
         """Send a message to a conversation"""
-        chat_messages_collection = await get_chat_messages_collection()
         conversations_collection = await get_conversations_collection()
         
         # Create message
@@ -51,104 +146,621 @@ class ChatService:
             "reply_to": reply_to
         }
         
-        # Insert message
-        result = await chat_messages_collection.insert_one(message_data)
+        if _message_batcher is not None:
+            # Write-behind: the insert and conversation update happen in a
+            # bulk write shared with other messages sent in the same window
+            message_data["_id"] = ObjectId()
+            participants = await _message_batcher.submit(message_data)
+        else:
+            # Insert message
+            await _message_store.insert(message_data)
+            
+            # Update last message info; the participants come back from the
+            # same round trip. Unread counts are derived from read watermarks,
+            # so no per-recipient counter is written here
+            conversation = await conversations_collection.find_one_and_update(
+                {"_id": ObjectId(conversation_id)},
+                ChatService._last_message_update(message_data),
+                projection={"participants": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            participants = conversation.get("participants", []) if conversation else []
         
         # Create response object
         message = ChatMessage(
-            id=str(result.inserted_id),
+            id=str(message_data["_id"]),
             conversation_id=conversation_id,
             sender_email=sender_email,
             sender_name=sender_name,
             message=message_content,
             timestamp=message_data["timestamp"],
             message_type=message_type,
-            reply_to=reply_to
+            reply_to=reply_to,
+            participants=participants
         )
         
-        # Update conversation with last message info
-        await conversations_collection.update_one(
-            {"_id": ObjectId(conversation_id)},
-            {
-                "$set": {
-                    "last_message": message_content,
-                    "last_message_time": message.timestamp,
-                    "last_message_sender": sender_email
-                },
-                "$inc": {
-                    f"unread_count.{sender_email}": 0  # Don't increment for sender
-                }
-            }
-        )
+        return message
+    
+    @staticmethod
+    async def _write_message_batch(batch: List[dict]) -> list:
+        """Write a batch of messages with one bulk insert and one bulk
+        conversation update. Returns each message's participants, or the
+        exception for messages that failed to insert.
         
-        # Increment unread count for other participants
-        conversation = await conversations_collection.find_one({"_id": ObjectId(conversation_id)})
-        if conversation:
-            for participant in conversation["participants"]:
-                if participant != sender_email:
-                    await conversations_collection.update_one(
+        Once the insert succeeded a message is stored, so a failing
+        conversation update only leaves last_message behind: it is logged and
+        the messages resolve with no participants instead of failing (a
+        sender told that a stored message failed would send it again).
+        """
+        conversations_collection = await get_conversations_collection()
+        
+        failed = await _message_store.insert_many(batch)
+        
+        # Fold the batch into one update per conversation: the newest message
+        # becomes last_message
+        latest = {}
+        for index, message_data in enumerate(batch):
+            if index in failed:
+                continue
+            conversation_id = message_data["conversation_id"]
+            if conversation_id not in latest or message_data["timestamp"] >= latest[conversation_id]["timestamp"]:
+                latest[conversation_id] = message_data
+        
+        participants = {}
+        if latest:
+            try:
+                await conversations_collection.bulk_write([
+                    UpdateOne(
                         {"_id": ObjectId(conversation_id)},
-                        {"$inc": {f"unread_count.{participant}": 1}}
+                        ChatService._last_message_update(message_data)
                     )
+                    for conversation_id, message_data in latest.items()
+                ], ordered=False)
+                
+                cursor = conversations_collection.find(
+                    {"_id": {"$in": [ObjectId(conversation_id) for conversation_id in latest]}},
+                    {"participants": 1}
+                )
+                async for conv in cursor:
+                    participants[str(conv["_id"])] = conv.get("participants", [])
+            except Exception as e:
+                logger.error(f"Conversation update after inserting {len(batch) - len(failed)} messages failed: {e}")
         
-        return message
+        return [
+            Exception(failed[index]) if index in failed
+            else participants.get(message_data["conversation_id"], [])
+            for index, message_data in enumerate(batch)
+        ]
     
     @staticmethod
-    async def get_conversation_messages(conversation_id: str, skip: int = 0, limit: int = 50) -> List[MessageResponse]:
-        """Get messages from a conversation with pagination"""
-        chat_messages_collection = await get_chat_messages_collection()
+    def _last_message_update(message_data: dict) -> dict:
+        """Update setting the conversation's last message fields"""
+        return {
+            "$set": {
+                "last_message": message_data["message"],
+                "last_message_time": message_data["timestamp"],
+                "last_message_sender": message_data["sender_email"],
+                "last_message_id": message_data["_id"],
+                "updated_at": datetime.utcnow()
+            }
+        }
+    
+    @staticmethod
+    async def get_conversation_messages(conversation_id: str, skip: int = 0, limit: int = 50,
+                                        before: Optional[str] = None,
+                                        after: Optional[str] = None) -> List[MessageResponse]:
+        """Get messages from a conversation with pagination.
         
-        cursor = chat_messages_collection.find(
-            {"conversation_id": conversation_id}
-        ).sort("timestamp", -1).skip(skip).limit(limit)
+        `before`/`after` are keyset cursors (see pagination.py); when one is given
+        `skip` is ignored and the page is read with an index range scan.
+        Messages are ordered by (timestamp, _id) so equal timestamps stay stable.
+        """
+        messages = await ChatService._fetch_message_page(conversation_id, skip, limit, before, after)
+        return [MessageResponse(**message_to_dict(message)) for message in messages]
+    
+    @staticmethod
+    async def get_conversation_messages_raw(conversation_id: str, skip: int = 0, limit: int = 50,
+                                            before: Optional[str] = None,
+                                            after: Optional[str] = None) -> List[dict]:
+        """Same page as get_conversation_messages, as plain dicts for FastJSONResponse"""
+        messages = await ChatService._fetch_message_page(conversation_id, skip, limit, before, after)
+        return [message_to_dict(message) for message in messages]
+    
+    @staticmethod
+    async def _fetch_message_page(conversation_id: str, skip: int, limit: int,
+                                  before: Optional[str], after: Optional[str]) -> List[dict]:
+        """Raw message documents of one history page, in chronological order"""
+        if _message_archive is not None:
+            return await _message_archive.read_through(_message_store, conversation_id, skip, limit, before, after)
+        return await _message_store.page(conversation_id, skip, limit, before, after)
+    
+    @staticmethod
+    async def export_messages(conversation_id: str) -> AsyncIterator[dict]:
+        """Every message of a conversation as a MessageResponse dict, oldest
+        first: archived history, then the message store from one cursor read
+        EXPORT_BATCH_SIZE documents at a time"""
+        last = None
+        if _message_archive is not None:
+            async for message in _message_archive.stream(conversation_id):
+                last = (message["timestamp"], message["_id"])
+                yield message_to_dict(message)
+        async for message in _message_store.stream(conversation_id, after=last, batch_size=settings.EXPORT_BATCH_SIZE):
+            yield message_to_dict(message)
+    
+    @staticmethod
+    async def is_participant(conversation_id: str, user_email: str) -> bool:
+        return await ChatService.get_member_conversation_type(conversation_id, user_email) is not None
+    
+    @staticmethod
+    async def get_member_conversation_type(conversation_id: str, user_email: str) -> Optional[str]:
+        """"direct" or "group" if the user is in the conversation, else None"""
+        key = (conversation_id, user_email)
+        conversation_type = _membership_cache.get(key)
+        if conversation_type is not None:
+            return conversation_type
+        if not ObjectId.is_valid(conversation_id):
+            return None
         
-        messages = []
-        async for message in cursor:
-            messages.append(MessageResponse(
-                id=str(message["_id"]),
-                conversation_id=message["conversation_id"],
-                sender_email=message["sender_email"],
-                sender_name=message["sender_name"],
-                message=message["message"],
-                timestamp=message["timestamp"],
-                message_type=message["message_type"],
-                edited=message.get("edited", False),
-                reply_to=message.get("reply_to")
-            ))
+        conversations_collection = await get_conversations_collection()
+        conversation = await conversations_collection.find_one(
+            {"_id": ObjectId(conversation_id)},
+            {"conversation_type": 1, "participants": 1}
+        )
+        if conversation is None:
+            return None
+        if conversation.get("conversation_type") == "group":
+            members_collection = await get_conversation_members_collection()
+            member = await members_collection.find_one(
+                {"conversation_id": conversation_id, "user_email": user_email},
+                {"_id": 1}
+            )
+            conversation_type = "group" if member else None
+        else:
+            conversation_type = "direct" if user_email in conversation.get("participants", []) else None
+        if conversation_type is not None:
+            _membership_cache.set(key, conversation_type)
+        return conversation_type
+    
+    @staticmethod
+    async def search_messages(user_email: str, query: str, conversation_id: Optional[str] = None,
+                              start: Optional[datetime] = None, end: Optional[datetime] = None,
+                              cursor: Optional[str] = None, limit: int = 20) -> List[MessageSearchHit]:
+        """Full-text search over the messages of the user's conversations.
         
-        return list(reversed(messages))  # Return in chronological order
+        Each conversation is searched through the (conversation_id, text)
+        index of the message store, so the cost grows with the conversations
+        searched rather than with the whole collection. Hits are ranked by
+        text score, then newest first; `cursor` (a search cursor of the last
+        hit) continues after it. Every query is bounded by SEARCH_MAX_TIME_MS
+        (pymongo raises ExecutionTimeout beyond it). Raises ValueError for a
+        malformed cursor.
+        """
+        after = decode_search_cursor(cursor) if cursor else None
+        if conversation_id is not None:
+            if await ChatService.get_member_conversation_type(conversation_id, user_email) is None:
+                return []
+            conversation_ids = [conversation_id]
+        else:
+            conversation_ids = await ChatService.get_user_conversation_ids(
+                user_email, limit=settings.SEARCH_MAX_CONVERSATIONS
+            )
+        if not conversation_ids:
+            return []
+        
+        messages = await _message_store.search(conversation_ids, query, start, end, after, limit)
+        return [MessageSearchHit(**message_to_dict(message), score=message["score"]) for message in messages]
     
     @staticmethod
     async def get_user_conversations(user_email: str) -> List[ConversationResponse]:
         """Get all conversations for a user"""
+        conversations = await ChatService._fetch_user_conversations(user_email)
+        unread_counts = await ChatService._unread_counts(user_email, conversations)
+        return [
+            ConversationResponse(**conversation_to_dict(conv, unread_count))
+            for conv, unread_count in zip(conversations, unread_counts)
+        ]
+    
+    @staticmethod
+    async def get_user_conversations_raw(user_email: str) -> List[dict]:
+        """Same as get_user_conversations, as plain dicts for FastJSONResponse"""
+        conversations = await ChatService._fetch_user_conversations(user_email)
+        unread_counts = await ChatService._unread_counts(user_email, conversations)
+        return [
+            conversation_to_dict(conv, unread_count)
+            for conv, unread_count in zip(conversations, unread_counts)
+        ]
+    
+    @staticmethod
+    async def _fetch_user_conversations(user_email: str, projection: dict = CONVERSATION_PROJECTION,
+                                        limit: int = 0) -> List[dict]:
+        """Direct conversations and groups of the user, most recently active first"""
         conversations_collection = await get_conversations_collection()
         
         cursor = conversations_collection.find(
-            {"participants": user_email}
-        ).sort("last_message_time", -1)
+            {"participants": user_email},
+            projection
+        ).sort("last_message_time", -1).limit(limit)
+        conversations = await cursor.to_list(length=None)
+        
+        group_ids = await ChatService.get_user_group_ids(user_email)
+        if not group_ids:
+            return conversations
+        # A user is in few groups, so they are sorted here rather than by an index
+        cursor = conversations_collection.find(
+            {"_id": {"$in": [ObjectId(group_id) for group_id in group_ids]}},
+            {**projection, "last_message_time": 1}
+        )
+        conversations += await cursor.to_list(length=None)
+        conversations.sort(
+            key=lambda conv: (conv.get("last_message_time") is not None, conv.get("last_message_time") or datetime.min),
+            reverse=True
+        )
+        return conversations[:limit] if limit else conversations
+    
+    @staticmethod
+    async def get_user_group_ids(user_email: str) -> List[str]:
+        """Ids of the group conversations the user is a member of"""
+        members_collection = await get_conversation_members_collection()
+        cursor = members_collection.find({"user_email": user_email}, {"_id": 0, "conversation_id": 1})
+        return [member["conversation_id"] async for member in cursor]
+    
+    @staticmethod
+    async def get_total_unread(user_email: str) -> dict:
+        """Unread messages across all of a user's conversations.
+        
+        Only conversations whose last message is past the user's watermark
+        are counted, and those counts are usually served from the cache.
+        """
+        conversations = await ChatService._fetch_user_conversations(
+            user_email, {"last_message_id": 1, "last_message_time": 1}
+        )
+        unread_counts = await ChatService._unread_counts(user_email, conversations)
+        return {
+            "total": sum(unread_counts),
+            "conversations": sum(1 for count in unread_counts if count)
+        }
+    
+    @staticmethod
+    async def _unread_counts(user_email: str, conversations: List[dict]) -> List[int]:
+        """Unread count of each conversation for the user, derived from their
+        read watermarks (capped at UNREAD_COUNT_CAP)"""
+        if not conversations:
+            return []
+        read_states_collection = await get_read_states_collection()
+        cursor = read_states_collection.find(
+            {"user_email": user_email, "conversation_id": {"$in": [str(conv["_id"]) for conv in conversations]}},
+            {"_id": 0, "conversation_id": 1, "last_read_at": 1, "last_read_message_id": 1}
+        )
+        watermarks = {state["conversation_id"]: state async for state in cursor}
+        
+        counts = [0] * len(conversations)
+        pending = []
+        for index, conv in enumerate(conversations):
+            if conv.get("last_message_time") is None:
+                continue
+            conversation_id = str(conv["_id"])
+            watermark = watermarks.get(conversation_id)
+            if watermark is not None and (
+                conv["last_message_time"], conv.get("last_message_id") or watermark["last_read_message_id"]
+            ) <= (watermark["last_read_at"], watermark["last_read_message_id"]):
+                continue  # Read up to the last message
+            
+            key = (
+                conversation_id, user_email,
+                conv.get("last_message_id") or conv["last_message_time"],
+                watermark["last_read_message_id"] if watermark else None
+            )
+            cached = _unread_cache.get(key)
+            if cached is not None:
+                counts[index] = cached
+            else:
+                pending.append((index, key, conversation_id, watermark))
+        
+        if pending:
+            results = await asyncio.gather(*[
+                ChatService._count_unread(conversation_id, user_email, watermark)
+                for _, _, conversation_id, watermark in pending
+            ])
+            for (index, key, _, _), count in zip(pending, results):
+                _unread_cache.set(key, count)
+                counts[index] = count
+        return counts
+    
+    @staticmethod
+    async def _count_unread(conversation_id: str, user_email: str, watermark: Optional[dict]) -> int:
+        """Count messages from others after the watermark (capped at UNREAD_COUNT_CAP)"""
+        return await _message_store.count_unread(conversation_id, user_email, watermark)
+    
+    @staticmethod
+    async def get_user_conversation_ids(user_email: str, limit: int = 0) -> List[str]:
+        """Get ids of a user's conversations (groups included), most recently
+        active first.
+        
+        The (participants, last_message_time) index serves the sort and only
+        `_id` is returned, so no ConversationResponse models are built.
+        """
+        conversations = await ChatService._fetch_user_conversations(user_email, {"_id": 1}, limit)
+        return [str(conv["_id"]) for conv in conversations]
+    
+    @staticmethod
+    async def get_user_contacts(user_email: str) -> List[str]:
+        """Get everyone who shares a direct conversation with the user (group
+        members are not contacts, so presence does not fan out to whole groups)"""
+        contacts = _contact_cache.get(user_email)
+        if contacts is not None:
+            return contacts
+        
+        conversations_collection = await get_conversations_collection()
+        participants = await conversations_collection.distinct("participants", {"participants": user_email})
+        contacts = [email for email in participants if email != user_email]
+        _contact_cache.set(user_email, contacts)
+        return contacts
+    
+    @staticmethod
+    async def mark_conversation_as_read(conversation_id: str, user_email: str) -> Optional[dict]:
+        """Mark all messages in a conversation as read for a user.
+        
+        Moves the user's read watermark to the conversation's last message;
+        the conversation document itself is not written. Returns the
+        watermark, or None if the user is not in the conversation or it has
+        no messages.
+        """
+        conversation_type = await ChatService.get_member_conversation_type(conversation_id, user_email)
+        if conversation_type is None:
+            return None
+        
+        conversations_collection = await get_conversations_collection()
+        read_states_collection = await get_read_states_collection()
+        
+        conversation = await conversations_collection.find_one(
+            {"_id": ObjectId(conversation_id)},
+            {"last_message_id": 1, "last_message_time": 1, "participants": 1}
+        )
+        if not conversation or conversation.get("last_message_time") is None:
+            return None
+        
+        last_message_id = conversation.get("last_message_id")
+        last_message_time = conversation["last_message_time"]
+        if last_message_id is None:
+            # Conversations last written before last_message_id was stored
+            latest = await _message_store.latest(conversation_id)
+            if latest is None:
+                return None
+            last_message_id, last_message_time = latest["_id"], latest["timestamp"]
+        
+        read_state = {
+            "last_read_message_id": last_message_id,
+            "last_read_at": last_message_time,
+            "updated_at": datetime.utcnow()
+        }
+        if conversation_type == "direct":
+            # Lets delta sync find both participants' watermarks by user
+            read_state["participants"] = conversation.get("participants", [])
+        try:
+            # Only ever move the watermark forward: an existing newer watermark
+            # does not match the filter and the upsert hits the unique index
+            await read_states_collection.update_one(
+                {
+                    "user_email": user_email,
+                    "conversation_id": conversation_id,
+                    "$or": [
+                        {"last_read_at": {"$lt": last_message_time}},
+                        {"last_read_at": last_message_time, "last_read_message_id": {"$lt": last_message_id}}
+                    ]
+                },
+                {"$set": read_state},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # Already read at or past this message
+        
+        return {
+            "conversation_id": conversation_id,
+            "conversation_type": conversation_type,
+            "user_email": user_email,
+            "last_read_message_id": str(last_message_id),
+            "last_read_at": last_message_time
+        }
+    
+    @staticmethod
+    async def get_read_receipts(conversation_id: str) -> List[ReadReceipt]:
+        """Read watermark of every participant who has read the conversation"""
+        read_states_collection = await get_read_states_collection()
+        
+        cursor = read_states_collection.find(
+            {"conversation_id": conversation_id},
+            {"_id": 0, "user_email": 1, "last_read_message_id": 1, "last_read_at": 1}
+        )
+        return [
+            ReadReceipt(
+                user_email=state["user_email"],
+                last_read_message_id=str(state["last_read_message_id"]),
+                last_read_at=state["last_read_at"]
+            )
+            async for state in cursor
+        ]
+    
+    @staticmethod
+    async def create_group(creator_email: str, name: str, members: List[str]) -> dict:
+        """Create a group conversation owned by the creator. Members are rows
+        of conversation_members, not a participants array, so groups of any
+        size cost one document per member. Returns the conversation dict."""
+        members = sorted(set(members) - {creator_email})
+        if len(members) > settings.GROUP_MAX_INITIAL_MEMBERS:
+            raise ValueError(f"At most {settings.GROUP_MAX_INITIAL_MEMBERS} members can be added at once")
+        conversations_collection = await get_conversations_collection()
+        members_collection = await get_conversation_members_collection()
+        
+        now = datetime.utcnow()
+        conversation = {
+            "conversation_type": "group",
+            "name": name,
+            "created_by": creator_email,
+            "created_at": now,
+            "updated_at": now,
+            "member_count": len(members) + 1
+        }
+        result = await conversations_collection.insert_one(conversation)
+        conversation["_id"] = result.inserted_id
+        conversation_id = str(result.inserted_id)
         
-        conversations = []
-        async for conv in cursor:
-            conversations.append(ConversationResponse(
-                conversation_id=str(conv["_id"]),
-                participants=conv["participants"],
-                last_message=conv.get("last_message"),
-                last_message_time=conv.get("last_message_time"),
-                last_message_sender=conv.get("last_message_sender"),
-                unread_count=conv.get("unread_count", {}).get(user_email, 0)
-            ))
+        rows = [{"conversation_id": conversation_id, "user_email": creator_email, "role": "owner", "joined_at": now}]
+        rows += [{"conversation_id": conversation_id, "user_email": email, "role": "member", "joined_at": now} for email in members]
+        for offset in range(0, len(rows), 1000):
+            await members_collection.insert_many(rows[offset:offset + 1000], ordered=False)
+        return conversation_to_dict(conversation)
+    
+    @staticmethod
+    async def join_group(conversation_id: str, user_email: str) -> Optional[bool]:
+        """Add the user to a group. Returns False if already a member and None
+        if there is no such group. The user's read watermark starts at the
+        group's last message, so earlier history does not count as unread."""
+        if not ObjectId.is_valid(conversation_id):
+            return None
+        conversations_collection = await get_conversations_collection()
+        members_collection = await get_conversation_members_collection()
         
-        return conversations
+        group = await conversations_collection.find_one(
+            {"_id": ObjectId(conversation_id), "conversation_type": "group"},
+            {"_id": 1}
+        )
+        if group is None:
+            return None
+        try:
+            await members_collection.insert_one({
+                "conversation_id": conversation_id,
+                "user_email": user_email,
+                "role": "member",
+                "joined_at": datetime.utcnow()
+            })
+        except DuplicateKeyError:
+            return False
+        await conversations_collection.update_one(
+            {"_id": group["_id"]},
+            {"$inc": {"member_count": 1}, "$set": {"updated_at": datetime.utcnow()}}
+        )
+        await ChatService.mark_conversation_as_read(conversation_id, user_email)
+        return True
     
     @staticmethod
-    async def mark_conversation_as_read(conversation_id: str, user_email: str):
-        """Mark all messages in a conversation as read for a user"""
+    async def leave_group(conversation_id: str, user_email: str) -> bool:
+        """Remove the user from a group. Returns False if not a member"""
+        if not ObjectId.is_valid(conversation_id):
+            return False
         conversations_collection = await get_conversations_collection()
+        members_collection = await get_conversation_members_collection()
+        read_states_collection = await get_read_states_collection()
         
+        result = await members_collection.delete_one({"conversation_id": conversation_id, "user_email": user_email})
+        if not result.deleted_count:
+            return False
+        _membership_cache.pop((conversation_id, user_email))
         await conversations_collection.update_one(
             {"_id": ObjectId(conversation_id)},
-            {"$set": {f"unread_count.{user_email}": 0}}
+            {"$inc": {"member_count": -1}, "$set": {"updated_at": datetime.utcnow()}}
         )
+        await read_states_collection.delete_one({"conversation_id": conversation_id, "user_email": user_email})
+        return True
+    
+    @staticmethod
+    async def get_group_members(conversation_id: str, skip: int = 0, limit: int = 100) -> List[GroupMember]:
+        """One page of a group's members, by email"""
+        members_collection = await get_conversation_members_collection()
+        cursor = members_collection.find(
+            {"conversation_id": conversation_id},
+            {"_id": 0, "user_email": 1, "role": 1, "joined_at": 1}
+        ).sort("user_email", 1).skip(skip).limit(limit)
+        return [GroupMember(**member) async for member in cursor]
+    
+    @staticmethod
+    async def sync(user_email: str, since: Optional[datetime]) -> dict:
+        """Everything that changed for the user after `since` (a decoded sync
+        token): changed conversations, their new messages and read state
+        changes, as plain dicts.
+        
+        Replies with `reset` (and a fresh token) instead when there is no
+        token, it is older than SYNC_TOKEN_MAX_AGE_SECONDS or more changed than
+        one reply may carry. A conversation with more new messages than
+        SYNC_MESSAGES_PER_CONVERSATION returns only its newest page and is
+        listed in `truncated`.
+        """
+        now = datetime.utcnow()
+        token = encode_sync_token(now - timedelta(seconds=settings.SYNC_OVERLAP_SECONDS))
+        reset = {"token": token, "reset": True, "conversations": [], "messages": [], "read_states": [], "truncated": []}
+        if since is None or since < now - timedelta(seconds=settings.SYNC_TOKEN_MAX_AGE_SECONDS):
+            return reset
+        
+        conversations_collection = await get_conversations_collection()
+        read_states_collection = await get_read_states_collection()
+        
+        cursor = conversations_collection.find(
+            {"participants": user_email, "updated_at": {"$gt": since}},
+            CONVERSATION_PROJECTION
+        ).sort("updated_at", 1).limit(settings.SYNC_MAX_CONVERSATIONS + 1)
+        conversations = await cursor.to_list(length=None)
+        group_ids = await ChatService.get_user_group_ids(user_email)
+        if group_ids:
+            cursor = conversations_collection.find(
+                {"_id": {"$in": [ObjectId(group_id) for group_id in group_ids]}, "updated_at": {"$gt": since}},
+                CONVERSATION_PROJECTION
+            ).limit(settings.SYNC_MAX_CONVERSATIONS + 1)
+            conversations += await cursor.to_list(length=None)
+        if len(conversations) > settings.SYNC_MAX_CONVERSATIONS:
+            return reset
+        
+        # Everyone's watermarks in direct conversations (which carry their
+        # participants), only the user's own in groups (receipts of thousands
+        # of members are not synced). Each branch is an index range of changes
+        cursor = read_states_collection.find(
+            {
+                "$or": [{"participants": user_email}, {"user_email": user_email}],
+                "updated_at": {"$gt": since}
+            },
+            {"_id": 0, "conversation_id": 1, "user_email": 1, "last_read_message_id": 1, "last_read_at": 1}
+        ).limit(settings.SYNC_MAX_READ_STATES + 1)
+        read_states = await cursor.to_list(length=None)
+        if len(read_states) > settings.SYNC_MAX_READ_STATES:
+            return reset
+        
+        # Messages at or after the token time: the page after a cursor with
+        # the smallest possible id, one extra message to detect a longer gap
+        after = encode_cursor(since, ObjectId("0" * 24))
+        limit = settings.SYNC_MESSAGES_PER_CONVERSATION
+        changed = [
+            str(conv["_id"]) for conv in conversations
+            if conv.get("last_message_time") is not None and conv["last_message_time"] >= since
+        ]
+        pages = await asyncio.gather(*[
+            ChatService._fetch_message_page(conversation_id, 0, limit + 1, None, after)
+            for conversation_id in changed
+        ])
+        messages, truncated = [], []
+        for conversation_id, page in zip(changed, pages):
+            if len(page) > limit:
+                truncated.append(conversation_id)
+                page = await ChatService._fetch_message_page(conversation_id, 0, limit, None, None)
+            messages.extend(message_to_dict(message) for message in page)
+        
+        unread_counts = await ChatService._unread_counts(user_email, conversations)
+        return {
+            "token": token,
+            "reset": False,
+            "conversations": [
+                conversation_to_dict(conv, unread_count)
+                for conv, unread_count in zip(conversations, unread_counts)
+            ],
+            "messages": messages,
+            "read_states": [
+                {
+                    "conversation_id": state["conversation_id"],
+                    "user_email": state["user_email"],
+                    "last_read_message_id": str(state["last_read_message_id"]),
+                    "last_read_at": state["last_read_at"]
+                }
+                for state in read_states
+            ],
+            "truncated": truncated
+        }
     
     @staticmethod
     async def update_user_online_status(email: str, is_online: bool, socket_id: Optional[str] = None):
@@ -167,13 +779,24 @@ class ChatService:
         
         await users_collection.update_one(
             {"email": email},
-            {"$set": update_data},
+            {
+                "$set": update_data,
+                # A user first seen here has no name yet but is searchable by email
+                "$setOnInsert": {"search_keys": ChatService.user_search_keys(email, "")}
+            },
             upsert=True
         )
+        # Presence changes on every connect and disconnect, so the cached
+        # profile is patched rather than dropped
+        _user_cache.update(email, lambda user: user.model_copy(update=update_data))
     
     @staticmethod
     async def get_user_by_email(email: str) -> Optional[User]:
         """Get user by email"""
+        user = _user_cache.get(email)
+        if user is not None:
+            return user
+        
         users_collection = await get_users_collection()
         user_data = await users_collection.find_one({"email": email})
         
@@ -181,7 +804,9 @@ class ChatService:
             # Convert ObjectId to string for Pydantic v2 compatibility
             if "_id" in user_data and isinstance(user_data["_id"], ObjectId):
                 user_data["_id"] = str(user_data["_id"])
-            return User(**user_data)
+            user = User(**user_data)
+            _user_cache.set(email, user)
+            return user
         return None
     
     @staticmethod
@@ -195,10 +820,13 @@ class ChatService:
             "profile_image": profile_image,
             "is_online": False,
             "last_seen": None,
-            "socket_id": None
+            "socket_id": None,
+            "search_keys": ChatService.user_search_keys(email, name)
         }
         
         result = await users_collection.insert_one(user_data)
+        # A new user can match any cached search
+        _user_search_cache.clear()
         
         user = User(
             id=str(result.inserted_id),
@@ -207,5 +835,105 @@ class ChatService:
             profile_image=profile_image,
             is_online=False
         )
+        # The first connect right after login reads the new profile
+        _user_cache.set(email, user)
+        
+        return user 
+    
+    @staticmethod
+    def user_search_keys(email: str, name: str) -> List[str]:
+        """Normalized lowercase keys a user can be found by with a prefix query:
+        the email, its local part, the full name and each word of the name"""
+        email = email.lower().strip()
+        name = " ".join((name or "").lower().split())
+        keys = {email, email.split("@")[0]}
+        if name:
+            keys.add(name)
+            keys.update(name.split(" "))
+        return sorted(key for key in keys if key)
+    
+    @staticmethod
+    async def search_users(query: str, exclude_email: Optional[str] = None, limit: int = 10) -> List[dict]:
+        """Autocomplete users by prefix of their email, name or a name word.
         
-        return user 
\ No newline at end of file
+        Every query is an index range scan: exact keys on the lowercase
+        multikey `search_keys` index, then email prefixes on the `email`
+        index, then any key prefix. Each fetches at most
+        USER_SEARCH_CANDIDATES, so exact and email-prefix matches are never
+        crowded out by name matches of a short prefix. Hits are ranked exact
+        email, email prefix, name prefix, then name-word prefix, and cached
+        for a few seconds.
+        """
+        prefix = " ".join(query.lower().split())
+        if not prefix:
+            return []
+        
+        ranked = _user_search_cache.get(prefix)
+        if ranked is None:
+            users_collection = await get_users_collection()
+            pattern = f"^{re.escape(prefix)}"
+            candidates = {}
+            for query_filter in (
+                {"search_keys": prefix},
+                {"email": {"$regex": pattern}},
+                {"search_keys": {"$regex": pattern}}
+            ):
+                cursor = users_collection.find(query_filter, USER_SEARCH_PROJECTION).limit(USER_SEARCH_CANDIDATES)
+                async for user in cursor:
+                    candidates.setdefault(user["email"], user)
+            
+            def rank(user):
+                email = user["email"].lower()
+                name = (user.get("name") or "").lower()
+                if email == prefix:
+                    return (0, name)
+                if email.startswith(prefix):
+                    return (1, name)
+                if name.startswith(prefix):
+                    return (2, name)
+                return (3, name)
+            
+            ranked = sorted(candidates.values(), key=rank)
+            _user_search_cache.set(prefix, ranked)
+        
+        users = []
+        for user in ranked:
+            if user["email"] == exclude_email:
+                continue
+            users.append({
+                "email": user["email"],
+                "name": user.get("name"),
+                "profile_image": user.get("profile_image"),
+                "is_online": user.get("is_online", False)
+            })
+            if len(users) >= limit:
+                break
+        return users
+    
+    @staticmethod
+    def get_cache_stats() -> dict:
+        """Hit/miss counters of the in-process caches"""
+        return {
+            "users": _user_cache.stats(),
+            "contacts": _contact_cache.stats(),
+            "user_search": _user_search_cache.stats(),
+            "direct_conversations": _direct_conversation_cache.stats(),
+            "memberships": _membership_cache.stats(),
+            "unread_counts": _unread_cache.stats()
+        }
+    
+    @staticmethod
+    async def flush_message_batches():
+        """Write any queued messages (called on shutdown)"""
+        if _message_batcher is not None:
+            await _message_batcher.stop()
+
+if settings.METRICS_ENABLED:
+    metrics.instrument_static_methods(ChatService)
+
+# Optional write-behind batching of message writes (see message_batcher.py)
+_message_batcher = WriteBehindBatcher(
+    ChatService._write_message_batch,
+    max_batch_size=settings.MESSAGE_BATCH_MAX_SIZE,
+    max_delay_ms=settings.MESSAGE_BATCH_MAX_DELAY_MS
+) if settings.MESSAGE_BATCH_ENABLED else None
@@ -10,5 +10,115 @@ class Settings:
     JWT_ALGORITHM: str = os.getenv("JWT_ALGORITHM", "HS256")
     JWT_EXPIRE_MINUTES: int = int(os.getenv("JWT_EXPIRE_MINUTES", "1440"))
     CORS_ORIGINS: list = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
+    # Users allowed on admin endpoints (comma-separated emails; empty = nobody)
+    ADMIN_EMAILS: list = [email.strip() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()]
+    # Inter-worker Socket.IO bus: "", redis://..., unix:///path or tcp://host:port
+    SOCKETIO_MESSAGE_QUEUE: str = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+    # Presence backend: "local" or "mongo" (defaults to mongo when a message queue is set)
+    PRESENCE_BACKEND: str = os.getenv("PRESENCE_BACKEND", "")
+    PRESENCE_TTL_SECONDS: int = int(os.getenv("PRESENCE_TTL_SECONDS", "90"))
+    # Presence diffs are sent to contacts once per flush; going offline is only
+    # announced after the user stayed offline for PRESENCE_DEBOUNCE_SECONDS
+    PRESENCE_FLUSH_INTERVAL_MS: float = float(os.getenv("PRESENCE_FLUSH_INTERVAL_MS", "1000"))
+    PRESENCE_DEBOUNCE_SECONDS: float = float(os.getenv("PRESENCE_DEBOUNCE_SECONDS", "5"))
+    # Most emails one get_online_users request may ask about
+    ONLINE_USERS_MAX_EMAILS: int = int(os.getenv("ONLINE_USERS_MAX_EMAILS", "500"))
+    # Max direct conversations kept in the pair -> conversation id cache
+    CONVERSATION_CACHE_SIZE: int = int(os.getenv("CONVERSATION_CACHE_SIZE", "50000"))
+    # User profile cache used by get_user_by_email
+    USER_CACHE_SIZE: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    USER_CACHE_TTL_SECONDS: int = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+    # Write-behind batching of message inserts: a batch is written when it
+    # reaches MAX_SIZE messages or MAX_DELAY_MS after its first message
+    MESSAGE_BATCH_ENABLED: bool = os.getenv("MESSAGE_BATCH_ENABLED", "false").lower() == "true"
+    MESSAGE_BATCH_MAX_SIZE: int = int(os.getenv("MESSAGE_BATCH_MAX_SIZE", "100"))
+    MESSAGE_BATCH_MAX_DELAY_MS: float = float(os.getenv("MESSAGE_BATCH_MAX_DELAY_MS", "5"))
+    # Message layout: "flat" (one chat_messages document per message) or
+    # "bucketed" (chat_message_buckets of up to BUCKET_SIZE messages spanning
+    # at most BUCKET_SPAN_SECONDS, see message_store.py)
+    MESSAGE_STORAGE: str = os.getenv("MESSAGE_STORAGE", "flat")
+    MESSAGE_BUCKET_SIZE: int = int(os.getenv("MESSAGE_BUCKET_SIZE", "200"))
+    MESSAGE_BUCKET_SPAN_SECONDS: float = float(os.getenv("MESSAGE_BUCKET_SPAN_SECONDS", "86400"))
+    # Messages older than ARCHIVE_AFTER_DAYS are moved by `python message_archive.py run`
+    # into zlib-compressed blobs of up to BLOB_MESSAGES messages (0 = no archive)
+    MESSAGE_ARCHIVE_AFTER_DAYS: float = float(os.getenv("MESSAGE_ARCHIVE_AFTER_DAYS", "0"))
+    MESSAGE_ARCHIVE_BLOB_MESSAGES: int = int(os.getenv("MESSAGE_ARCHIVE_BLOB_MESSAGES", "1000"))
+    MESSAGE_ARCHIVE_COMPRESSION_LEVEL: int = int(os.getenv("MESSAGE_ARCHIVE_COMPRESSION_LEVEL", "6"))
+    # Delta sync (GET /sync): tokens older than MAX_AGE get a full-reload reply;
+    # each token is backdated by OVERLAP to cover writes still in flight
+    # (keep it above MESSAGE_BATCH_MAX_DELAY_MS), so clients may see a change twice
+    SYNC_TOKEN_MAX_AGE_SECONDS: int = int(os.getenv("SYNC_TOKEN_MAX_AGE_SECONDS", "604800"))
+    SYNC_OVERLAP_SECONDS: float = float(os.getenv("SYNC_OVERLAP_SECONDS", "5"))
+    # Bounds of one sync reply: more changed conversations or read states than
+    # this means a full reload; longer message gaps return the newest page only
+    SYNC_MAX_CONVERSATIONS: int = int(os.getenv("SYNC_MAX_CONVERSATIONS", "200"))
+    SYNC_MAX_READ_STATES: int = int(os.getenv("SYNC_MAX_READ_STATES", "1000"))
+    SYNC_MESSAGES_PER_CONVERSATION: int = int(os.getenv("SYNC_MESSAGES_PER_CONVERSATION", "50"))
+    # Conversation exports: Mongo cursor batch size and bytes per streamed chunk
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    EXPORT_CHUNK_BYTES: int = int(os.getenv("EXPORT_CHUNK_BYTES", "65536"))
+    # Conversation rooms joined on connect (most recently active first, 0 = all)
+    CONNECT_ROOM_JOIN_LIMIT: int = int(os.getenv("CONNECT_ROOM_JOIN_LIMIT", "50"))
+    # Conversation events kept per worker for replay on reconnect (replay_buffer.py):
+    # at most MAX_EVENTS in total and MAX_EVENTS_PER_CONVERSATION per conversation
+    REPLAY_MAX_EVENTS: int = int(os.getenv("REPLAY_MAX_EVENTS", "50000"))
+    REPLAY_MAX_EVENTS_PER_CONVERSATION: int = int(os.getenv("REPLAY_MAX_EVENTS_PER_CONVERSATION", "200"))
+    # Group conversations: members given when creating one, and messages to a
+    # group room are sent as one new_messages event per EMIT_INTERVAL_MS tick
+    # (at most EMIT_MAX_BATCH messages per event)
+    GROUP_MAX_INITIAL_MEMBERS: int = int(os.getenv("GROUP_MAX_INITIAL_MEMBERS", "5000"))
+    GROUP_EMIT_INTERVAL_MS: float = float(os.getenv("GROUP_EMIT_INTERVAL_MS", "100"))
+    GROUP_EMIT_MAX_BATCH: int = int(os.getenv("GROUP_EMIT_MAX_BATCH", "50"))
+    # Typing indicators are flushed once per tick, at most MAX_EMITS_PER_ROOM per
+    # conversation per tick, and expire after TIMEOUT_SECONDS without a new start
+    TYPING_FLUSH_INTERVAL_MS: float = float(os.getenv("TYPING_FLUSH_INTERVAL_MS", "250"))
+    TYPING_TIMEOUT_SECONDS: float = float(os.getenv("TYPING_TIMEOUT_SECONDS", "5"))
+    TYPING_MAX_EMITS_PER_ROOM: int = int(os.getenv("TYPING_MAX_EMITS_PER_ROOM", "5"))
+    # Short-lived cache of /users/search results (autocomplete keystrokes)
+    USER_SEARCH_CACHE_SIZE: int = int(os.getenv("USER_SEARCH_CACHE_SIZE", "5000"))
+    USER_SEARCH_CACHE_TTL_SECONDS: int = int(os.getenv("USER_SEARCH_CACHE_TTL_SECONDS", "10"))
+    # Encode history/inbox responses straight from Mongo documents (serialization.py)
+    FAST_JSON_RESPONSES: bool = os.getenv("FAST_JSON_RESPONSES", "true").lower() == "true"
+    # Message search runs one text query per conversation, CONCURRENCY at a
+    # time, each limited to MAX_TIME_MS; searches without a conversation cover
+    # the user's MAX_CONVERSATIONS most recently active conversations
+    SEARCH_MAX_TIME_MS: int = int(os.getenv("SEARCH_MAX_TIME_MS", "2000"))
+    SEARCH_CONCURRENCY: int = int(os.getenv("SEARCH_CONCURRENCY", "8"))
+    SEARCH_MAX_CONVERSATIONS: int = int(os.getenv("SEARCH_MAX_CONVERSATIONS", "200"))
+    # Bucketed layout: best-matching buckets per conversation whose messages
+    # are ranked (the same set for every page)
+    SEARCH_BUCKET_CANDIDATES: int = int(os.getenv("SEARCH_BUCKET_CANDIDATES", "25"))
+    # Unread counts are derived from read watermarks; each count stops at CAP
+    # and is cached until a new message arrives or the watermark moves
+    UNREAD_COUNT_CAP: int = int(os.getenv("UNREAD_COUNT_CAP", "1000"))
+    UNREAD_CACHE_SIZE: int = int(os.getenv("UNREAD_CACHE_SIZE", "100000"))
+    # MongoDB connection pool (per worker and server) and timeouts; socket
+    # timeout 0 means none. WARMUP_CONNECTIONS are opened at startup
+    MONGO_MAX_POOL_SIZE: int = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+    MONGO_MIN_POOL_SIZE: int = int(os.getenv("MONGO_MIN_POOL_SIZE", "10"))
+    MONGO_MAX_IDLE_TIME_MS: int = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+    MONGO_WAIT_QUEUE_TIMEOUT_MS: int = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "2000"))
+    MONGO_CONNECT_TIMEOUT_MS: int = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+    MONGO_SERVER_SELECTION_TIMEOUT_MS: int = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+    MONGO_SOCKET_TIMEOUT_MS: int = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+    MONGO_POOL_WARMUP_CONNECTIONS: int = int(os.getenv("MONGO_POOL_WARMUP_CONNECTIONS", "10"))
+    # /health/ready fails when the ping takes longer than this or the pool is this full
+    READINESS_PING_TIMEOUT_MS: int = int(os.getenv("READINESS_PING_TIMEOUT_MS", "1000"))
+    READINESS_MAX_POOL_UTILIZATION: float = float(os.getenv("READINESS_MAX_POOL_UTILIZATION", "0.9"))
+    # Indexes (indexes.py) are built in the background by the first worker that
+    # starts with a new index spec; a build unfinished after STALE_SECONDS is retried
+    INDEX_BUILD_ON_STARTUP: bool = os.getenv("INDEX_BUILD_ON_STARTUP", "true").lower() == "true"
+    INDEX_BUILD_STALE_SECONDS: int = int(os.getenv("INDEX_BUILD_STALE_SECONDS", "3600"))
+    # Prometheus metrics at /metrics (ChatService, socket handlers, emits, Mongo commands)
+    METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # Slow-query profiler (query_profiler.py): per-shape Mongo timings, slow
+    # commands above THRESHOLD_MS logged, the EXPLAIN_TOP slowest shapes explained
+    SLOW_QUERY_PROFILER_ENABLED: bool = os.getenv("SLOW_QUERY_PROFILER_ENABLED", "false").lower() == "true"
+    SLOW_QUERY_THRESHOLD_MS: float = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "100"))
+    SLOW_QUERY_MAX_SHAPES: int = int(os.getenv("SLOW_QUERY_MAX_SHAPES", "1000"))
+    SLOW_QUERY_SAMPLE_SIZE: int = int(os.getenv("SLOW_QUERY_SAMPLE_SIZE", "100"))
+    SLOW_QUERY_EXPLAIN: bool = os.getenv("SLOW_QUERY_EXPLAIN", "true").lower() == "true"
+    SLOW_QUERY_EXPLAIN_TOP: int = int(os.getenv("SLOW_QUERY_EXPLAIN_TOP", "5"))
+    SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS: float = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS", "600"))
 
 settings = Settings() 
\ No newline at end of file
@@ -1,7 +1,13 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import monitoring
 from config import settings
+from indexes import ensure_indexes
+from metrics import mongo_command_metrics
+from query_profiler import slow_query_profiler
 import asyncio
 import logging
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -11,6 +17,85 @@ class Database:
 
 db = Database()
 
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Tracks open, checked-out and waiting connections of each server's pool
+    (pymongo calls it from driver threads)"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+        self.checkout_failures = 0
+    
+    def _pool(self, address) -> dict:
+        pool = self._pools.get(address)
+        if pool is None:
+            pool = self._pools[address] = {"open": 0, "in_use": 0, "waiting": 0}
+        return pool
+    
+    def _add(self, address, field: str, delta: int):
+        with self._lock:
+            pool = self._pool(address)
+            pool[field] = max(pool[field] + delta, 0)
+    
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)
+    
+    def pool_ready(self, event):
+        pass
+    
+    def pool_cleared(self, event):
+        pass
+    
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(event.address, None)
+    
+    def connection_created(self, event):
+        self._add(event.address, "open", 1)
+    
+    def connection_ready(self, event):
+        pass
+    
+    def connection_closed(self, event):
+        self._add(event.address, "open", -1)
+    
+    def connection_check_out_started(self, event):
+        self._add(event.address, "waiting", 1)
+    
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["waiting"] = max(pool["waiting"] - 1, 0)
+            self.checkout_failures += 1
+    
+    def connection_checked_out(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            pool["waiting"] = max(pool["waiting"] - 1, 0)
+            pool["in_use"] += 1
+    
+    def connection_checked_in(self, event):
+        self._add(event.address, "in_use", -1)
+    
+    def stats(self) -> dict:
+        """Totals over all servers; utilization is that of the busiest pool"""
+        with self._lock:
+            pools = [dict(pool) for pool in self._pools.values()]
+            checkout_failures = self.checkout_failures
+        max_size = settings.MONGO_MAX_POOL_SIZE
+        busiest = max((pool["in_use"] for pool in pools), default=0)
+        return {
+            "max_pool_size": max_size,
+            "open": sum(pool["open"] for pool in pools),
+            "in_use": sum(pool["in_use"] for pool in pools),
+            "waiting": sum(pool["waiting"] for pool in pools),
+            "utilization": round(busiest / max_size, 4) if max_size else 0.0,
+            "checkout_failures": checkout_failures
+        }
+
+pool_monitor = PoolMonitor()
+
 async def get_database():
     return db.database
 
@@ -22,16 +107,35 @@ async def connect_to_mongo():
     for attempt in range(max_retries):
         try:
             logger.info(f"Attempting to connect to MongoDB (attempt {attempt + 1}/{max_retries})")
-            db.client = AsyncIOMotorClient(settings.MONGODB_URL)
+            event_listeners = [pool_monitor]
+            if settings.METRICS_ENABLED:
+                event_listeners.append(mongo_command_metrics)
+            if slow_query_profiler is not None:
+                event_listeners.append(slow_query_profiler)
+            db.client = AsyncIOMotorClient(
+                settings.MONGODB_URL,
+                maxPoolSize=settings.MONGO_MAX_POOL_SIZE,
+                minPoolSize=settings.MONGO_MIN_POOL_SIZE,
+                maxIdleTimeMS=settings.MONGO_MAX_IDLE_TIME_MS,
+                waitQueueTimeoutMS=settings.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+                connectTimeoutMS=settings.MONGO_CONNECT_TIMEOUT_MS,
+                serverSelectionTimeoutMS=settings.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                socketTimeoutMS=settings.MONGO_SOCKET_TIMEOUT_MS or None,
+                event_listeners=event_listeners
+            )
             db.database = db.client[settings.DATABASE_NAME]
             
             # Test the connection
             await db.client.admin.command('ping')
             
-            # Create indexes for better performance
-            await db.database.chat_messages.create_index([("conversation_id", 1), ("timestamp", -1)])
-            await db.database.conversations.create_index([("participants", 1)])
-            await db.database.conversations.create_index([("last_message_time", -1)])
+            if slow_query_profiler is not None:
+                slow_query_profiler.attach(db.client, asyncio.get_running_loop())
+            
+            # Indexes are built by the first worker that sees a new index spec
+            if settings.INDEX_BUILD_ON_STARTUP:
+                logger.info(f"Indexes: {await ensure_indexes(db.database)}")
+            
+            await warm_up_pool(settings.MONGO_POOL_WARMUP_CONNECTIONS)
             
             logger.info("Connected to MongoDB successfully")
             return
@@ -45,6 +149,50 @@ async def connect_to_mongo():
                 logger.error("All MongoDB connection attempts failed")
                 raise e
 
+async def warm_up_pool(connections: int):
+    """Open `connections` pooled connections up front with concurrent pings,
+    so the first requests after a deploy do not pay the connection handshake"""
+    if connections <= 0:
+        return
+    started = time.perf_counter()
+    await asyncio.gather(*(db.client.admin.command('ping') for _ in range(connections)))
+    logger.info(
+        f"MongoDB pool warmed up: {pool_monitor.stats()['open']} connections open "
+        f"in {(time.perf_counter() - started) * 1000:.0f} ms"
+    )
+
+async def check_readiness() -> dict:
+    """Ping MongoDB through the pool and report pool saturation.
+    
+    Not ready when the ping fails or times out (READINESS_PING_TIMEOUT_MS),
+    or when the busiest pool is at least READINESS_MAX_POOL_UTILIZATION in use.
+    """
+    pool = pool_monitor.stats()
+    result = {"ready": False, "mongo": {"ping_ms": None, "error": None}, "pool": pool}
+    if db.client is None:
+        result["mongo"]["error"] = "not connected"
+        return result
+    
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(
+            db.client.admin.command('ping'),
+            timeout=settings.READINESS_PING_TIMEOUT_MS / 1000
+        )
+        result["mongo"]["ping_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    except asyncio.TimeoutError:
+        result["mongo"]["error"] = f"ping timed out after {settings.READINESS_PING_TIMEOUT_MS} ms"
+        return result
+    except Exception as e:
+        result["mongo"]["error"] = type(e).__name__
+        return result
+    
+    if pool["utilization"] >= settings.READINESS_MAX_POOL_UTILIZATION:
+        result["mongo"]["error"] = f"connection pool {pool['utilization']:.0%} in use"
+        return result
+    result["ready"] = True
+    return result
+
 async def close_mongo_connection():
     """Close database connection"""
     if db.client:
@@ -56,10 +204,30 @@ async def get_chat_messages_collection():
     database = await get_database()
     return database.chat_messages
 
+async def get_message_buckets_collection():
+    database = await get_database()
+    return database.chat_message_buckets
+
+async def get_message_archive_collection():
+    database = await get_database()
+    return database.chat_message_archive
+
 async def get_conversations_collection():
     database = await get_database()
     return database.conversations
 
+async def get_conversation_members_collection():
+    database = await get_database()
+    return database.conversation_members
+
 async def get_users_collection():
     database = await get_database()
-    return database.users 
\ No newline at end of file
+    return database.users 
+
+async def get_presence_collection():
+    database = await get_database()
+    return database.presence
+
+async def get_read_states_collection():
+    database = await get_database()
+    return database.read_states
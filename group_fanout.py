@@ -0,0 +1,86 @@
+"""
+Batched delivery of new messages to group conversation rooms.
+
+A message to a group of N online members is N socket writes, so a busy
+study group with thousands of members would cost thousands of writes per
+message. The fan-out coalesces instead: messages sent to a group within one
+tick go out as a single `new_messages` event per room (split into events of
+at most `max_batch` messages), so each member gets one write per tick however
+many messages arrived.
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# emit(conversation_id, messages)
+EmitMessages = Callable[[str, List[dict]], Awaitable[None]]
+
+class GroupFanout:
+    def __init__(self, emit: EmitMessages, flush_interval_ms: float = 100, max_batch: int = 50):
+        self.emit = emit
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_batch = max_batch
+
+        self._pending: Dict[str, List[dict]] = {}  # conversation -> messages not sent yet
+        self._task: Optional[asyncio.Task] = None
+
+        self.metrics = {
+            "messages": 0,
+            "emits": 0,
+            "largest_batch": 0,
+            "emit_errors": 0,
+            "ticks": 0,
+        }
+
+    def add(self, conversation_id: str, message: dict):
+        self.metrics["messages"] += 1
+        self._pending.setdefault(conversation_id, []).append(message)
+        self._ensure_running()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        # Deliver what was accepted before shutting down
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Group fan-out flush error: {e}")
+            if not self._pending:
+                self._task = None
+                return
+
+    async def flush(self):
+        """Send every room its pending messages. A failed emit loses only its
+        own batch, the other rooms are still sent"""
+        self.metrics["ticks"] += 1
+        pending, self._pending = self._pending, {}
+        for conversation_id, messages in pending.items():
+            for offset in range(0, len(messages), self.max_batch):
+                batch = messages[offset:offset + self.max_batch]
+                try:
+                    await self.emit(conversation_id, batch)
+                except Exception as e:
+                    self.metrics["emit_errors"] += 1
+                    logger.error(f"Group fan-out of {len(batch)} messages to {conversation_id} failed: {e}")
+                    continue
+                self.metrics["emits"] += 1
+                self.metrics["largest_batch"] = max(self.metrics["largest_batch"], len(batch))
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "pending_rooms": len(self._pending),
+            "messages_per_emit": round(self.metrics["messages"] / self.metrics["emits"], 2) if self.metrics["emits"] else 0,
+        }
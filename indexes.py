@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+"""
+Declarative MongoDB index spec.
+
+INDEXES is the one list of indexes the chat queries rely on. connect_to_mongo
+calls ensure_indexes, which builds them once per version of the spec: the
+first worker that starts with a new spec hash claims the build in the
+schema_meta collection and runs it in the background, every other worker
+(and every later restart) only reads the marker.
+
+    python indexes.py build [--force]   # build now and wait (deploy step)
+    python indexes.py status            # missing / unexpected indexes
+    python indexes.py check             # explain every ChatService query shape
+
+`check` runs the ChatService queries, routes.search_users and the shared
+presence store against a throwaway database, once per message storage layout, explains every query
+shape they send and exits with status 1 if any of them uses a COLLSCAN or an
+in-memory SORT.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import socket
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError
+
+from config import settings
+from query_profiler import EXPLAINABLE_COMMANDS, command_namespace, command_shape, explain_command
+
+logger = logging.getLogger(__name__)
+
+class IndexSpec:
+    """One index: collection, key pattern and create_index options"""
+    __slots__ = ("collection", "keys", "options")
+
+    def __init__(self, collection: str, keys: list, **options):
+        self.collection = collection
+        self.keys = keys
+        self.options = options
+
+    @property
+    def name(self) -> str:
+        # Same default name the server gives an unnamed index
+        return self.options.get("name") or "_".join(f"{field}_{kind}" for field, kind in self.keys)
+
+    def to_dict(self) -> dict:
+        return {"collection": self.collection, "keys": [list(key) for key in self.keys], "options": self.options}
+
+INDEXES: List[IndexSpec] = [
+    # History pages and unread counts: keyset scans per conversation
+    IndexSpec("chat_messages", [("conversation_id", 1), ("timestamp", -1), ("_id", -1)]),
+    # Message search: one text query per conversation, so the equality prefix
+    # keeps each scan inside the conversation; English stop words are not indexed
+    IndexSpec("chat_messages", [("conversation_id", 1), ("message", "text")], default_language="english"),
+    # Bucketed layout (message_store.py): newest-first pages and unread
+    # counts walk buckets by end, oldest-first pages by start
+    IndexSpec("chat_message_buckets", [("conversation_id", 1), ("end", -1), ("start", -1)]),
+    IndexSpec("chat_message_buckets", [("conversation_id", 1), ("start", 1), ("end", 1)]),
+    # Bucket search re-matches words exactly, so no stemming here
+    IndexSpec("chat_message_buckets", [("conversation_id", 1), ("messages.message", "text")], default_language="none"),
+    # Compressed archive (message_archive.py), read like buckets
+    IndexSpec("chat_message_archive", [("conversation_id", 1), ("end", -1), ("start", -1)]),
+    IndexSpec("chat_message_archive", [("conversation_id", 1), ("start", 1), ("end", 1)]),
+    # Inbox, conversation ids and contacts of a user, most recent first
+    IndexSpec("conversations", [("participants", 1), ("last_message_time", -1)]),
+    IndexSpec("conversations", [("last_message_time", -1)]),
+    # Delta sync: a user's conversations changed since a token
+    IndexSpec("conversations", [("participants", 1), ("updated_at", 1)]),
+    # One direct conversation per pair of users
+    IndexSpec(
+        "conversations", [("pair_key", 1)],
+        unique=True, partialFilterExpression={"pair_key": {"$exists": True}}
+    ),
+    # Group membership: members of a group (paged by email), groups of a user
+    IndexSpec("conversation_members", [("conversation_id", 1), ("user_email", 1)], unique=True),
+    IndexSpec("conversation_members", [("user_email", 1), ("conversation_id", 1)]),
+    IndexSpec("users", [("email", 1)], unique=True),
+    IndexSpec("users", [("search_keys", 1)]),
+    IndexSpec("presence", [("sessions.host", 1)]),
+    IndexSpec("presence", [("sessions.seen", 1)]),
+    IndexSpec("read_states", [("user_email", 1), ("conversation_id", 1)], unique=True),
+    # Read receipts of a conversation
+    IndexSpec("read_states", [("conversation_id", 1), ("updated_at", 1)]),
+    # Delta sync: watermarks in a user's direct conversations, and the
+    # user's own, changed since a token
+    IndexSpec("read_states", [("participants", 1), ("updated_at", 1)]),
+    IndexSpec("read_states", [("user_email", 1), ("updated_at", 1)]),
+]
+
+# Indexes of the original schema (database.py / mongo-init.js before this
+# spec) that a longer index in INDEXES makes redundant, dropped before
+# building: (collection, index name)
+RETIRED_INDEXES = [
+    ("chat_messages", "conversation_id_1_timestamp_-1"),
+    ("conversations", "participants_1"),
+]
+
+# Marker document recording which spec version has been built
+META_COLLECTION = "schema_meta"
+META_ID = "indexes"
+
+_build_tasks = set()
+
+def spec_hash(specs: List[IndexSpec] = INDEXES) -> str:
+    payload = json.dumps([spec.to_dict() for spec in specs], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+async def build_indexes(database, specs: List[IndexSpec] = INDEXES) -> Dict[str, str]:
+    """Create every index in `specs` (existing ones are a no-op). Returns
+    {index: error} for the indexes that could not be built"""
+    errors = {}
+    for collection, name in RETIRED_INDEXES:
+        try:
+            if name in await database[collection].index_information():
+                await database[collection].drop_index(name)
+                logger.info(f"Dropped retired index {name} on {collection}")
+        except Exception as e:
+            errors[f"{collection}.{name}"] = str(e)
+            logger.error(f"Dropping retired index {name} on {collection} failed: {e}")
+    for spec in specs:
+        try:
+            # background only matters before MongoDB 4.2, later builds never block the collection
+            await database[spec.collection].create_index(spec.keys, background=True, **spec.options)
+        except Exception as e:
+            errors[f"{spec.collection}.{spec.name}"] = str(e)
+            logger.error(f"Building index {spec.name} on {spec.collection} failed: {e}")
+    return errors
+
+async def ensure_indexes(database, wait: bool = False, force: bool = False) -> str:
+    """Build INDEXES unless this version of the spec is already built or
+    another worker is building it (force skips both checks).
+
+    Returns "current", "building elsewhere", "started" (build running in a
+    background task) or, with wait=True, "built" / "failed".
+    """
+    version = spec_hash()
+    meta_collection = database[META_COLLECTION]
+    marker = await meta_collection.find_one({"_id": META_ID})
+    if not force and marker and marker.get("hash") == version and marker.get("state") == "ready":
+        return "current"
+
+    now = datetime.utcnow()
+    claim = {"_id": META_ID}
+    if not force:
+        # When the marker exists but does not match (same version, building
+        # and not stale) the upsert hits the unique _id
+        claim["$or"] = [
+            {"hash": {"$ne": version}},
+            {"state": "failed"},
+            {"state": "building", "started_at": {"$lt": now - timedelta(seconds=settings.INDEX_BUILD_STALE_SECONDS)}}
+        ]
+    try:
+        await meta_collection.update_one(
+            claim,
+            {"$set": {
+                "hash": version,
+                "state": "building",
+                "owner": f"{socket.gethostname()}:{os.getpid()}",
+                "started_at": now,
+                "errors": {}
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return "building elsewhere"
+
+    if wait:
+        return await _run_build(database, version)
+    task = asyncio.create_task(_run_build(database, version))
+    _build_tasks.add(task)
+    task.add_done_callback(_build_tasks.discard)
+    return "started"
+
+async def _run_build(database, version: str) -> str:
+    logger.info(f"Building {len(INDEXES)} indexes (spec {version})")
+    errors = await build_indexes(database)
+    state = "failed" if errors else "ready"
+    await database[META_COLLECTION].update_one(
+        {"_id": META_ID, "hash": version},
+        {"$set": {"state": state, "finished_at": datetime.utcnow(), "errors": errors}}
+    )
+    if errors:
+        logger.error(f"Index build (spec {version}) failed for {', '.join(errors)}")
+        return "failed"
+    logger.info(f"Indexes built (spec {version})")
+    return "built"
+
+async def index_drift(database) -> dict:
+    """Per collection: spec indexes that do not exist and existing indexes
+    that are not in the spec"""
+    expected: Dict[str, set] = {}
+    for spec in INDEXES:
+        expected.setdefault(spec.collection, set()).add(spec.name)
+    drift = {}
+    for collection, names in sorted(expected.items()):
+        existing = set(await database[collection].index_information()) - {"_id_"}
+        drift[collection] = {"missing": sorted(names - existing), "unexpected": sorted(existing - names)}
+    return drift
+
+class QueryRecorder(monitoring.CommandListener):
+    """Command listener keeping the first command of every query shape"""
+
+    def __init__(self):
+        self.commands: Dict[tuple, tuple] = {}
+
+    def started(self, event):
+        if event.command_name not in EXPLAINABLE_COMMANDS:
+            return
+        command = event.command
+        namespace = command_namespace(event.database_name, event.command_name, command)
+        shape = command_shape(event.command_name, command)
+        key = (event.command_name, namespace, json.dumps(shape, default=str))
+        self.commands.setdefault(key, (event.command_name, shape, command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+async def _exercise_queries():
+    """Call every ChatService method that queries Mongo, plus the
+    /users/search route and the presence store, on a small seeded data set"""
+    from chat_service import ChatService
+    from database import get_conversations_collection
+    from pagination import encode_cursor, encode_search_cursor
+    from presence import MongoPresenceStore
+    import routes
+
+    alice, bob, carol = "alice@example.com", "bob@example.com", "carol@example.com"
+    for email, name in ((alice, "Alice Adams"), (bob, "Bob Brown"), (carol, "Carol Clark")):
+        await ChatService.create_user(email, name)
+    await ChatService.get_user_by_email(alice)
+    await ChatService.update_user_online_status(alice, True, "sid-1")
+    await routes.search_users("bo", current_user=alice)
+
+    conversation_id = await ChatService.create_or_get_conversation(alice, bob)
+    # A direct conversation from before pair keys, found by participants
+    conversations_collection = await get_conversations_collection()
+    await conversations_collection.insert_one({
+        "participants": [bob, carol], "conversation_type": "direct", "created_at": datetime.utcnow()
+    })
+    await ChatService.create_or_get_conversation(bob, carol)
+
+    messages = []
+    for n in range(5):
+        messages.append(await ChatService.send_message(conversation_id, alice, "Alice Adams", f"exam notes {n}"))
+    await ChatService.send_message(conversation_id, bob, "Bob Brown", "thanks for the notes")
+    middle = messages[2]
+    cursor = encode_cursor(middle.timestamp, middle.id)
+    await ChatService.get_conversation_messages(conversation_id, skip=1, limit=2)
+    await ChatService.get_conversation_messages(conversation_id, limit=2, before=cursor)
+    await ChatService.get_conversation_messages_raw(conversation_id, limit=2, after=cursor)
+    hits = await ChatService.search_messages(bob, "notes", limit=1)
+    if hits:
+        await ChatService.search_messages(
+            bob, "notes", cursor=encode_search_cursor(hits[0].score, hits[0].timestamp, hits[0].id)
+        )
+    await ChatService.search_messages(
+        bob, "exam", conversation_id=conversation_id,
+        start=datetime.utcnow() - timedelta(days=1), end=datetime.utcnow()
+    )
+
+    await ChatService.get_user_conversations(bob)
+    await ChatService.get_user_conversations_raw(bob)
+    await ChatService.get_user_conversation_ids(bob, limit=10)
+    await ChatService.get_user_contacts(bob)
+    # Read states: watermark writes, unread counts, receipts and delta sync
+    # (by participants for direct conversations, by user for groups)
+    await ChatService.mark_conversation_as_read(conversation_id, bob)
+    await ChatService.send_message(conversation_id, alice, "Alice Adams", "one more")
+    await ChatService.get_total_unread(bob)
+    await ChatService.get_read_receipts(conversation_id)
+    await ChatService.sync(bob, datetime.utcnow() - timedelta(hours=1))
+
+    group = await ChatService.create_group(alice, "Study group", [bob])
+    group_id = group["conversation_id"]
+    await ChatService.join_group(group_id, carol)
+    await ChatService.get_member_conversation_type(group_id, carol)
+    await ChatService.send_message(group_id, carol, "Carol Clark", "hello group")
+    await ChatService.get_group_members(group_id, limit=10)
+    await ChatService.get_user_conversations(carol)
+    await ChatService.sync(carol, datetime.utcnow() - timedelta(hours=1))
+    await ChatService.leave_group(group_id, carol)
+
+    # Conversations written before last_message_id was stored
+    await conversations_collection.update_one(
+        {"_id": ObjectId(conversation_id)}, {"$unset": {"last_message_id": ""}}
+    )
+    await ChatService.mark_conversation_as_read(conversation_id, alice)
+
+    # Shared presence (presence.MongoPresenceStore): connect, lookups,
+    # heartbeat, expiry, disconnect and worker shutdown
+    store = MongoPresenceStore(host_id="index-check")
+    await store.add("sid-1", alice)
+    await store.add("sid-2", alice)
+    await store.is_online(alice)
+    await store.online_emails([alice, bob])
+    await store.sids(alice)
+    await store._refresh()
+    await store.remove("sid-2", alice)
+    await store.stop()
+
+    await ChatService._write_message_batch([
+        {
+            "_id": message_id, "conversation_id": conversation_id, "sender_email": bob,
+            "sender_name": "Bob Brown", "message": "batched", "timestamp": datetime.utcnow(),
+            "message_type": "text", "edited": False, "reply_to": None
+        }
+        for message_id in (ObjectId(), ObjectId())
+    ])
+
+async def check_query_plans(database_name: Optional[str] = None) -> List[dict]:
+    """Explain every query shape the chat service sends, with each message
+    storage layout, and return one result per shape; shapes with a COLLSCAN
+    or in-memory SORT carry a "problem" (text-score sorts are always in
+    memory and are allowed)"""
+    from motor.motor_asyncio import AsyncIOMotorClient
+    import chat_service
+    import database
+    from message_store import create_message_store
+
+    recorder = QueryRecorder()
+    settings.DATABASE_NAME = database_name or f"chat_index_check_{os.getpid()}"
+    database.db.client = AsyncIOMotorClient(settings.MONGODB_URL, event_listeners=[recorder])
+    database.db.database = database.db.client[settings.DATABASE_NAME]
+    message_store = chat_service._message_store
+    results = []
+    try:
+        for layout in ("flat", "bucketed"):
+            errors = await build_indexes(database.db.database)
+            if errors:
+                raise RuntimeError(f"Index build failed: {errors}")
+            chat_service._message_store = create_message_store(layout)
+            for cache in (
+                chat_service._direct_conversation_cache, chat_service._user_cache, chat_service._contact_cache,
+                chat_service._user_search_cache, chat_service._unread_cache
+            ):
+                cache.clear()  # Entries point at the previous pass' documents
+            recorder.commands.clear()
+            await _exercise_queries()
+
+            for key, (command_name, shape, command) in sorted(recorder.commands.items()):
+                if any(result["key"] == key for result in results):
+                    continue  # Same shape as with the other layout
+                summary = await explain_command(database.db.database, command_name, command)
+                problem = None
+                if summary["collscan"]:
+                    problem = "COLLSCAN"
+                elif summary["in_memory_sort"] and "$text" not in json.dumps(shape):
+                    problem = "in-memory SORT"
+                results.append({
+                    "key": key, "layout": layout, "command": command_name, "namespace": key[1],
+                    "shape": shape, "plan": summary["plan"], "problem": problem
+                })
+            await database.db.client.drop_database(settings.DATABASE_NAME)
+        return results
+    finally:
+        chat_service._message_store = message_store
+        await database.db.client.drop_database(settings.DATABASE_NAME)
+        database.db.client.close()
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description="Build or check the MongoDB indexes")
+    parser.add_argument("command", choices=["build", "status", "check"])
+    parser.add_argument("--force", action="store_true", help="build even if the spec is marked as built")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.command == "check":
+        results = await check_query_plans()
+        for result in results:
+            status = result["problem"] or "ok"
+            print(f"{status:<15} {result['layout']:<9} {result['command']:<14} {result['namespace']:<40} {result['plan']}")
+            print(f"{'':<25} {json.dumps(result['shape'], default=str)}")
+        problems = [result for result in results if result["problem"]]
+        print(f"{len(results)} query shapes, {len(problems)} without a suitable index")
+        return 1 if problems else 0
+
+    from database import connect_to_mongo, close_mongo_connection, db
+    settings.INDEX_BUILD_ON_STARTUP = False
+    await connect_to_mongo()
+    try:
+        if args.command == "status":
+            marker = await db.database[META_COLLECTION].find_one({"_id": META_ID}) or {}
+            print(json.dumps({
+                "spec": spec_hash(),
+                "built": marker.get("hash"),
+                "state": marker.get("state"),
+                "collections": await index_drift(db.database)
+            }, indent=2, default=str))
+            return 0
+        result = await ensure_indexes(db.database, wait=True, force=args.force)
+        logger.info(f"Indexes: {result}")
+        return 1 if result == "failed" else 0
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
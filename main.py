@@ -1,12 +1,17 @@
 import uvicorn
 import socketio
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, JSONResponse
 import logging
 
-from database import connect_to_mongo, close_mongo_connection
-from socket_handlers import SocketHandler
+from database import connect_to_mongo, close_mongo_connection, check_readiness, pool_monitor
+from socket_handlers import SocketHandler, presence_store, session_registry
+from chat_service import ChatService
+from worker_bus import create_client_manager
+from query_profiler import slow_query_profiler, REPORT_SORT_KEYS
 from config import settings
+import metrics
 import routes
 
 # Setup logging
@@ -14,8 +19,10 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Create Socket.IO server
-sio = socketio.AsyncServer(
+server_class = metrics.MeteredAsyncServer if settings.METRICS_ENABLED else socketio.AsyncServer
+sio = server_class(
     async_mode='asgi',
+    client_manager=create_client_manager(settings.SOCKETIO_MESSAGE_QUEUE),
     cors_allowed_origins=settings.CORS_ORIGINS,
     logger=True,
     engineio_logger=True
@@ -35,10 +42,42 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Initialize Socket.IO handlers
 socket_handler = SocketHandler(sio)
+# Routes that change room membership (leaving a group) reach it through app.state
+app.state.socket_handler = socket_handler
+
+def _room_counts() -> dict:
+    counts = {("conversation",): 0, ("user",): 0}
+    for room in sio.manager.rooms.get('/', {}):
+        if isinstance(room, str) and room.startswith(("conversation:", "user:")):
+            counts[(room.split(":", 1)[0],)] += 1
+    return counts
+
+def _cache_stat(field: str):
+    return lambda: {(name,): stats[field] for name, stats in ChatService.get_cache_stats().items()}
+
+# Gauges read when /metrics is scraped
+metrics.CallbackMetric("chat_socketio_sessions", "Connected Socket.IO sessions on this worker", "gauge", (),
+                       lambda: {(): session_registry.session_count()})
+metrics.CallbackMetric("chat_socketio_users", "Distinct users connected to this worker", "gauge", (),
+                       lambda: {(): session_registry.user_count()})
+metrics.CallbackMetric("chat_socketio_rooms", "Socket.IO rooms with local members", "gauge", ("kind",), _room_counts)
+metrics.CallbackMetric("chat_replay_buffer_events", "Conversation events buffered for replay", "gauge", (),
+                       lambda: {(): socket_handler.replay.stats()["events"]})
+metrics.CallbackMetric("chat_replay_buffer_evictions", "Events evicted from the replay buffer", "counter", (),
+                       lambda: {(): socket_handler.replay.metrics["evictions"]})
+metrics.CallbackMetric("chat_mongo_pool_connections", "MongoDB pool connections by state", "gauge", ("state",),
+                       lambda: {(state,): pool_monitor.stats()[state] for state in ("open", "in_use", "waiting")})
+metrics.CallbackMetric("chat_mongo_pool_checkout_failures", "MongoDB pool checkouts that failed or timed out", "counter", (),
+                       lambda: {(): pool_monitor.checkout_failures})
+metrics.CallbackMetric("chat_cache_hits", "In-process cache hits", "counter", ("cache",), _cache_stat("hits"))
+metrics.CallbackMetric("chat_cache_misses", "In-process cache misses", "counter", ("cache",), _cache_stat("misses"))
+metrics.CallbackMetric("chat_cache_hit_ratio", "In-process cache hit ratio", "gauge", ("cache",), _cache_stat("hit_ratio"))
+metrics.CallbackMetric("chat_cache_entries", "In-process cache entries", "gauge", ("cache",), _cache_stat("size"))
 
 # Include API routes
 app.include_router(routes.router, prefix="/api")
@@ -50,11 +89,17 @@ socket_app = socketio.ASGIApp(sio, other_asgi_app=app)
 async def startup_event():
     """Initialize database connection on startup"""
     await connect_to_mongo()
+    await presence_store.start()
     logger.info("Chat backend started successfully")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Close database connection on shutdown"""
+    await ChatService.flush_message_batches()
+    await socket_handler.typing.stop()
+    await socket_handler.group_fanout.stop()
+    await socket_handler.presence.stop()
+    await presence_store.stop()
     await close_mongo_connection()
     logger.info("Chat backend shutdown")
 
@@ -66,6 +111,60 @@ async def root():
 async def health_check():
     return {"status": "healthy", "service": "chat-backend"}
 
+@app.get("/health/live")
+async def liveness_check():
+    """The worker's event loop is responsive (does not touch MongoDB)"""
+    return {"status": "alive", "service": "chat-backend"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """503 unless MongoDB answers a ping in time and the pool has headroom"""
+    readiness = await check_readiness()
+    return JSONResponse(
+        {"status": "ready" if readiness["ready"] else "unavailable", **readiness},
+        status_code=200 if readiness["ready"] else 503
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus metrics of this worker"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/stats/slow-queries")
+async def slow_query_stats(limit: int = 20, sort: str = "total_ms", admin: str = Depends(routes.get_admin_user)):
+    """Top Mongo query shapes of this worker (needs SLOW_QUERY_PROFILER_ENABLED).
+    Admins only: the report holds query shapes, namespaces and plans"""
+    if slow_query_profiler is None:
+        raise HTTPException(status_code=404, detail="Slow-query profiler is disabled")
+    if sort not in REPORT_SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort must be one of {', '.join(REPORT_SORT_KEYS)}")
+    return slow_query_profiler.report(limit=min(max(limit, 1), 200), sort=sort)
+
+@app.get("/stats/caches")
+async def cache_stats(admin: str = Depends(routes.get_admin_user)):
+    """Hit/miss counters of this worker's in-process caches (admins only)"""
+    return ChatService.get_cache_stats()
+
+@app.get("/stats/presence")
+async def presence_stats(admin: str = Depends(routes.get_admin_user)):
+    """Presence broadcast counters for this worker (admins only)"""
+    return socket_handler.presence.stats()
+
+@app.get("/stats/replay")
+async def replay_stats(admin: str = Depends(routes.get_admin_user)):
+    """Replay buffer size, evictions and replays for this worker (admins only)"""
+    return socket_handler.replay.stats()
+
+@app.get("/stats/groups")
+async def group_fanout_stats(admin: str = Depends(routes.get_admin_user)):
+    """Batched group message delivery counters for this worker (admins only)"""
+    return socket_handler.group_fanout.stats()
+
+@app.get("/stats/typing")
+async def typing_stats(admin: str = Depends(routes.get_admin_user)):
+    """Typing indicator coalescing counters for this worker (admins only)"""
+    return socket_handler.typing.stats()
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:socket_app",
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Cold-tier archive for old message history.
+
+The tiering job moves messages older than MESSAGE_ARCHIVE_AFTER_DAYS out of
+the message store (flat or bucketed) into chat_message_archive, one document
+per conversation per time range holding up to MESSAGE_ARCHIVE_BLOB_MESSAGES
+messages as a zlib-compressed BSON blob:
+
+    {_id: "<conversation_id>:<first message id>", conversation_id, start, end,
+     count, codec: "zlib", data: <compressed {"messages": [...]}>}
+
+History pages read through to the archive only when they run past the oldest
+hot message (or start from a cursor older than the archive age), so pages of
+recent history cost nothing extra. Archived messages are not searchable and
+are not counted as unread.
+
+    python message_archive.py run      # archive everything older than the age
+    python message_archive.py stats    # hot vs archive size
+"""
+import argparse
+import asyncio
+import json
+import logging
+import zlib
+from datetime import datetime, timedelta
+from typing import AsyncIterator, List, Optional
+
+import bson
+
+from config import settings
+from database import get_conversations_collection, get_message_archive_collection
+from message_store import BUCKET_MESSAGE_FIELDS, read_bucket_page, stream_buckets
+from pagination import decode_cursor, encode_cursor
+
+logger = logging.getLogger(__name__)
+
+def encode_blob(conversation_id: str, messages: List[dict], level: int = 6) -> dict:
+    """Archive document for consecutive messages of one conversation (oldest first)"""
+    payload = {"messages": [{field: message.get(field) for field in BUCKET_MESSAGE_FIELDS} for message in messages]}
+    return {
+        "_id": f"{conversation_id}:{messages[0]['_id']}",
+        "conversation_id": conversation_id,
+        "start": messages[0]["timestamp"],
+        "end": messages[-1]["timestamp"],
+        "count": len(messages),
+        "codec": "zlib",
+        "data": bson.Binary(zlib.compress(bson.encode(payload), level)),
+        "archived_at": datetime.utcnow()
+    }
+
+def decode_blob(blob: dict) -> List[dict]:
+    payload = bson.decode(zlib.decompress(blob["data"]))
+    conversation_id = blob["conversation_id"]
+    return [dict(message, conversation_id=conversation_id) for message in payload["messages"]]
+
+class MessageArchive:
+    """Compressed archive of messages older than `after_days`"""
+
+    def __init__(self, after_days: float, blob_messages: int = 1000, compression_level: int = 6):
+        self.after = timedelta(days=after_days)
+        self.blob_messages = blob_messages
+        self.compression_level = compression_level
+
+    def boundary(self) -> datetime:
+        """Messages at or after this time are never archived"""
+        return datetime.utcnow() - self.after
+
+    async def archive_conversation(self, store, conversation_id: str, cutoff: datetime) -> int:
+        """Move the conversation's messages older than `cutoff` from `store`
+        into archive blobs. The blob is written before the messages are
+        removed, and its id is derived from its first message, so an
+        interrupted run can simply be repeated."""
+        archive_collection = await get_message_archive_collection()
+        archived = 0
+        while True:
+            messages = await store.older_than(conversation_id, cutoff, self.blob_messages)
+            if not messages:
+                return archived
+            blob = encode_blob(conversation_id, messages, self.compression_level)
+            await archive_collection.replace_one({"_id": blob["_id"]}, blob, upsert=True)
+            await store.remove(conversation_id, [message["_id"] for message in messages])
+            archived += len(messages)
+            if len(messages) < self.blob_messages:
+                return archived
+
+    async def run(self, store) -> dict:
+        """Archive every conversation's messages older than the archive age"""
+        conversations_collection = await get_conversations_collection()
+        cutoff = self.boundary()
+        conversations = messages = 0
+        async for conv in conversations_collection.find({}, {"_id": 1}).batch_size(1000):
+            count = await self.archive_conversation(store, str(conv["_id"]), cutoff)
+            if count:
+                conversations += 1
+                messages += count
+        return {"cutoff": cutoff, "conversations": conversations, "messages": messages}
+
+    async def read_through(self, store, conversation_id: str, skip: int, limit: int,
+                           before: Optional[str], after: Optional[str]) -> List[dict]:
+        """A history page from the hot store, continued into the archive when
+        it crosses the archive boundary (same arguments as store.page)"""
+        archive_collection = await get_message_archive_collection()
+
+        if after:
+            position = decode_cursor(after)
+            if position[0] >= self.boundary():
+                return await store.page(conversation_id, 0, limit, None, after)
+            archived = await read_bucket_page(
+                archive_collection, conversation_id, 0, limit, position, False, decode_blob
+            )
+            if len(archived) >= limit:
+                return archived
+            if archived:
+                after = encode_cursor(archived[-1]["timestamp"], archived[-1]["_id"])
+            return archived + await store.page(conversation_id, 0, limit - len(archived), None, after)
+
+        hot = await store.page(conversation_id, skip, limit, before, None)
+        if len(hot) >= limit:
+            return hot
+        # The page runs past the oldest hot message
+        if hot:
+            position, skip = (hot[0]["timestamp"], hot[0]["_id"]), 0
+        elif before:
+            position, skip = decode_cursor(before), 0
+        else:
+            position = None
+            if skip:
+                skip = max(0, skip - await store.count(conversation_id))
+        archived = await read_bucket_page(
+            archive_collection, conversation_id, skip, limit - len(hot), position, True, decode_blob
+        )
+        return archived + hot
+
+    async def stream(self, conversation_id: str) -> AsyncIterator[dict]:
+        """Every archived message of the conversation, oldest first, one
+        blob in memory at a time"""
+        archive_collection = await get_message_archive_collection()
+        cursor = archive_collection.find({"conversation_id": conversation_id}).sort([("start", 1)]).batch_size(2)
+        async for message in stream_buckets(cursor, unpack=decode_blob):
+            yield message
+
+    async def stats(self) -> dict:
+        archive_collection = await get_message_archive_collection()
+        cursor = archive_collection.aggregate([
+            {"$group": {"_id": None, "blobs": {"$sum": 1}, "messages": {"$sum": "$count"}}}
+        ])
+        result = await cursor.to_list(length=1)
+        return {"blobs": result[0]["blobs"], "messages": result[0]["messages"]} if result else {"blobs": 0, "messages": 0}
+
+def create_message_archive() -> Optional[MessageArchive]:
+    if settings.MESSAGE_ARCHIVE_AFTER_DAYS <= 0:
+        return None
+    return MessageArchive(
+        settings.MESSAGE_ARCHIVE_AFTER_DAYS,
+        blob_messages=settings.MESSAGE_ARCHIVE_BLOB_MESSAGES,
+        compression_level=settings.MESSAGE_ARCHIVE_COMPRESSION_LEVEL
+    )
+
+async def main():
+    parser = argparse.ArgumentParser(description="Move old messages to the compressed archive")
+    parser.add_argument("command", choices=["run", "stats"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    archive = create_message_archive()
+    if archive is None:
+        parser.error("set MESSAGE_ARCHIVE_AFTER_DAYS to enable the archive")
+
+    from database import connect_to_mongo, close_mongo_connection
+    from message_store import create_message_store
+
+    await connect_to_mongo()
+    try:
+        if args.command == "run":
+            result = await archive.run(create_message_store())
+        else:
+            result = await archive.stats()
+        print(json.dumps(result, indent=2, default=str))
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
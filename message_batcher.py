@@ -0,0 +1,104 @@
+"""
+Write-behind batching for message inserts.
+
+Callers submit a document and await its result; a single background writer
+collects submissions for up to `max_delay_ms` or `max_batch_size` documents
+and hands the whole batch to `write_batch` in one go. Only one batch is in
+flight at a time, so batches commit in submission order and new submissions
+accumulate while the previous batch is being written.
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# write_batch(items) must return one result per item; an Exception instance
+# in the result list fails only that item's awaitable
+WriteBatch = Callable[[List[Any]], Awaitable[List[Any]]]
+
+class WriteBehindBatcher:
+    def __init__(self, write_batch: WriteBatch, max_batch_size: int = 100, max_delay_ms: float = 5):
+        self.write_batch = write_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item: Any) -> Any:
+        """Queue an item and wait until the batch containing it commits"""
+        if self._worker is None or self._worker.done():
+            self._start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    def _start(self):
+        self._queue = asyncio.Queue()
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush whatever is queued and stop the writer"""
+        if self._worker is None:
+            return
+        self._queue.put_nowait(None)
+        await self._worker
+        self._worker = None
+
+    async def _collect(self) -> Tuple[List[Tuple[Any, asyncio.Future]], bool]:
+        entry = await self._queue.get()
+        if entry is None:
+            return [], True
+        batch = [entry]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            try:
+                entry = self._queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if entry is None:
+                return batch, True
+            batch.append(entry)
+        return batch, False
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            batch, stopping = await self._collect()
+            if batch:
+                await self._commit(batch)
+
+    async def _commit(self, batch: List[Tuple[Any, asyncio.Future]]):
+        items = [item for item, _ in batch]
+        try:
+            results = await self.write_batch(items)
+        except Exception as e:
+            logger.error(f"Batch write of {len(items)} items failed: {e}")
+            results = [e] * len(items)
+
+        self.batches += 1
+        self.items += len(items)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+            "queued": self._queue.qsize() if self._queue else 0,
+        }
@@ -0,0 +1,499 @@
+"""
+Message storage layouts for chat history.
+
+FlatMessageStore keeps one chat_messages document per message (the original
+layout). BucketedMessageStore packs each conversation's messages into
+chat_message_buckets documents of at most MESSAGE_BUCKET_SIZE messages
+spanning at most MESSAGE_BUCKET_SPAN_SECONDS:
+
+    {conversation_id, start, end, count, messages: [{_id, sender_email, ...}]}
+
+so a history page reads one or two documents and the indexes hold one entry
+per bucket instead of one per message. MESSAGE_STORAGE selects the layout;
+`python migrations.py bucket-messages` copies flat history into buckets.
+
+Both stores return flat message documents (with conversation_id), so
+serialization.message_to_dict works on either.
+"""
+import asyncio
+import heapq
+import itertools
+import re
+from datetime import datetime, timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from config import settings
+from database import get_chat_messages_collection, get_message_buckets_collection
+from pagination import decode_cursor, keyset_filter
+from serialization import MESSAGE_PROJECTION
+
+# Fields of a message kept inside a bucket (conversation_id lives on the bucket)
+BUCKET_MESSAGE_FIELDS = ("_id", "sender_email", "sender_name", "message", "timestamp", "message_type", "edited", "reply_to")
+
+class FlatMessageStore:
+    """One chat_messages document per message"""
+
+    async def insert(self, message: dict):
+        chat_messages_collection = await get_chat_messages_collection()
+        await chat_messages_collection.insert_one(message)
+
+    async def insert_many(self, messages: List[dict]) -> Dict[int, str]:
+        """Insert a batch; returns {index: error} for messages that failed"""
+        chat_messages_collection = await get_chat_messages_collection()
+        try:
+            await chat_messages_collection.insert_many(messages, ordered=False)
+        except BulkWriteError as e:
+            return {
+                error["index"]: error.get("errmsg", "Message insert failed")
+                for error in e.details.get("writeErrors", [])
+            }
+        return {}
+
+    async def page(self, conversation_id: str, skip: int, limit: int,
+                   before: Optional[str], after: Optional[str]) -> List[dict]:
+        """Message documents of one history page, in chronological order"""
+        chat_messages_collection = await get_chat_messages_collection()
+
+        query = {"conversation_id": conversation_id}
+        if after:
+            query.update(keyset_filter(after, "after"))
+            cursor = chat_messages_collection.find(query, MESSAGE_PROJECTION).sort(
+                [("timestamp", 1), ("_id", 1)]
+            ).limit(limit)
+        else:
+            if before:
+                query.update(keyset_filter(before, "before"))
+                skip = 0
+            cursor = chat_messages_collection.find(query, MESSAGE_PROJECTION).sort(
+                [("timestamp", -1), ("_id", -1)]
+            ).skip(skip).limit(limit)
+
+        messages = await cursor.to_list(length=limit)
+
+        if after:
+            return messages
+        messages.reverse()  # Return in chronological order
+        return messages
+
+    async def latest(self, conversation_id: str) -> Optional[dict]:
+        chat_messages_collection = await get_chat_messages_collection()
+        return await chat_messages_collection.find_one(
+            {"conversation_id": conversation_id},
+            {"timestamp": 1},
+            sort=[("timestamp", -1), ("_id", -1)]
+        )
+
+    async def count_unread(self, conversation_id: str, user_email: str, watermark: Optional[dict]) -> int:
+        """Count messages from others after the watermark with a range scan
+        of the (conversation_id, timestamp, _id) index"""
+        chat_messages_collection = await get_chat_messages_collection()
+
+        query = {"conversation_id": conversation_id, "sender_email": {"$ne": user_email}}
+        if watermark is not None:
+            query["$or"] = [
+                {"timestamp": {"$gt": watermark["last_read_at"]}},
+                {"timestamp": watermark["last_read_at"], "_id": {"$gt": watermark["last_read_message_id"]}}
+            ]
+        return await chat_messages_collection.count_documents(query, limit=settings.UNREAD_COUNT_CAP)
+
+    async def search(self, conversation_ids: List[str], query: str, start: Optional[datetime],
+                     end: Optional[datetime], after: Optional[tuple], limit: int) -> List[dict]:
+        """Text search hits (message documents with a "score") ranked by
+        (score, timestamp, _id), best first, strictly after the `after` hit"""
+        return await merge_search_hits(
+            lambda conversation_id: self._search_conversation(conversation_id, query, start, end, after, limit),
+            conversation_ids, limit
+        )
+
+    async def _search_conversation(self, conversation_id: str, query: str, start: Optional[datetime],
+                                   end: Optional[datetime], after: Optional[tuple], limit: int) -> List[dict]:
+        """One conversation's best hits; the (conversation_id, text) index
+        only scans the entries of this conversation"""
+        chat_messages_collection = await get_chat_messages_collection()
+
+        match = {"conversation_id": conversation_id, "$text": {"$search": query}}
+        if start or end:
+            match["timestamp"] = {}
+            if start:
+                match["timestamp"]["$gte"] = start
+            if end:
+                match["timestamp"]["$lte"] = end
+
+        pipeline = [{"$match": match}, {"$addFields": {"score": {"$meta": "textScore"}}}]
+        if after is not None:
+            score, timestamp, message_id = after
+            pipeline.append({"$match": {"$or": [
+                {"score": {"$lt": score}},
+                {"score": score, "timestamp": {"$lt": timestamp}},
+                {"score": score, "timestamp": timestamp, "_id": {"$lt": message_id}}
+            ]}})
+        pipeline += [
+            {"$sort": {"score": -1, "timestamp": -1, "_id": -1}},
+            {"$limit": limit}
+        ]
+        cursor = chat_messages_collection.aggregate(pipeline, maxTimeMS=settings.SEARCH_MAX_TIME_MS)
+        return await cursor.to_list(length=limit)
+
+    async def count(self, conversation_id: str) -> int:
+        chat_messages_collection = await get_chat_messages_collection()
+        return await chat_messages_collection.count_documents({"conversation_id": conversation_id})
+
+    async def older_than(self, conversation_id: str, cutoff: datetime, limit: int) -> List[dict]:
+        """The oldest `limit` messages sent before `cutoff`, oldest first"""
+        chat_messages_collection = await get_chat_messages_collection()
+        cursor = chat_messages_collection.find(
+            {"conversation_id": conversation_id, "timestamp": {"$lt": cutoff}}
+        ).sort([("timestamp", 1), ("_id", 1)]).limit(limit)
+        return await cursor.to_list(length=limit)
+
+    async def remove(self, conversation_id: str, message_ids: list):
+        chat_messages_collection = await get_chat_messages_collection()
+        await chat_messages_collection.delete_many(
+            {"conversation_id": conversation_id, "_id": {"$in": message_ids}}
+        )
+
+    async def stream(self, conversation_id: str, after: Optional[tuple] = None,
+                     batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Every message after the (timestamp, _id) `after`, oldest first,
+        fetched from one cursor `batch_size` documents at a time"""
+        chat_messages_collection = await get_chat_messages_collection()
+        query = {"conversation_id": conversation_id}
+        if after is not None:
+            query["$or"] = [
+                {"timestamp": {"$gt": after[0]}},
+                {"timestamp": after[0], "_id": {"$gt": after[1]}}
+            ]
+        cursor = chat_messages_collection.find(query, MESSAGE_PROJECTION).sort(
+            [("timestamp", 1), ("_id", 1)]
+        ).batch_size(batch_size)
+        async for message in cursor:
+            yield message
+
+def _message_key(message: dict) -> tuple:
+    return (message["timestamp"], message["_id"])
+
+def _search_key(message: dict) -> tuple:
+    return (message["score"], message["timestamp"], message["_id"])
+
+async def merge_search_hits(search_conversation: Callable[[str], Awaitable[List[dict]]],
+                            conversation_ids: List[str], limit: int) -> List[dict]:
+    """Search each conversation on its own (at most SEARCH_CONCURRENCY at a
+    time) and merge their hits, each list best first, into the best `limit`"""
+    semaphore = asyncio.Semaphore(settings.SEARCH_CONCURRENCY)
+
+    async def search_one(conversation_id: str) -> List[dict]:
+        async with semaphore:
+            return await search_conversation(conversation_id)
+
+    results = await asyncio.gather(*(search_one(conversation_id) for conversation_id in conversation_ids))
+    return list(itertools.islice(heapq.merge(*results, key=_search_key, reverse=True), limit))
+
+def _unpack(bucket: dict) -> List[dict]:
+    conversation_id = bucket["conversation_id"]
+    return [dict(entry, conversation_id=conversation_id) for entry in bucket["messages"]]
+
+def _search_terms(query: str):
+    """(words, phrases, excluded words) of a $text search string"""
+    phrases = [phrase.lower() for phrase in re.findall(r'"([^"]+)"', query)]
+    words, excluded = [], []
+    for token in re.sub(r'"[^"]*"', " ", query).lower().split():
+        target = excluded if token.startswith("-") else words
+        target.extend(re.findall(r"\w+", token))
+    for phrase in phrases:
+        words.extend(re.findall(r"\w+", phrase))
+    return words, phrases, excluded
+
+async def read_bucket_page(collection, conversation_id: str, skip: int, limit: int,
+                           position: Optional[tuple], newest_first: bool,
+                           unpack: Callable[[dict], List[dict]] = _unpack) -> List[dict]:
+    """One page, in chronological order, from bucket documents ({conversation_id,
+    start, end, ...}) of `collection`: the newest messages strictly before the
+    (timestamp, _id) `position`, or the oldest strictly after it.
+
+    Buckets are read in end order (start order for oldest-first pages) until
+    no remaining bucket can hold a message of the page, so the page is exact
+    even where buckets overlap. A message found in two buckets counts once.
+    """
+    if newest_first:
+        query = {"conversation_id": conversation_id}
+        if position:
+            query["start"] = {"$lte": position[0]}
+            skip = 0
+        cursor = collection.find(query).sort([("end", -1)])
+    else:
+        skip = 0
+        query = {"conversation_id": conversation_id}
+        if position:
+            query["end"] = {"$gte": position[0]}
+        cursor = collection.find(query).sort([("start", 1)])
+
+    wanted = skip + limit
+    collected = []
+    seen = set()
+    async for bucket in cursor.batch_size(4):
+        if len(collected) >= wanted:
+            # Stop once the next bucket cannot contain anything newer (older)
+            # than the page boundary
+            boundary = collected[wanted - 1]["timestamp"]
+            if (bucket["end"] < boundary) if newest_first else (bucket["start"] > boundary):
+                break
+        for message in unpack(bucket):
+            if message["_id"] in seen:
+                continue
+            if position is not None and (
+                _message_key(message) >= position if newest_first else _message_key(message) <= position
+            ):
+                continue
+            seen.add(message["_id"])
+            collected.append(message)
+        collected.sort(key=_message_key, reverse=newest_first)
+        del collected[wanted:]
+
+    page = collected[skip:wanted]
+    if newest_first:
+        page.reverse()  # Return in chronological order
+    return page
+
+async def stream_buckets(cursor, after: Optional[tuple] = None,
+                         unpack: Callable[[dict], List[dict]] = _unpack) -> AsyncIterator[dict]:
+    """Messages of bucket documents read in start order, oldest first.
+
+    A message is held back only until a bucket starting after it arrives,
+    so memory stays at about one bucket (more where buckets overlap), and
+    messages repeated in two buckets are yielded once.
+    """
+    pending = []
+    order = itertools.count()
+    last = after
+    async for bucket in cursor:
+        while pending and pending[0][0] < (bucket["start"],):
+            key, _, message = heapq.heappop(pending)
+            if last is None or key > last:
+                last = key
+                yield message
+        for message in unpack(bucket):
+            key = _message_key(message)
+            if after is None or key > after:
+                heapq.heappush(pending, (key, next(order), message))
+    while pending:
+        key, _, message = heapq.heappop(pending)
+        if last is None or key > last:
+            last = key
+            yield message
+
+class BucketedMessageStore:
+    """Messages packed into per-conversation buckets.
+
+    Writes $push into the conversation's open bucket (upserting a new one
+    when it is full or too old). Reads walk buckets newest first (oldest
+    first for `after` pages) and stop as soon as no remaining bucket can
+    hold a message of the page, so a page usually costs one or two bucket
+    reads.
+    """
+
+    def __init__(self, bucket_size: int = 200, span_seconds: float = 86400):
+        self.bucket_size = bucket_size
+        self.span = timedelta(seconds=span_seconds)
+
+    def _append(self, conversation_id: str, messages: List[dict]) -> tuple:
+        """(filter, update) appending messages to the conversation's open bucket"""
+        for message in messages:
+            message.setdefault("_id", ObjectId())
+        timestamps = [message["timestamp"] for message in messages]
+        return (
+            {
+                "conversation_id": conversation_id,
+                "count": {"$lte": self.bucket_size - len(messages)},
+                "start": {"$gte": max(timestamps) - self.span}
+            },
+            {
+                "$push": {"messages": {"$each": [
+                    {field: message.get(field) for field in BUCKET_MESSAGE_FIELDS} for message in messages
+                ]}},
+                "$inc": {"count": len(messages)},
+                "$min": {"start": min(timestamps)},
+                "$max": {"end": max(timestamps)}
+            }
+        )
+
+    def pack(self, conversation_id: str, messages: List[dict]) -> List[dict]:
+        """Bucket documents holding `messages` (sorted oldest first), split by
+        bucket size and span like the write path does"""
+        buckets = []
+        for message in messages:
+            bucket = buckets[-1] if buckets else None
+            if bucket is None or bucket["count"] >= self.bucket_size or message["timestamp"] - bucket["start"] > self.span:
+                bucket = {"conversation_id": conversation_id, "start": message["timestamp"], "count": 0, "messages": []}
+                buckets.append(bucket)
+            bucket["messages"].append({field: message.get(field) for field in BUCKET_MESSAGE_FIELDS})
+            bucket["count"] += 1
+            bucket["end"] = message["timestamp"]
+        return buckets
+
+    async def insert(self, message: dict):
+        buckets_collection = await get_message_buckets_collection()
+        await buckets_collection.update_one(*self._append(message["conversation_id"], [message]), upsert=True)
+
+    async def insert_many(self, messages: List[dict]) -> Dict[int, str]:
+        """Append a batch with one bucket update per conversation; returns
+        {index: error} for messages whose bucket update failed"""
+        buckets_collection = await get_message_buckets_collection()
+        by_conversation: Dict[str, List[int]] = {}
+        for index, message in enumerate(messages):
+            by_conversation.setdefault(message["conversation_id"], []).append(index)
+        groups = list(by_conversation.items())
+        try:
+            await buckets_collection.bulk_write([
+                UpdateOne(*self._append(conversation_id, [messages[index] for index in indexes]), upsert=True)
+                for conversation_id, indexes in groups
+            ], ordered=False)
+        except BulkWriteError as e:
+            failed = {}
+            for error in e.details.get("writeErrors", []):
+                for index in groups[error["index"]][1]:
+                    failed[index] = error.get("errmsg", "Message insert failed")
+            return failed
+        return {}
+
+    async def page(self, conversation_id: str, skip: int, limit: int,
+                   before: Optional[str], after: Optional[str]) -> List[dict]:
+        buckets_collection = await get_message_buckets_collection()
+        if after:
+            return await read_bucket_page(buckets_collection, conversation_id, 0, limit, decode_cursor(after), False)
+        position = decode_cursor(before) if before else None
+        return await read_bucket_page(buckets_collection, conversation_id, skip, limit, position, True)
+
+    async def latest(self, conversation_id: str) -> Optional[dict]:
+        page = await self.page(conversation_id, 0, 1, None, None)
+        return page[-1] if page else None
+
+    async def count_unread(self, conversation_id: str, user_email: str, watermark: Optional[dict]) -> int:
+        """Count messages from others after the watermark, unwinding only
+        the buckets that end after it"""
+        buckets_collection = await get_message_buckets_collection()
+
+        match_bucket = {"conversation_id": conversation_id}
+        match_message = {"messages.sender_email": {"$ne": user_email}}
+        if watermark is not None:
+            match_bucket["end"] = {"$gte": watermark["last_read_at"]}
+            match_message["$or"] = [
+                {"messages.timestamp": {"$gt": watermark["last_read_at"]}},
+                {"messages.timestamp": watermark["last_read_at"], "messages._id": {"$gt": watermark["last_read_message_id"]}}
+            ]
+        cursor = buckets_collection.aggregate([
+            {"$match": match_bucket},
+            {"$unwind": "$messages"},
+            {"$match": match_message},
+            {"$limit": settings.UNREAD_COUNT_CAP},
+            {"$count": "unread"}
+        ])
+        result = await cursor.to_list(length=1)
+        return result[0]["unread"] if result else 0
+
+    async def search(self, conversation_ids: List[str], query: str, start: Optional[datetime],
+                     end: Optional[datetime], after: Optional[tuple], limit: int) -> List[dict]:
+        """Hits of every conversation, ranked like FlatMessageStore.search"""
+        return await merge_search_hits(
+            lambda conversation_id: self._search_conversation(conversation_id, query, start, end, after, limit),
+            conversation_ids, limit
+        )
+
+    async def _search_conversation(self, conversation_id: str, query: str, start: Optional[datetime],
+                                   end: Optional[datetime], after: Optional[tuple], limit: int) -> List[dict]:
+        """The text index finds the conversation's SEARCH_BUCKET_CANDIDATES
+        best buckets; their messages are then matched against the search
+        terms and scored by how many term occurrences they contain.
+        
+        The candidate buckets do not depend on the page, so every page ranks
+        the same hits and the cursor continues exactly where the last page
+        stopped. Matches outside the candidate buckets are not returned.
+        """
+        buckets_collection = await get_message_buckets_collection()
+
+        filter_query = {"conversation_id": conversation_id, "$text": {"$search": query}}
+        if start:
+            filter_query["end"] = {"$gte": start}
+        if end:
+            filter_query["start"] = {"$lte": end}
+        cursor = buckets_collection.find(
+            filter_query,
+            {"score": {"$meta": "textScore"}, "conversation_id": 1, "messages": 1}
+        ).sort([
+            ("score", {"$meta": "textScore"}),
+            ("end", -1),
+            ("_id", -1)
+        ]).limit(settings.SEARCH_BUCKET_CANDIDATES).max_time_ms(settings.SEARCH_MAX_TIME_MS)
+
+        words, phrases, excluded = _search_terms(query)
+        hits = []
+        async for bucket in cursor:
+            for message in _unpack(bucket):
+                if (start and message["timestamp"] < start) or (end and message["timestamp"] > end):
+                    continue
+                text = message["message"].lower()
+                tokens = re.findall(r"\w+", text)
+                if any(word in tokens for word in excluded) or not all(phrase in text for phrase in phrases):
+                    continue
+                score = sum(tokens.count(word) for word in words)
+                if score:
+                    message["score"] = float(score)
+                    if after is None or _search_key(message) < after:
+                        hits.append(message)
+        hits.sort(key=_search_key, reverse=True)
+        return hits[:limit]
+
+    async def count(self, conversation_id: str) -> int:
+        buckets_collection = await get_message_buckets_collection()
+        cursor = buckets_collection.aggregate([
+            {"$match": {"conversation_id": conversation_id}},
+            {"$group": {"_id": None, "count": {"$sum": "$count"}}}
+        ])
+        result = await cursor.to_list(length=1)
+        return result[0]["count"] if result else 0
+
+    async def older_than(self, conversation_id: str, cutoff: datetime, limit: int) -> List[dict]:
+        """The oldest `limit` messages sent before `cutoff`, oldest first"""
+        buckets_collection = await get_message_buckets_collection()
+        page = await read_bucket_page(buckets_collection, conversation_id, 0, limit, None, False)
+        return [message for message in page if message["timestamp"] < cutoff]
+
+    async def remove(self, conversation_id: str, message_ids: list):
+        """Drop messages from their buckets (start/end stay as bounds) and
+        delete buckets left empty"""
+        buckets_collection = await get_message_buckets_collection()
+        await buckets_collection.update_many(
+            {"conversation_id": conversation_id, "messages._id": {"$in": message_ids}},
+            [
+                {"$set": {"messages": {"$filter": {
+                    "input": "$messages",
+                    "cond": {"$not": [{"$in": ["$$this._id", message_ids]}]}
+                }}}},
+                {"$set": {"count": {"$size": "$messages"}}}
+            ]
+        )
+        await buckets_collection.delete_many({"conversation_id": conversation_id, "count": 0})
+
+    async def stream(self, conversation_id: str, after: Optional[tuple] = None,
+                     batch_size: int = 1000) -> AsyncIterator[dict]:
+        """Every message after the (timestamp, _id) `after`, oldest first"""
+        buckets_collection = await get_message_buckets_collection()
+        query = {"conversation_id": conversation_id}
+        if after is not None:
+            query["end"] = {"$gte": after[0]}
+        cursor = buckets_collection.find(query).sort([("start", 1)]).batch_size(
+            max(1, batch_size // self.bucket_size)
+        )
+        async for message in stream_buckets(cursor, after):
+            yield message
+
+def create_message_store(layout: Optional[str] = None):
+    layout = layout or settings.MESSAGE_STORAGE
+    if layout == "bucketed":
+        return BucketedMessageStore(settings.MESSAGE_BUCKET_SIZE, settings.MESSAGE_BUCKET_SPAN_SECONDS)
+    if layout != "flat":
+        raise ValueError(f"Unknown MESSAGE_STORAGE {layout!r}")
+    return FlatMessageStore()
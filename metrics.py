@@ -0,0 +1,195 @@
+"""
+Prometheus metrics for the chat backend.
+
+Metrics are plain in-process counters and histograms rendered in the
+Prometheus text exposition format by `render()` (served at /metrics), so no
+client library is needed. Each update is a dict lookup under a lock (Mongo
+command events arrive on driver threads), about a microsecond per call.
+"""
+import bisect
+import functools
+import inspect
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import socketio
+from pymongo import monitoring
+
+# Seconds; fine-grained at the low end where the hot paths live
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY: List["_Metric"] = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Iterable[str], values: Iterable) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def samples(self) -> Iterable[Tuple[str, tuple, tuple, float]]:
+        """(suffix, extra label names, label values, value) tuples"""
+        return ()
+
+    def render(self) -> List[str]:
+        family = self.name + "_total" if self.type == "counter" else self.name
+        lines = [f"# HELP {family} {self.documentation}", f"# TYPE {family} {self.type}"]
+        for suffix, extra_names, values, value in self.samples():
+            labels = _format_labels(self.labelnames + extra_names, values)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for labelvalues, value in items:
+            yield "_total", (), labelvalues, value
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labelvalues -> [count per bucket (+Inf last), sum]
+        self._values: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            items = sorted((labelvalues, (list(counts), total)) for labelvalues, (counts, total) in self._values.items())
+        for labelvalues, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield "_bucket", ("le",), labelvalues + (_format_value(float(bound)),), cumulative
+            yield "_sum", (), labelvalues, total
+            yield "_count", (), labelvalues, cumulative
+
+class CallbackMetric(_Metric):
+    """Gauge or counter whose values are read from `func` at scrape time;
+    func returns {label values tuple: value}"""
+
+    def __init__(self, name: str, documentation: str, type: str, labelnames: Tuple[str, ...],
+                 func: Callable[[], Dict[tuple, float]]):
+        super().__init__(name, documentation, labelnames)
+        self.type = type
+        self.func = func
+
+    def samples(self):
+        suffix = "_total" if self.type == "counter" else ""
+        for labelvalues, value in sorted(self.func().items()):
+            yield suffix, (), labelvalues, value
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+SERVICE_SECONDS = Histogram("chat_service_call_seconds", "ChatService method latency", ("method",))
+SERVICE_ERRORS = Counter("chat_service_call_errors", "ChatService calls that raised", ("method",))
+SOCKET_HANDLER_SECONDS = Histogram("chat_socket_handler_seconds", "Socket.IO event handler latency", ("event",))
+SOCKET_HANDLER_ERRORS = Counter("chat_socket_handler_errors", "Socket.IO event handlers that failed (raised or caught an error)", ("event",))
+SOCKET_EMITS = Counter("chat_socketio_emits", "Socket.IO emits by event name", ("event",))
+MONGO_COMMANDS = Counter("chat_mongo_commands", "MongoDB commands sent", ("command",))
+MONGO_COMMAND_ERRORS = Counter("chat_mongo_command_errors", "MongoDB commands that failed", ("command",))
+MONGO_COMMAND_SECONDS = Histogram("chat_mongo_command_seconds", "MongoDB command latency", ("command",))
+
+def timed(func: Callable, histogram: Histogram, errors: Counter, label: str) -> Callable:
+    """Wrap a function (sync or async) to record its latency and exceptions"""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                errors.inc(label)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, label)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except Exception:
+            errors.inc(label)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - start, label)
+    return wrapper
+
+def instrument_static_methods(cls: type):
+    """Time every static method of a service class (e.g. ChatService)"""
+    for name, attr in list(vars(cls).items()):
+        if isinstance(attr, staticmethod):
+            setattr(cls, name, staticmethod(timed(attr.__func__, SERVICE_SECONDS, SERVICE_ERRORS, name)))
+
+def time_socket_handler(handler: Callable) -> Callable:
+    return timed(handler, SOCKET_HANDLER_SECONDS, SOCKET_HANDLER_ERRORS, handler.__name__)
+
+class MeteredAsyncServer(socketio.AsyncServer):
+    """AsyncServer counting emits by event name"""
+
+    async def emit(self, event, *args, **kwargs):
+        SOCKET_EMITS.inc(event)
+        return await super().emit(event, *args, **kwargs)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """pymongo command listener counting commands, failures and latency"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMANDS.inc(event.command_name)
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name)
+
+    def failed(self, event):
+        MONGO_COMMANDS.inc(event.command_name)
+        MONGO_COMMAND_ERRORS.inc(event.command_name)
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, event.command_name)
+
+mongo_command_metrics = MongoCommandMetrics()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+One-off data migrations.
+
+    python migrations.py user-search-keys
+    python migrations.py read-watermarks
+    python migrations.py bucket-messages
+    python migrations.py conversation-updated-at
+    python migrations.py read-state-participants
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+
+from pymongo import UpdateMany, UpdateOne
+
+from chat_service import ChatService
+from config import settings
+from database import (
+    connect_to_mongo, close_mongo_connection, get_users_collection,
+    get_conversations_collection, get_chat_messages_collection, get_read_states_collection,
+    get_message_buckets_collection
+)
+from message_store import BucketedMessageStore
+
+logger = logging.getLogger(__name__)
+
+async def backfill_user_search_keys(batch_size: int = 1000) -> int:
+    """Add search_keys to users created before /users/search used them
+    (or upserted by a presence update before they had a name)"""
+    users_collection = await get_users_collection()
+    cursor = users_collection.find(
+        {"search_keys": {"$exists": False}},
+        {"email": 1, "name": 1}
+    ).batch_size(batch_size)
+
+    updated = 0
+    operations = []
+    async for user in cursor:
+        operations.append(UpdateOne(
+            {"_id": user["_id"]},
+            {"$set": {"search_keys": ChatService.user_search_keys(user["email"], user.get("name"))}}
+        ))
+        if len(operations) >= batch_size:
+            await users_collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await users_collection.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    return updated
+
+async def convert_unread_counts_to_watermarks(batch_size: int = 1000) -> int:
+    """Replace the per-conversation unread_count maps with read_states
+    watermarks: a participant with N unread messages gets a watermark just
+    before the N-th newest message they did not send"""
+    conversations_collection = await get_conversations_collection()
+    chat_messages_collection = await get_chat_messages_collection()
+    read_states_collection = await get_read_states_collection()
+    cursor = conversations_collection.find(
+        {"unread_count": {"$exists": True}},
+        {"unread_count": 1, "participants": 1}
+    ).batch_size(batch_size)
+
+    converted = 0
+    async for conv in cursor:
+        conversation_id = str(conv["_id"])
+        operations = []
+        for user_email, unread in (conv.get("unread_count") or {}).items():
+            if not isinstance(unread, int):
+                continue  # Nested leftovers of the old dotted $inc
+            if unread > 0:
+                oldest_unread = await chat_messages_collection.find_one(
+                    {"conversation_id": conversation_id, "sender_email": {"$ne": user_email}},
+                    {"timestamp": 1},
+                    sort=[("timestamp", -1), ("_id", -1)],
+                    skip=unread - 1
+                )
+                if oldest_unread is None:
+                    continue
+                query = {
+                    "conversation_id": conversation_id,
+                    "$or": [
+                        {"timestamp": {"$lt": oldest_unread["timestamp"]}},
+                        {"timestamp": oldest_unread["timestamp"], "_id": {"$lt": oldest_unread["_id"]}}
+                    ]
+                }
+            else:
+                query = {"conversation_id": conversation_id}
+            last_read = await chat_messages_collection.find_one(
+                query, {"timestamp": 1}, sort=[("timestamp", -1), ("_id", -1)]
+            )
+            if last_read is None:
+                continue
+            operations.append(UpdateOne(
+                {"user_email": user_email, "conversation_id": conversation_id},
+                {"$setOnInsert": {
+                    "last_read_message_id": last_read["_id"],
+                    "last_read_at": last_read["timestamp"],
+                    "participants": conv.get("participants", []),
+                    "updated_at": datetime.utcnow()
+                }},
+                upsert=True
+            ))
+        if operations:
+            await read_states_collection.bulk_write(operations, ordered=False)
+        await conversations_collection.update_one({"_id": conv["_id"]}, {"$unset": {"unread_count": ""}})
+        converted += 1
+    return converted
+
+async def bucket_flat_messages(batch_size: int = 1000) -> int:
+    """Copy chat_messages into chat_message_buckets for MESSAGE_STORAGE=bucketed.
+    
+    Each conversation resumes after its newest bucketed message, so this can
+    run once ahead of the switch and again right before it to copy what was
+    sent in between. chat_messages itself is left untouched.
+    """
+    conversations_collection = await get_conversations_collection()
+    chat_messages_collection = await get_chat_messages_collection()
+    buckets_collection = await get_message_buckets_collection()
+    store = BucketedMessageStore(settings.MESSAGE_BUCKET_SIZE, settings.MESSAGE_BUCKET_SPAN_SECONDS)
+
+    flush_at = max(batch_size, 2 * store.bucket_size)
+    copied = 0
+    async for conv in conversations_collection.find({}, {"_id": 1}).batch_size(batch_size):
+        conversation_id = str(conv["_id"])
+        query = {"conversation_id": conversation_id}
+        newest = await store.latest(conversation_id)
+        if newest is not None:
+            query["$or"] = [
+                {"timestamp": {"$gt": newest["timestamp"]}},
+                {"timestamp": newest["timestamp"], "_id": {"$gt": newest["_id"]}}
+            ]
+        cursor = chat_messages_collection.find(query).sort(
+            [("timestamp", 1), ("_id", 1)]
+        ).batch_size(batch_size)
+
+        pending = []
+        async for message in cursor:
+            pending.append(message)
+            if len(pending) >= flush_at:
+                # Keep the last, possibly partial bucket open for the next messages
+                buckets = store.pack(conversation_id, pending)
+                await buckets_collection.insert_many(buckets[:-1])
+                copied += sum(bucket["count"] for bucket in buckets[:-1])
+                pending = pending[len(pending) - buckets[-1]["count"]:]
+        if pending:
+            buckets = store.pack(conversation_id, pending)
+            await buckets_collection.insert_many(buckets)
+            copied += len(pending)
+    return copied
+
+async def backfill_conversation_updated_at() -> int:
+    """Set updated_at on conversations last written before delta sync used it"""
+    conversations_collection = await get_conversations_collection()
+    result = await conversations_collection.update_many(
+        {"updated_at": {"$exists": False}},
+        [{"$set": {"updated_at": {"$ifNull": ["$last_message_time", "$created_at"]}}}]
+    )
+    return result.modified_count
+
+async def backfill_read_state_participants(batch_size: int = 1000) -> int:
+    """Copy participants onto the read states of direct conversations written
+    before delta sync looked them up by user"""
+    conversations_collection = await get_conversations_collection()
+    read_states_collection = await get_read_states_collection()
+    cursor = conversations_collection.find(
+        {"conversation_type": {"$ne": "group"}},
+        {"participants": 1}
+    ).batch_size(batch_size)
+
+    updated = 0
+    operations = []
+    async for conv in cursor:
+        operations.append(UpdateMany(
+            {"conversation_id": str(conv["_id"]), "participants": {"$exists": False}},
+            {"$set": {"participants": conv.get("participants", [])}}
+        ))
+        if len(operations) >= batch_size:
+            result = await read_states_collection.bulk_write(operations, ordered=False)
+            updated += result.modified_count
+            operations = []
+    if operations:
+        result = await read_states_collection.bulk_write(operations, ordered=False)
+        updated += result.modified_count
+    return updated
+
+MIGRATIONS = {
+    "user-search-keys": backfill_user_search_keys,
+    "read-watermarks": convert_unread_counts_to_watermarks,
+    "bucket-messages": bucket_flat_messages,
+    "conversation-updated-at": backfill_conversation_updated_at,
+    "read-state-participants": backfill_read_state_participants,
+}
+
+async def main():
+    parser = argparse.ArgumentParser(description="Run a data migration")
+    parser.add_argument("migration", choices=sorted(MIGRATIONS))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    await connect_to_mongo()
+    try:
+        count = await MIGRATIONS[args.migration]()
+        logger.info(f"{args.migration}: updated {count} documents")
+    finally:
+        await close_mongo_connection()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field, ConfigDict, field_validator
+from pydantic import BaseModel, Field, ConfigDict, field_validator, model_validator
 from typing import List, Optional, Any, Annotated
 from datetime import datetime
 from bson import ObjectId
@@ -56,6 +56,7 @@ class ChatMessage(BaseModel):
     edited: bool = False
     edited_at: Optional[datetime] = None
     reply_to: Optional[str] = None  # ID of message being replied to
+    participants: List[str] = []  # Conversation participants, filled in by send_message
 
 class Conversation(BaseModel):
     model_config = ConfigDict(
@@ -65,23 +66,46 @@ class Conversation(BaseModel):
     )
     
     id: Optional[str] = Field(default=None, alias="_id")
-    participants: List[str]  # List of email addresses
+    participants: List[str] = []  # Emails of a direct conversation; group members live in conversation_members
     conversation_type: str = "direct"  # direct, group
+    name: Optional[str] = None  # Group name
+    created_by: Optional[str] = None
+    member_count: Optional[int] = None  # Groups only
     created_at: datetime = Field(default_factory=datetime.utcnow)
     last_message: Optional[str] = None
     last_message_time: Optional[datetime] = None
     last_message_sender: Optional[str] = None
-    unread_count: dict = {}  # {email: count}
+    last_message_id: Optional[str] = None  # Unread counts compare it with read_states watermarks
+    updated_at: Optional[datetime] = None  # Last change, for delta sync
 
 class MessageRequest(BaseModel):
-    to_email: str
+    to_email: Optional[str] = None  # Direct message to a user
+    conversation_id: Optional[str] = None  # Or a message to a conversation the sender is in
     message: str
     message_type: str = "text"
     reply_to: Optional[str] = None
 
+    @model_validator(mode="after")
+    def check_target(self):
+        if (self.to_email is None) == (self.conversation_id is None):
+            raise ValueError("Give exactly one of to_email and conversation_id")
+        return self
+
+class GroupCreateRequest(BaseModel):
+    name: str
+    members: List[str] = []  # Emails added besides the creator
+
+class GroupMember(BaseModel):
+    user_email: str
+    role: str  # owner, member
+    joined_at: datetime
+
 class ConversationResponse(BaseModel):
     conversation_id: str
     participants: List[str]
+    conversation_type: str = "direct"
+    name: Optional[str] = None
+    member_count: Optional[int] = None
     last_message: Optional[str] = None
     last_message_time: Optional[datetime] = None
     last_message_sender: Optional[str] = None
@@ -96,4 +120,23 @@ class MessageResponse(BaseModel):
     timestamp: datetime
     message_type: str
     edited: bool
-    reply_to: Optional[str] = None 
\ No newline at end of file
+    reply_to: Optional[str] = None 
+
+class MessageSearchHit(MessageResponse):
+    score: float
+
+class ReadReceipt(BaseModel):
+    user_email: str
+    last_read_message_id: str
+    last_read_at: datetime
+
+class ReadStateChange(ReadReceipt):
+    conversation_id: str
+
+class SyncResponse(BaseModel):
+    token: str  # Pass back as `token` on the next sync
+    reset: bool = False  # Token expired or too much changed: reload everything
+    conversations: List[ConversationResponse] = []
+    messages: List[MessageResponse] = []
+    read_states: List[ReadStateChange] = []
+    truncated: List[str] = []  # Conversations whose gap was cut to the newest messages
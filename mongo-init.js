@@ -5,11 +5,9 @@ db = db.getSiblingDB('chat_app');
 db.createCollection('users');
 db.createCollection('conversations');
 db.createCollection('chat_messages');
+db.createCollection('read_states');
 
-// Create indexes for better performance
-db.chat_messages.createIndex({ "conversation_id": 1, "timestamp": -1 });
-db.conversations.createIndex({ "participants": 1 });
-db.conversations.createIndex({ "last_message_time": -1 });
-db.users.createIndex({ "email": 1 }, { unique: true });
+// Indexes are defined in indexes.py and built by the backend on startup
+// (or with `python indexes.py build`)
 
 print('Chat application database initialized successfully!'); 
\ No newline at end of file
@@ -0,0 +1,80 @@
+"""
+Opaque keyset cursors for message history.
+
+A cursor encodes the (timestamp, _id) of a message, so the next page is
+found with an index range scan instead of skipping over earlier entries.
+Search cursors add the relevance score of the last hit, and sync tokens
+(GET /sync) encode a server time the same way.
+"""
+import base64
+import calendar
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+def _millis(timestamp: datetime) -> int:
+    # BSON datetimes have millisecond precision, so milliseconds are exact
+    return (calendar.timegm(timestamp.utctimetuple()) * 1000) + timestamp.microsecond // 1000
+
+def encode_cursor(timestamp: datetime, message_id) -> str:
+    raw = f"{_millis(timestamp)}.{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Decode a cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        millis, message_id = base64.urlsafe_b64decode(padded.encode()).decode().split(".")
+        timestamp = datetime(1970, 1, 1) + timedelta(milliseconds=int(millis))
+        return timestamp, ObjectId(message_id)
+    except (ValueError, TypeError, OverflowError, InvalidId) as e:
+        raise ValueError("Invalid cursor") from e
+
+def keyset_filter(cursor: str, direction: str) -> dict:
+    """Mongo filter for messages strictly before/after the cursor position"""
+    timestamp, message_id = decode_cursor(cursor)
+    op = "$lt" if direction == "before" else "$gt"
+    return {
+        "$or": [
+            {"timestamp": {op: timestamp}},
+            {"timestamp": timestamp, "_id": {op: message_id}}
+        ]
+    }
+
+def message_cursor(message: dict) -> Optional[str]:
+    """Cursor pointing at a message dict (as built by serialization.message_to_dict)"""
+    if message is None:
+        return None
+    return encode_cursor(message["timestamp"], message["id"])
+
+def encode_search_cursor(score: float, timestamp: datetime, message_id) -> str:
+    raw = f"{score!r}_{_millis(timestamp)}.{message_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_search_cursor(cursor: str) -> Tuple[float, datetime, ObjectId]:
+    """Decode a search cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        score, position = base64.urlsafe_b64decode(padded.encode()).decode().split("_")
+        millis, message_id = position.split(".")
+        timestamp = datetime(1970, 1, 1) + timedelta(milliseconds=int(millis))
+        return float(score), timestamp, ObjectId(message_id)
+    except (ValueError, TypeError, OverflowError, InvalidId) as e:
+        raise ValueError("Invalid cursor") from e
+
+def encode_sync_token(timestamp: datetime) -> str:
+    raw = f"s{_millis(timestamp)}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_sync_token(token: str) -> datetime:
+    """Decode a sync token, raising ValueError if it is malformed"""
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        if not raw.startswith("s"):
+            raise ValueError("Invalid sync token")
+        return datetime(1970, 1, 1) + timedelta(milliseconds=int(raw[1:]))
+    except (ValueError, TypeError, OverflowError) as e:
+        raise ValueError("Invalid sync token") from e
@@ -0,0 +1,256 @@
+"""
+Presence stores and presence broadcasting.
+
+LocalPresenceStore answers from this process' SessionRegistry and is enough
+for a single worker. MongoPresenceStore keeps one document per online user in
+the `presence` collection so every worker sees the same online set.
+
+PresenceBroadcaster delivers online/offline changes only to users who share a
+conversation with the user, as batched `presence_update` diffs.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+from config import settings
+from database import get_presence_collection
+from session_registry import SessionRegistry
+
+logger = logging.getLogger(__name__)
+
+class LocalPresenceStore:
+    """Presence for a single process, backed by the session registry.
+
+    add/remove are called after the registry has been updated.
+    """
+
+    def __init__(self, registry: SessionRegistry):
+        self.registry = registry
+
+    async def add(self, sid: str, email: str) -> bool:
+        """Record a session. Returns True if the user just came online"""
+        return self.registry.sid_count(email) == 1
+
+    async def remove(self, sid: str, email: str) -> bool:
+        """Forget a session. Returns True if the user just went offline"""
+        return not self.registry.is_online(email)
+
+    async def is_online(self, email: str) -> bool:
+        return self.registry.is_online(email)
+
+    async def online_emails(self, emails: Optional[List[str]] = None) -> List[str]:
+        if emails is None:
+            return self.registry.online_emails()
+        return [email for email in emails if self.registry.is_online(email)]
+
+    async def sids(self, email: str) -> List[str]:
+        return list(self.registry.get_sids(email))
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class MongoPresenceStore:
+    """Presence shared by every worker through MongoDB.
+
+    Each presence document holds the user's live sessions tagged with the
+    worker (host) that owns them. Workers refresh their sessions on a
+    heartbeat so sessions of a crashed worker expire after PRESENCE_TTL_SECONDS.
+    """
+
+    def __init__(self, host_id: Optional[str] = None):
+        self.host_id = host_id or uuid.uuid4().hex
+        self.ttl = settings.PRESENCE_TTL_SECONDS
+        self._heartbeat_task: Optional[asyncio.Task] = None
+
+    async def add(self, sid: str, email: str) -> bool:
+        presence_collection = await get_presence_collection()
+        previous = await presence_collection.find_one_and_update(
+            {"_id": email},
+            {"$push": {"sessions": {"sid": sid, "host": self.host_id, "seen": datetime.utcnow()}}},
+            upsert=True,
+            projection={"sessions.sid": 1},
+            return_document=ReturnDocument.BEFORE
+        )
+        return not previous or not previous.get("sessions")
+
+    async def remove(self, sid: str, email: str) -> bool:
+        presence_collection = await get_presence_collection()
+        current = await presence_collection.find_one_and_update(
+            {"_id": email},
+            {"$pull": {"sessions": {"sid": sid}}},
+            projection={"sessions.sid": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if current is None:
+            return True
+        if current.get("sessions"):
+            return False
+        await presence_collection.delete_one({"_id": email, "sessions": {"$size": 0}})
+        return True
+
+    async def is_online(self, email: str) -> bool:
+        presence_collection = await get_presence_collection()
+        return await presence_collection.count_documents({"_id": email}, limit=1) > 0
+
+    async def online_emails(self, emails: Optional[List[str]] = None) -> List[str]:
+        presence_collection = await get_presence_collection()
+        query = {} if emails is None else {"_id": {"$in": emails}}
+        cursor = presence_collection.find(query, {"_id": 1})
+        return [doc["_id"] async for doc in cursor]
+
+    async def sids(self, email: str) -> List[str]:
+        """The user's sessions on every worker"""
+        presence_collection = await get_presence_collection()
+        presence = await presence_collection.find_one({"_id": email}, {"sessions.sid": 1})
+        return [session["sid"] for session in (presence or {}).get("sessions", [])]
+
+    async def start(self):
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def stop(self):
+        if self._heartbeat_task:
+            self._heartbeat_task.cancel()
+            self._heartbeat_task = None
+        # Drop this worker's sessions so its users don't look online forever
+        presence_collection = await get_presence_collection()
+        await self._pull_sessions(
+            presence_collection, {"sessions.host": self.host_id}, {"host": self.host_id}
+        )
+
+    async def _pull_sessions(self, presence_collection, query: dict, session_filter: dict):
+        """Remove the sessions matching `session_filter` from the users found
+        by `query` (an indexed sessions.* filter), then delete the users left
+        without sessions by _id rather than scanning for empty documents"""
+        emails = await presence_collection.distinct("_id", query)
+        if not emails:
+            return
+        await presence_collection.update_many(
+            {"_id": {"$in": emails}},
+            {"$pull": {"sessions": session_filter}}
+        )
+        await presence_collection.delete_many({"_id": {"$in": emails}, "sessions": {"$size": 0}})
+
+    async def _refresh(self):
+        """Mark this worker's sessions as seen and expire the sessions of
+        workers that stopped heart-beating"""
+        presence_collection = await get_presence_collection()
+        now = datetime.utcnow()
+        await presence_collection.update_many(
+            {"sessions.host": self.host_id},
+            {"$set": {"sessions.$[s].seen": now}},
+            array_filters=[{"s.host": self.host_id}]
+        )
+        cutoff = now - timedelta(seconds=self.ttl)
+        await self._pull_sessions(
+            presence_collection, {"sessions.seen": {"$lt": cutoff}}, {"seen": {"$lt": cutoff}}
+        )
+
+    async def _heartbeat(self):
+        interval = max(self.ttl / 3, 1)
+        while True:
+            try:
+                await asyncio.sleep(interval)
+                await self._refresh()
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Presence heartbeat error: {e}")
+
+def create_presence_store(registry: SessionRegistry):
+    """Pick the presence backend from settings"""
+    backend = settings.PRESENCE_BACKEND
+    if not backend:
+        backend = "mongo" if settings.SOCKETIO_MESSAGE_QUEUE else "local"
+    if backend == "mongo":
+        return MongoPresenceStore()
+    if backend == "local":
+        return LocalPresenceStore(registry)
+    raise ValueError(f"Unsupported PRESENCE_BACKEND: {backend}")
+
+# emit(contact_email, {"online": [...], "offline": [...]})
+EmitPresence = Callable[[str, dict], Awaitable[None]]
+GetContacts = Callable[[str], Awaitable[List[str]]]
+
+class PresenceBroadcaster:
+    """Batches presence changes and sends each contact one diff per tick.
+
+    Going offline is only announced once the user stayed offline for
+    `debounce_seconds`, so a quick reconnect (page reload, network blip)
+    produces no presence traffic at all.
+    """
+
+    def __init__(self, emit: EmitPresence, get_contacts: GetContacts,
+                 flush_interval_ms: float = 1000, debounce_seconds: float = 5):
+        self.emit = emit
+        self.get_contacts = get_contacts
+        self.flush_interval = flush_interval_ms / 1000
+        self.debounce = debounce_seconds
+        self._pending: Dict[str, Tuple[bool, float]] = {}  # email -> (online, changed_at)
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {
+            "changes": 0,
+            "flaps_absorbed": 0,
+            "users_announced": 0,
+            "emits": 0,
+        }
+
+    def user_online(self, email: str):
+        self._change(email, True)
+
+    def user_offline(self, email: str):
+        self._change(email, False)
+
+    def _change(self, email: str, online: bool):
+        self.metrics["changes"] += 1
+        pending = self._pending.get(email)
+        if pending is not None and pending[0] != online:
+            # Reverted before it was announced: contacts never need to know
+            del self._pending[email]
+            self.metrics["flaps_absorbed"] += 1
+            return
+        self._pending[email] = (online, time.monotonic())
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Presence flush error: {e}")
+
+    async def flush(self):
+        now = time.monotonic()
+        due = [
+            (email, online) for email, (online, changed_at) in self._pending.items()
+            if online or now - changed_at >= self.debounce
+        ]
+        diffs: Dict[str, dict] = {}
+        for email, online in due:
+            del self._pending[email]
+            self.metrics["users_announced"] += 1
+            for contact in await self.get_contacts(email):
+                diff = diffs.setdefault(contact, {"online": [], "offline": []})
+                diff["online" if online else "offline"].append(email)
+
+        for contact, diff in diffs.items():
+            await self.emit(contact, diff)
+        self.metrics["emits"] += len(diffs)
+
+    def stats(self) -> dict:
+        return {**self.metrics, "pending": len(self._pending)}
@@ -0,0 +1,313 @@
+"""
+Slow-query profiler built on pymongo command monitoring.
+
+Every command is reduced to a shape (its filter/sort/update structure with
+all values replaced by "?") and aggregated per (command, namespace, shape):
+count, errors, total/max duration and how often it exceeded the threshold.
+Slow executions are logged and kept in a small ring of recent samples, and
+the slowest shapes are explained once in a while so the report shows which
+plan (COLLSCAN, in-memory SORT, index) they use. Values never leave the
+process: shapes, samples and explain summaries are all redacted.
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from pymongo import monitoring
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Driver/session fields that are not part of what a query does
+_COMMAND_NOISE = {
+    "lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit",
+    "startTransaction", "writeConcern", "readConcern", "cursor", "batchSize",
+    "singleBatch", "maxTimeMS", "ordered", "comment", "documents", "bypassDocumentValidation",
+}
+# Keys whose values describe structure rather than user data
+_STRUCTURAL_KEYS = {"sort", "projection", "fields", "$sort", "$project", "hint", "key", "$meta"}
+# Commands the profiler ignores (handshakes, auth, its own explains)
+_IGNORED_COMMANDS = {
+    "hello", "ismaster", "isMaster", "ping", "buildinfo", "buildInfo", "saslStart",
+    "saslContinue", "endSessions", "explain", "getnonce", "killCursors",
+}
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+
+def query_shape(value: Any, structural: bool = False) -> Any:
+    """Structure of a query document with every value replaced by "?"."""
+    if isinstance(value, dict):
+        return {
+            key: query_shape(item, structural or key in _STRUCTURAL_KEYS)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(item, dict) for item in value):
+            # Clauses, pipeline stages or bulk statements: keep each distinct shape once
+            shapes = []
+            for item in value:
+                shape = query_shape(item, structural)
+                if shape not in shapes:
+                    shapes.append(shape)
+            return shapes
+        return [query_shape(value[0], structural)] if value else []
+    if structural and isinstance(value, (int, float)):
+        return value  # Sort directions, projection flags
+    return "?"
+
+def command_shape(command_name: str, command: dict) -> dict:
+    return query_shape({
+        key: value for key, value in command.items()
+        if key != command_name and key not in _COMMAND_NOISE
+    })
+
+def command_namespace(database_name: str, command_name: str, command: dict) -> str:
+    collection = command.get("collection") if command_name == "getMore" else command.get(command_name)
+    return f"{database_name}.{collection}" if isinstance(collection, str) else database_name
+
+def plan_summary(explain: dict) -> dict:
+    """Redacted summary of an explain result: plan stages, indexes used and
+    execution counters (no index bounds or filter values)"""
+    if "stages" in explain and explain["stages"]:
+        # Aggregations: the query part is in the first stage's $cursor
+        cursor_stage = explain["stages"][0].get("$cursor", {})
+        planner = cursor_stage.get("queryPlanner", {})
+        execution = cursor_stage.get("executionStats", {})
+    else:
+        planner = explain.get("queryPlanner", {})
+        execution = explain.get("executionStats", {})
+
+    winning = planner.get("winningPlan", {})
+    winning = winning.get("queryPlan", winning)  # Slot-based engine plans
+    stages = []
+    nodes = [winning]
+    while nodes:
+        node = nodes.pop(0)
+        if not isinstance(node, dict) or "stage" not in node:
+            continue
+        stage = node["stage"]
+        if node.get("indexName"):
+            stage += f"({node['indexName']})"
+        stages.append(stage)
+        if "inputStage" in node:
+            nodes.append(node["inputStage"])
+        nodes.extend(node.get("inputStages", []))
+
+    plain_stages = [stage.split("(")[0] for stage in stages]
+    return {
+        "plan": " <- ".join(stages),
+        "collscan": "COLLSCAN" in plain_stages,
+        "in_memory_sort": "SORT" in plain_stages,
+        "n_returned": execution.get("nReturned"),
+        "keys_examined": execution.get("totalKeysExamined"),
+        "docs_examined": execution.get("totalDocsExamined"),
+        "execution_ms": execution.get("executionTimeMillis"),
+    }
+
+async def explain_command(database, command_name: str, command: dict) -> dict:
+    """Explain a captured command (executionStats) and return its plan_summary"""
+    command = {key: value for key, value in command.items() if key not in _COMMAND_NOISE}
+    if command_name == "aggregate":
+        command["cursor"] = {}
+    result = await database.command({"explain": command, "verbosity": "executionStats"})
+    return plan_summary(result)
+
+class _ShapeStats:
+    __slots__ = (
+        "command", "namespace", "shape", "count", "errors", "total_ms", "max_ms",
+        "slow_count", "last_slow_at", "slowest_command", "database", "explain", "explained_at",
+    )
+
+    def __init__(self, command: str, namespace: str, shape: dict, database: str):
+        self.command = command
+        self.namespace = namespace
+        self.shape = shape
+        self.database = database
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.slow_count = 0
+        self.last_slow_at: Optional[datetime] = None
+        self.slowest_command: Optional[dict] = None  # Kept only to run explain
+        self.explain: Optional[dict] = None
+        self.explained_at = 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "command": self.command,
+            "namespace": self.namespace,
+            "shape": self.shape,
+            "count": self.count,
+            "errors": self.errors,
+            "total_ms": round(self.total_ms, 3),
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "slow_count": self.slow_count,
+            "last_slow_at": self.last_slow_at,
+            "explain": self.explain,
+        }
+
+class SlowQueryProfiler(monitoring.CommandListener):
+    """Command listener aggregating per-shape timings. pymongo calls it from
+    driver threads, so state is guarded by a lock and explains are handed
+    to the event loop."""
+
+    def __init__(self, threshold_ms: float = 100, max_shapes: int = 1000, sample_size: int = 100,
+                 explain: bool = True, explain_top: int = 5, explain_interval_seconds: float = 600):
+        self.threshold_ms = threshold_ms
+        self.explain_enabled = explain
+        self.explain_top = explain_top
+        self.explain_interval = explain_interval_seconds
+
+        self._lock = threading.Lock()
+        self._inflight: Dict[tuple, tuple] = {}
+        self.max_shapes = max_shapes
+        self._shapes: "OrderedDict[tuple, _ShapeStats]" = OrderedDict()
+        self._samples = deque(maxlen=sample_size)
+        self._client = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._explaining = set()
+
+    def attach(self, client, loop: asyncio.AbstractEventLoop):
+        """Client and loop used to run explains"""
+        self._client = client
+        self._loop = loop
+
+    # pymongo CommandListener interface
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        command = event.command
+        key = (event.connection_id, event.request_id)
+        with self._lock:
+            self._inflight[key] = (event.database_name, command)
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool):
+        with self._lock:
+            started = self._inflight.pop((event.connection_id, event.request_id), None)
+        if started is None:
+            return
+        database_name, command = started
+        duration_ms = event.duration_micros / 1000
+        command_name = event.command_name
+        shape = command_shape(command_name, command)
+        namespace = command_namespace(database_name, command_name, command)
+        shape_key = (command_name, namespace, json.dumps(shape, default=str))
+
+        slow = duration_ms >= self.threshold_ms
+        explain = False
+        with self._lock:
+            stats = self._shapes.get(shape_key)
+            if stats is None:
+                stats = self._shapes[shape_key] = _ShapeStats(command_name, namespace, shape, database_name)
+                if len(self._shapes) > self.max_shapes:
+                    self._shapes.popitem(last=False)  # Least recently seen shape
+            else:
+                self._shapes.move_to_end(shape_key)
+            stats.count += 1
+            stats.total_ms += duration_ms
+            if failed:
+                stats.errors += 1
+            if duration_ms >= stats.max_ms:
+                stats.max_ms = duration_ms
+                if command_name in EXPLAINABLE_COMMANDS:
+                    stats.slowest_command = command
+            if slow:
+                stats.slow_count += 1
+                stats.last_slow_at = datetime.utcnow()
+                self._samples.append({
+                    "at": stats.last_slow_at,
+                    "command": command_name,
+                    "namespace": namespace,
+                    "shape": shape,
+                    "duration_ms": round(duration_ms, 3),
+                    "failed": failed,
+                })
+                explain = self._should_explain(shape_key, stats)
+
+        if slow:
+            logger.warning(
+                f"Slow Mongo {command_name} on {namespace} took {duration_ms:.1f} ms: "
+                f"{json.dumps(shape, default=str)}"
+            )
+        if explain:
+            asyncio.run_coroutine_threadsafe(self._explain(shape_key, stats), self._loop)
+
+    def _should_explain(self, shape_key: tuple, stats: _ShapeStats) -> bool:
+        if not self.explain_enabled or self._client is None or self._loop is None:
+            return False
+        if stats.slowest_command is None or shape_key in self._explaining:
+            return False
+        if stats.explain is not None and time.monotonic() - stats.explained_at < self.explain_interval:
+            return False
+        # Only the slowest shapes are worth an extra query
+        slowest = sorted(
+            (entry for entry in self._shapes.values() if entry.slow_count),
+            key=lambda entry: entry.max_ms, reverse=True
+        )[:self.explain_top]
+        if stats not in slowest:
+            return False
+        self._explaining.add(shape_key)
+        return True
+
+    async def _explain(self, shape_key: tuple, stats: _ShapeStats):
+        try:
+            summary = await explain_command(self._client[stats.database], stats.command, stats.slowest_command)
+            with self._lock:
+                stats.explain = summary
+                stats.explained_at = time.monotonic()
+            logger.warning(f"Explain for slow Mongo {stats.command} on {stats.namespace}: {summary['plan']}")
+        except Exception as e:
+            logger.error(f"Explain of slow query failed: {e}")
+        finally:
+            with self._lock:
+                self._explaining.discard(shape_key)
+
+    def report(self, limit: int = 20, sort: str = "total_ms") -> dict:
+        """Top `limit` shapes by total_ms, max_ms, mean_ms, count or slow_count,
+        plus the most recent slow samples"""
+        with self._lock:
+            shapes = [entry.to_dict() for entry in self._shapes.values()]
+            samples = list(self._samples)
+        shapes.sort(key=lambda entry: entry[sort], reverse=True)
+        return {
+            "threshold_ms": self.threshold_ms,
+            "shapes_tracked": len(shapes),
+            "top": shapes[:limit],
+            "recent_slow": samples[::-1],
+        }
+
+    def reset(self):
+        with self._lock:
+            self._shapes.clear()
+            self._samples.clear()
+
+REPORT_SORT_KEYS = ("total_ms", "max_ms", "mean_ms", "count", "slow_count")
+
+def create_profiler() -> Optional[SlowQueryProfiler]:
+    if not settings.SLOW_QUERY_PROFILER_ENABLED:
+        return None
+    return SlowQueryProfiler(
+        threshold_ms=settings.SLOW_QUERY_THRESHOLD_MS,
+        max_shapes=settings.SLOW_QUERY_MAX_SHAPES,
+        sample_size=settings.SLOW_QUERY_SAMPLE_SIZE,
+        explain=settings.SLOW_QUERY_EXPLAIN,
+        explain_top=settings.SLOW_QUERY_EXPLAIN_TOP,
+        explain_interval_seconds=settings.SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS,
+    )
+
+# None unless SLOW_QUERY_PROFILER_ENABLED; registered on the Mongo client by database.py
+slow_query_profiler = create_profiler()
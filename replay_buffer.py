@@ -0,0 +1,139 @@
+"""
+Replay of conversation events missed while a socket was disconnected.
+
+Every new_message(s), marked_as_read and user_typing event this worker delivers
+to a `conversation:{id}` room is numbered from one per-worker sequence and
+kept in a bounded ring buffer per conversation. The event payload carries its
+`seq`; a client that reconnects with the epoch and last seq it saw gets only
+the gap replayed.
+
+Events are recorded where the client manager delivers them to local sockets,
+so with a message queue every worker numbers the events its own sockets
+receive, whichever worker emitted them. Sequences are per worker process
+(`epoch`): reconnecting to another worker, after a restart or past evicted
+events the replay is reported incomplete and the client falls back to
+GET /api/sync.
+"""
+import uuid
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+REPLAYED_EVENTS = ("new_message", "new_messages", "marked_as_read", "user_typing")
+
+# (seq, event, data)
+Event = Tuple[int, str, dict]
+
+class ReplayBuffer:
+    def __init__(self, max_events: int = 50000, max_events_per_conversation: int = 200):
+        self.max_events = max_events
+        self.max_events_per_conversation = max_events_per_conversation
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+
+        # conversation -> events, least recently written conversation first
+        self._events: "OrderedDict[str, Deque[Event]]" = OrderedDict()
+        # conversation -> highest seq it can no longer replay
+        self._floor: Dict[str, int] = {}
+        # Highest seq evicted together with its whole conversation buffer
+        self._evicted_through = 0
+        self._size = 0
+
+        self.metrics = {
+            "recorded": 0,
+            "evictions": 0,
+            "replays": 0,
+            "replays_incomplete": 0,
+            "events_replayed": 0,
+        }
+
+    def record(self, conversation_id: str, event: str, data: dict) -> dict:
+        """Number and buffer an event, returning the payload to deliver"""
+        self.seq += 1
+        data = dict(data, seq=self.seq)
+        events = self._events.get(conversation_id)
+        if events is None:
+            events = self._events[conversation_id] = deque()
+            # Anything of this conversation up to here may have been evicted
+            self._floor[conversation_id] = self._evicted_through
+        else:
+            self._events.move_to_end(conversation_id)
+        events.append((self.seq, event, data))
+        self._size += 1
+        self.metrics["recorded"] += 1
+
+        if len(events) > self.max_events_per_conversation:
+            self._evict(conversation_id)
+        while self._size > self.max_events:
+            self._evict(next(iter(self._events)))
+        return data
+
+    def _evict(self, conversation_id: str):
+        events = self._events[conversation_id]
+        seq, _, _ = events.popleft()
+        self._floor[conversation_id] = seq
+        self._size -= 1
+        self.metrics["evictions"] += 1
+        if not events:
+            del self._events[conversation_id]
+            del self._floor[conversation_id]
+            self._evicted_through = max(self._evicted_through, seq)
+
+    def since(self, conversation_ids: List[str], seq: int) -> Optional[List[Event]]:
+        """Events of the conversations after `seq`, oldest first, or None if
+        some of them are no longer buffered"""
+        self.metrics["replays"] += 1
+        if seq > self.seq:
+            self.metrics["replays_incomplete"] += 1
+            return None
+        missed = []
+        for conversation_id in conversation_ids:
+            events = self._events.get(conversation_id)
+            if self._floor.get(conversation_id, self._evicted_through) > seq:
+                self.metrics["replays_incomplete"] += 1
+                return None
+            if events:
+                missed.extend(event for event in events if event[0] > seq)
+        missed.sort(key=lambda event: event[0])
+        self.metrics["events_replayed"] += len(missed)
+        return missed
+
+    def stamp(self, event: str, data, room) -> dict:
+        """Record an event if it goes to a conversation room"""
+        if event not in REPLAYED_EVENTS or not isinstance(data, dict):
+            return data
+        rooms = room if isinstance(room, list) else [room]
+        for name in rooms:
+            if isinstance(name, str) and name.startswith("conversation:"):
+                return self.record(name.split(":", 1)[1], event, data)
+        return data
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "epoch": self.epoch,
+            "seq": self.seq,
+            "conversations": len(self._events),
+            "events": self._size,
+        }
+
+def record_local_emits(manager, buffer: ReplayBuffer):
+    """Make `manager` record conversation events in `buffer` as it delivers
+    them to this worker's sockets"""
+    if isinstance(manager, AsyncPubSubManager):
+        # Emits from this and every other worker are delivered locally here
+        handle_emit = manager._handle_emit
+
+        async def _handle_emit(message):
+            data = buffer.stamp(message["event"], message["data"], message.get("room"))
+            await handle_emit(dict(message, data=data))
+
+        manager._handle_emit = _handle_emit
+    else:
+        emit = manager.emit
+
+        async def _emit(event, data, namespace, room=None, **kwargs):
+            return await emit(event, buffer.stamp(event, data, room), namespace, room=room, **kwargs)
+
+        manager.emit = _emit
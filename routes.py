@@ -1,14 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Header
+from fastapi import APIRouter, Depends, HTTPException, status, Header, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import List, Optional
+from datetime import datetime
+from pymongo.errors import ExecutionTimeout
 import logging
 
 from models import (
     User, MessageResponse, ConversationResponse, 
-    MessageRequest
+    MessageRequest, MessageSearchHit, ReadReceipt, SyncResponse,
+    GroupCreateRequest, GroupMember
 )
 from chat_service import ChatService
 from auth import verify_token, create_access_token
+from pagination import message_cursor, decode_sync_token, encode_search_cursor
+from serialization import FastJSONResponse, ndjson_chunks
+from config import settings
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -26,6 +33,12 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             headers={"WWW-Authenticate": "Bearer"},
         )
 
+async def get_admin_user(current_user: str = Depends(get_current_user)) -> str:
+    """Get current user, if listed in ADMIN_EMAILS"""
+    if current_user not in settings.ADMIN_EMAILS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
 @router.post("/auth/login")
 async def login(email: str, name: str, profile_image: Optional[str] = None):
     """
@@ -77,6 +90,9 @@ async def get_current_user_info(current_user: str = Depends(get_current_user)):
 async def get_conversations(current_user: str = Depends(get_current_user)):
     """Get all conversations for the current user"""
     try:
+        if settings.FAST_JSON_RESPONSES:
+            conversations = await ChatService.get_user_conversations_raw(current_user)
+            return FastJSONResponse(conversations)
         conversations = await ChatService.get_user_conversations(current_user)
         return conversations
     except Exception as e:
@@ -86,14 +102,40 @@ async def get_conversations(current_user: str = Depends(get_current_user)):
 @router.get("/conversations/{conversation_id}/messages", response_model=List[MessageResponse])
 async def get_conversation_messages(
     conversation_id: str,
+    response: Response,
     skip: int = 0,
     limit: int = 50,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
     current_user: str = Depends(get_current_user)
 ):
-    """Get messages from a specific conversation"""
+    """Get messages from a specific conversation
+    
+    Pass the X-Next-Cursor response header back as `before` to load older
+    messages (or as `after` when paging forward with `after`).
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
     try:
-        messages = await ChatService.get_conversation_messages(conversation_id, skip, limit)
+        if not await ChatService.is_participant(conversation_id, current_user):
+            raise HTTPException(status_code=403, detail="Not a member of this conversation")
+        messages = await ChatService.get_conversation_messages_raw(
+            conversation_id, skip, limit, before=before, after=after
+        )
+        headers = {}
+        if len(messages) == limit:
+            edge = messages[-1] if after else messages[0]
+            headers["X-Next-Cursor"] = message_cursor(edge)
+        
+        if settings.FAST_JSON_RESPONSES:
+            # Encode the projected documents directly, skipping response_model
+            return FastJSONResponse(messages, headers=headers)
+        response.headers.update(headers)
         return messages
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Get messages error: {e}")
         raise HTTPException(status_code=500, detail="Failed to get messages")
@@ -105,12 +147,103 @@ async def mark_conversation_read(
 ):
     """Mark a conversation as read for the current user"""
     try:
-        await ChatService.mark_conversation_as_read(conversation_id, current_user)
-        return {"message": "Conversation marked as read"}
+        if not await ChatService.is_participant(conversation_id, current_user):
+            raise HTTPException(status_code=403, detail="Not a member of this conversation")
+        read_state = await ChatService.mark_conversation_as_read(conversation_id, current_user)
+        return {
+            "message": "Conversation marked as read",
+            "last_read_message_id": read_state["last_read_message_id"] if read_state else None,
+            "last_read_at": read_state["last_read_at"] if read_state else None
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Mark as read error: {e}")
         raise HTTPException(status_code=500, detail="Failed to mark conversation as read")
 
+@router.get("/conversations/{conversation_id}/read-receipts", response_model=List[ReadReceipt])
+async def get_read_receipts(
+    conversation_id: str,
+    current_user: str = Depends(get_current_user)
+):
+    """Get how far each participant has read a conversation (members only)"""
+    try:
+        if not await ChatService.is_participant(conversation_id, current_user):
+            raise HTTPException(status_code=403, detail="Not a member of this conversation")
+        return await ChatService.get_read_receipts(conversation_id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Get read receipts error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get read receipts")
+
+async def _log_export_errors(chunks):
+    # Headers are already sent once streaming starts, so a failure can only
+    # be logged and the response cut short
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        logger.error(f"Export error: {e}")
+        raise
+
+@router.get("/conversations/{conversation_id}/export")
+async def export_conversation(
+    conversation_id: str,
+    gzip: bool = False,
+    current_user: str = Depends(get_current_user)
+):
+    """Stream the whole conversation history as newline-delimited JSON,
+    oldest message first"""
+    try:
+        allowed = await ChatService.is_participant(conversation_id, current_user)
+    except Exception as e:
+        logger.error(f"Export error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to export conversation")
+    if not allowed:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    filename = f"conversation-{conversation_id}.ndjson" + (".gz" if gzip else "")
+    chunks = ndjson_chunks(
+        ChatService.export_messages(conversation_id),
+        compress=gzip,
+        chunk_bytes=settings.EXPORT_CHUNK_BYTES
+    )
+    return StreamingResponse(
+        _log_export_errors(chunks),
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@router.get("/sync", response_model=SyncResponse)
+async def sync(token: Optional[str] = None, current_user: str = Depends(get_current_user)):
+    """Changes since a sync token: conversations, new messages and read states.
+    
+    Call without a token (or after a `reset` reply) to get a token, then
+    reload everything and pass the token to the next sync.
+    """
+    try:
+        since = decode_sync_token(token) if token else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        changes = await ChatService.sync(current_user, since)
+        if settings.FAST_JSON_RESPONSES:
+            return FastJSONResponse(changes)
+        return changes
+    except Exception as e:
+        logger.error(f"Sync error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to sync")
+
+@router.get("/unread")
+async def get_unread(current_user: str = Depends(get_current_user)):
+    """Get the total number of unread messages across all conversations"""
+    try:
+        return await ChatService.get_total_unread(current_user)
+    except Exception as e:
+        logger.error(f"Get unread error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get unread count")
+
 @router.post("/conversations/start")
 async def start_conversation(
     to_email: str,
@@ -136,6 +269,71 @@ async def start_conversation(
         logger.error(f"Start conversation error: {e}")
         raise HTTPException(status_code=500, detail="Failed to start conversation")
 
+@router.post("/groups", response_model=ConversationResponse)
+async def create_group(
+    group_request: GroupCreateRequest,
+    current_user: str = Depends(get_current_user)
+):
+    """Create a group conversation with the current user as owner"""
+    if not group_request.name.strip():
+        raise HTTPException(status_code=400, detail="Group name is required")
+    try:
+        return await ChatService.create_group(current_user, group_request.name.strip(), group_request.members)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Create group error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create group")
+
+@router.post("/groups/{conversation_id}/join")
+async def join_group(
+    conversation_id: str,
+    current_user: str = Depends(get_current_user)
+):
+    """Join a group conversation (then emit join_conversation on the socket)"""
+    try:
+        joined = await ChatService.join_group(conversation_id, current_user)
+    except Exception as e:
+        logger.error(f"Join group error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to join group")
+    if joined is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return {"conversation_id": conversation_id, "joined": joined}
+
+@router.post("/groups/{conversation_id}/leave")
+async def leave_group(
+    conversation_id: str,
+    request: Request,
+    current_user: str = Depends(get_current_user)
+):
+    """Leave a group conversation; the user's sockets leave its room too"""
+    try:
+        left = await ChatService.leave_group(conversation_id, current_user)
+        if left:
+            await request.app.state.socket_handler.remove_from_conversation(current_user, conversation_id)
+        return {"conversation_id": conversation_id, "left": left}
+    except Exception as e:
+        logger.error(f"Leave group error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to leave group")
+
+@router.get("/groups/{conversation_id}/members", response_model=List[GroupMember])
+async def get_group_members(
+    conversation_id: str,
+    skip: int = 0,
+    limit: int = 100,
+    current_user: str = Depends(get_current_user)
+):
+    """Members of a group, one page at a time (members only)"""
+    try:
+        if await ChatService.get_member_conversation_type(conversation_id, current_user) != "group":
+            raise HTTPException(status_code=404, detail="Group not found")
+        return await ChatService.get_group_members(conversation_id, max(skip, 0), min(max(limit, 1), 500))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Get group members error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to get group members")
+
 @router.post("/messages/send")
 async def send_message_rest(
     message_request: MessageRequest,
@@ -148,15 +346,21 @@ async def send_message_rest(
         if not sender_user:
             raise HTTPException(status_code=404, detail="Sender not found")
         
-        # Check if recipient exists
-        recipient_user = await ChatService.get_user_by_email(message_request.to_email)
-        if not recipient_user:
-            raise HTTPException(status_code=404, detail="Recipient not found")
-        
-        # Create or get conversation
-        conversation_id = await ChatService.create_or_get_conversation(
-            current_user, message_request.to_email
-        )
+        if message_request.conversation_id:
+            # A conversation the sender is in (direct or group)
+            conversation_id = message_request.conversation_id
+            if not await ChatService.is_participant(conversation_id, current_user):
+                raise HTTPException(status_code=404, detail="Conversation not found")
+        else:
+            # Check if recipient exists
+            recipient_user = await ChatService.get_user_by_email(message_request.to_email)
+            if not recipient_user:
+                raise HTTPException(status_code=404, detail="Recipient not found")
+            
+            # Create or get conversation
+            conversation_id = await ChatService.create_or_get_conversation(
+                current_user, message_request.to_email
+            )
         
         # Send message
         message = await ChatService.send_message(
@@ -184,41 +388,52 @@ async def send_message_rest(
         logger.error(f"Send message REST error: {e}")
         raise HTTPException(status_code=500, detail="Failed to send message")
 
+@router.get("/messages/search", response_model=List[MessageSearchHit])
+async def search_messages(
+    q: str,
+    response: Response,
+    conversation_id: Optional[str] = None,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = 20,
+    current_user: str = Depends(get_current_user)
+):
+    """Full-text search over the current user's messages, best matches first
+    
+    Pass the X-Next-Cursor response header back as `cursor` for the next page.
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is required")
+    limit = min(max(limit, 1), 50)
+    try:
+        hits = await ChatService.search_messages(
+            current_user, q,
+            conversation_id=conversation_id,
+            start=start_date,
+            end=end_date,
+            cursor=cursor,
+            limit=limit
+        )
+        if len(hits) == limit:
+            response.headers["X-Next-Cursor"] = encode_search_cursor(hits[-1].score, hits[-1].timestamp, hits[-1].id)
+        return hits
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ExecutionTimeout:
+        raise HTTPException(status_code=504, detail="Search took too long, try a more specific query")
+    except Exception as e:
+        logger.error(f"Search messages error: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search messages")
+
 @router.get("/users/search")
 async def search_users(
     query: str,
     current_user: str = Depends(get_current_user)
 ):
-    """Search for users by email or name"""
+    """Search for users by email or name prefix"""
     try:
-        # This is a basic implementation - you might want to integrate with your existing user system
-        # For now, we'll just return users from the chat system
-        from database import get_users_collection
-        users_collection = await get_users_collection()
-        
-        # Search by email or name (case insensitive)
-        cursor = users_collection.find({
-            "$and": [
-                {"email": {"$ne": current_user}},  # Exclude current user
-                {
-                    "$or": [
-                        {"email": {"$regex": query, "$options": "i"}},
-                        {"name": {"$regex": query, "$options": "i"}}
-                    ]
-                }
-            ]
-        }).limit(10)
-        
-        users = []
-        async for user in cursor:
-            users.append({
-                "email": user["email"],
-                "name": user["name"],
-                "profile_image": user.get("profile_image"),
-                "is_online": user.get("is_online", False)
-            })
-        
-        return users
+        return await ChatService.search_users(query, exclude_email=current_user)
     except Exception as e:
         logger.error(f"Search users error: {e}")
         raise HTTPException(status_code=500, detail="Failed to search users") 
\ No newline at end of file
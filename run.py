@@ -7,6 +7,9 @@ import sys
 import argparse
 import uvicorn
 
+from config import settings
+from worker_bus import is_local_bus_url, start_broker_thread
+
 def main():
     parser = argparse.ArgumentParser(description='Chat Socket Backend Server')
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to')
@@ -20,12 +23,19 @@ def main():
     # Determine the app to run
     app_module = "main:socket_app"
     
+    # Workers connect to a message bus broker hosted by this supervisor process
+    if is_local_bus_url(settings.SOCKETIO_MESSAGE_QUEUE):
+        start_broker_thread(settings.SOCKETIO_MESSAGE_QUEUE)
+        print(f"📡 Socket.IO message bus: {settings.SOCKETIO_MESSAGE_QUEUE}")
+    
     # Set log level
     log_level = "info" if args.production else "debug"
     
     if args.production:
         print(f"🚀 Starting Chat Backend in PRODUCTION mode on {args.host}:{args.port}")
         print(f"   Workers: {args.workers}")
+        if args.workers > 1 and not settings.SOCKETIO_MESSAGE_QUEUE:
+            print("⚠️  SOCKETIO_MESSAGE_QUEUE is not set: events will not reach sockets on other workers")
         uvicorn.run(
             app_module,
             host=args.host,
@@ -0,0 +1,105 @@
+"""
+Fast JSON encoding for history and inbox responses.
+
+Raw Mongo documents are projected to plain dicts with the same fields as
+MessageResponse/ConversationResponse and encoded directly, skipping model
+construction and FastAPI's response_model validation. orjson is used when
+installed (it encodes datetimes natively); otherwise the stdlib encoder.
+"""
+import json
+import zlib
+from datetime import datetime
+from typing import Any, AsyncIterator
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Fields read from chat_messages for a MessageResponse
+MESSAGE_PROJECTION = {
+    "conversation_id": 1,
+    "sender_email": 1,
+    "sender_name": 1,
+    "message": 1,
+    "timestamp": 1,
+    "message_type": 1,
+    "edited": 1,
+    "reply_to": 1,
+}
+
+# Fields read from conversations for a ConversationResponse
+CONVERSATION_PROJECTION = {
+    "participants": 1,
+    "conversation_type": 1,
+    "name": 1,
+    "member_count": 1,
+    "last_message": 1,
+    "last_message_time": 1,
+    "last_message_sender": 1,
+    "last_message_id": 1,
+}
+
+def message_to_dict(message: dict) -> dict:
+    return {
+        "id": str(message["_id"]),
+        "conversation_id": message["conversation_id"],
+        "sender_email": message["sender_email"],
+        "sender_name": message["sender_name"],
+        "message": message["message"],
+        "timestamp": message["timestamp"],
+        "message_type": message["message_type"],
+        "edited": message.get("edited", False),
+        "reply_to": message.get("reply_to"),
+    }
+
+def conversation_to_dict(conv: dict, unread_count: int = 0) -> dict:
+    return {
+        "conversation_id": str(conv["_id"]),
+        "participants": conv.get("participants", []),
+        "conversation_type": conv.get("conversation_type", "direct"),
+        "name": conv.get("name"),
+        "member_count": conv.get("member_count"),
+        "last_message": conv.get("last_message"),
+        "last_message_time": conv.get("last_message_time"),
+        "last_message_sender": conv.get("last_message_sender"),
+        "unread_count": unread_count,
+    }
+
+def _default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def dumps(content: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, default=_default)
+    return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+async def ndjson_chunks(records: AsyncIterator[Any], compress: bool = False,
+                        chunk_bytes: int = 65536) -> AsyncIterator[bytes]:
+    """Encode records as newline-delimited JSON, yielded in chunks of about
+    `chunk_bytes` (gzip-compressed with `compress`). Records are only pulled
+    when the consumer asks for the next chunk."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    buffer = bytearray()
+    async for record in records:
+        buffer += dumps(record)
+        buffer += b"\n"
+        if len(buffer) >= chunk_bytes:
+            chunk = compressor.compress(bytes(buffer)) if compressor else bytes(buffer)
+            buffer.clear()
+            if chunk:
+                yield chunk
+    chunk = compressor.compress(bytes(buffer)) + compressor.flush() if compressor else bytes(buffer)
+    if chunk:
+        yield chunk
+
+class FastJSONResponse(Response):
+    """JSON response encoded with `dumps`, bypassing jsonable_encoder"""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,80 @@
+from typing import Dict, Optional, Set, List
+import time
+
+class Session:
+    """A single connected socket belonging to a user"""
+    __slots__ = ("sid", "email", "name", "connected_at")
+
+    def __init__(self, sid: str, email: str, name: Optional[str] = None):
+        self.sid = sid
+        self.email = email
+        self.name = name
+        self.connected_at = time.time()
+
+class SessionRegistry:
+    """Bidirectional index of connected sockets.
+
+    Keeps sid -> Session and email -> set of sids so every lookup is O(1)
+    and a user can be connected from several devices/tabs at once.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, Session] = {}
+        self._sids_by_email: Dict[str, Set[str]] = {}
+
+    def add(self, sid: str, email: str, name: Optional[str] = None) -> bool:
+        """Register a session. Returns True if this is the user's first session"""
+        if sid in self._sessions:
+            self.remove(sid)
+
+        self._sessions[sid] = Session(sid, email, name)
+        sids = self._sids_by_email.get(email)
+        if sids is None:
+            self._sids_by_email[email] = {sid}
+            return True
+        sids.add(sid)
+        return False
+
+    def remove(self, sid: str) -> Optional[Session]:
+        """Unregister a session and return it (None if unknown)"""
+        session = self._sessions.pop(sid, None)
+        if session is None:
+            return None
+
+        sids = self._sids_by_email.get(session.email)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids_by_email[session.email]
+        return session
+
+    def get(self, sid: str) -> Optional[Session]:
+        return self._sessions.get(sid)
+
+    def get_email(self, sid: str) -> Optional[str]:
+        session = self._sessions.get(sid)
+        return session.email if session else None
+
+    def get_sids(self, email: str) -> Set[str]:
+        return set(self._sids_by_email.get(email, ()))
+
+    def sid_count(self, email: str) -> int:
+        return len(self._sids_by_email.get(email, ()))
+
+    def is_online(self, email: str) -> bool:
+        return email in self._sids_by_email
+
+    def online_emails(self) -> List[str]:
+        return list(self._sids_by_email.keys())
+
+    def session_count(self) -> int:
+        return len(self._sessions)
+
+    def user_count(self) -> int:
+        return len(self._sids_by_email)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, sid: str) -> bool:
+        return sid in self._sessions
@@ -1,24 +1,112 @@
 import socketio
-from typing import Dict
 from auth import verify_token
 from chat_service import ChatService
 from models import MessageRequest
+from session_registry import SessionRegistry
+from presence import create_presence_store, PresenceBroadcaster
+from typing_manager import TypingManager
+from replay_buffer import ReplayBuffer, record_local_emits
+from group_fanout import GroupFanout
+from config import settings
+import metrics
 import asyncio
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Store user socket mappings
-connected_users: Dict[str, str] = {}  # {email: socket_id}
+# Store user socket mappings (sid -> session, email -> sids)
+session_registry = SessionRegistry()
+
+# Online/offline state, shared across workers when a message queue is configured
+presence_store = create_presence_store(session_registry)
 
 class SocketHandler:
     def __init__(self, sio: socketio.AsyncServer):
         self.sio = sio
+        self.typing = TypingManager(
+            self._emit_typing,
+            flush_interval_ms=settings.TYPING_FLUSH_INTERVAL_MS,
+            timeout_seconds=settings.TYPING_TIMEOUT_SECONDS,
+            max_emits_per_room=settings.TYPING_MAX_EMITS_PER_ROOM
+        )
+        self.presence = PresenceBroadcaster(
+            self._emit_presence,
+            ChatService.get_user_contacts,
+            flush_interval_ms=settings.PRESENCE_FLUSH_INTERVAL_MS,
+            debounce_seconds=settings.PRESENCE_DEBOUNCE_SECONDS
+        )
+        self.group_fanout = GroupFanout(
+            self._emit_group_messages,
+            flush_interval_ms=settings.GROUP_EMIT_INTERVAL_MS,
+            max_batch=settings.GROUP_EMIT_MAX_BATCH
+        )
+        self.replay = ReplayBuffer(
+            max_events=settings.REPLAY_MAX_EVENTS,
+            max_events_per_conversation=settings.REPLAY_MAX_EVENTS_PER_CONVERSATION
+        )
+        record_local_emits(sio.manager, self.replay)
         self.setup_handlers()
     
+    async def _emit_presence(self, contact_email: str, diff: dict):
+        await self.sio.emit('presence_update', diff, room=f"user:{contact_email}")
+    
+    async def _emit_group_messages(self, conversation_id: str, messages: list):
+        await self.sio.emit('new_messages', {
+            'conversation_id': conversation_id,
+            'messages': messages
+        }, room=f"conversation:{conversation_id}")
+    
+    async def remove_from_conversation(self, email: str, conversation_id: str):
+        """Take every session of the user, on any worker, out of the
+        conversation room (sessions of other workers are left through the
+        message queue) and tell the user's clients"""
+        room = f"conversation:{conversation_id}"
+        for sid in await presence_store.sids(email):
+            await self.sio.leave_room(sid, room)
+        await self.sio.emit('left_conversation', {'conversation_id': conversation_id}, room=f"user:{email}")
+    
+    async def _emit_typing(self, conversation_id: str, user_email: str, typing: bool):
+        await self.sio.emit('user_typing', {
+            'conversation_id': conversation_id,
+            'user_email': user_email,
+            'typing': typing
+        }, room=f"conversation:{conversation_id}", skip_sid=list(session_registry.get_sids(user_email)))
+    
+    async def _replay_missed_events(self, sid: str, email: str, conversation_ids: list, last_seen):
+        """Send the socket what its conversation rooms received after the
+        `{epoch, seq}` it last saw, in one `replay` event. `complete` is False
+        when the gap cannot be replayed (or none was asked for) and the client
+        has to fall back to GET /api/sync"""
+        events = None
+        if isinstance(last_seen, dict) and last_seen.get('epoch') == self.replay.epoch:
+            events = self.replay.since(conversation_ids, int(last_seen.get('seq', 0)))
+        await self.sio.emit('replay', {
+            'epoch': self.replay.epoch,
+            'seq': self.replay.seq,
+            'complete': events is not None,
+            'events': [
+                {'event': event, 'data': data}
+                for _, event, data in events or ()
+                if not (event == 'user_typing' and data.get('user_email') == email)
+            ]
+        }, room=sid)
+    
+    def _enter_rooms(self, sid: str, rooms: list):
+        """Join a local socket to many rooms at once without a round trip
+        through the (possibly pub/sub) client manager per room"""
+        for room in rooms:
+            self.sio.manager.basic_enter_room(sid, '/', room)
+    
+    def _event(self, handler):
+        """Register a Socket.IO event handler, timed when metrics are enabled"""
+        if settings.METRICS_ENABLED:
+            handler = metrics.time_socket_handler(handler)
+        self.sio.on(handler.__name__, handler)
+        return handler
+    
     def setup_handlers(self):
-        @self.sio.event
-        async def connect(sid, environ, auth):
+        @self._event
+        async def connect(sid, environ, auth=None):
             """Handle client connection"""
             try:
                 # Verify JWT token
@@ -29,8 +117,11 @@ class SocketHandler:
                 
                 email = verify_token(token)
                 
-                # Store user connection
-                connected_users[email] = sid
+                # Store user connection (a user may have several sessions);
+                # the session keeps the display name so sends need no user read
+                user = await ChatService.get_user_by_email(email)
+                session_registry.add(sid, email, user.name if user else None)
+                first_session = await presence_store.add(sid, email)
                 
                 # Update user online status
                 await ChatService.update_user_online_status(email, True, sid)
@@ -38,81 +129,108 @@ class SocketHandler:
                 # Join user to their personal room
                 await self.sio.enter_room(sid, f"user:{email}")
                 
-                # Get user's conversations and join those rooms
-                conversations = await ChatService.get_user_conversations(email)
-                for conv in conversations:
-                    await self.sio.enter_room(sid, f"conversation:{conv.conversation_id}")
+                # Join only the most recently active conversation rooms; others are
+                # joined on demand (join_conversation / sending a message) and new
+                # messages also reach participants through their user rooms.
+                # Group messages only go to the group room, so every group is joined
+                conversation_ids = await ChatService.get_user_conversation_ids(
+                    email, limit=settings.CONNECT_ROOM_JOIN_LIMIT
+                )
+                joined = set(conversation_ids)
+                conversation_ids += [
+                    group_id for group_id in await ChatService.get_user_group_ids(email)
+                    if group_id not in joined
+                ]
+                self._enter_rooms(sid, [f"conversation:{conversation_id}" for conversation_id in conversation_ids])
                 
-                # Notify other users that this user is online
-                await self.sio.emit('user_online', {'email': email}, skip_sid=sid)
+                # Events of those rooms missed since the client's last seen seq
+                await self._replay_missed_events(sid, email, conversation_ids, auth.get('replay'))
+                
+                # Notify the user's contacts (batched) that this user is online
+                if first_session:
+                    self.presence.user_online(email)
                 
                 logger.info(f"User {email} connected with socket {sid}")
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('connect')
                 logger.error(f"Connection error: {e}")
+                session = session_registry.remove(sid)
+                if session:
+                    await presence_store.remove(sid, session.email)
                 await self.sio.disconnect(sid)
                 return False
         
-        @self.sio.event
+        @self._event
         async def disconnect(sid):
             """Handle client disconnection"""
             try:
-                # Find user by socket ID
-                user_email = None
-                for email, socket_id in connected_users.items():
-                    if socket_id == sid:
-                        user_email = email
-                        break
-                
-                if user_email:
-                    # Remove from connected users
-                    del connected_users[user_email]
+                # Remove from connected users
+                session = session_registry.remove(sid)
+                
+                if session and not session_registry.is_online(session.email):
+                    # No sessions left on this worker to keep typing alive
+                    self.typing.clear_user(session.email)
+                
+                if session and await presence_store.remove(sid, session.email):
+                    user_email = session.email
                     
                     # Update user offline status
                     await ChatService.update_user_online_status(user_email, False)
                     
-                    # Notify other users that this user is offline
-                    await self.sio.emit('user_offline', {'email': user_email}, skip_sid=sid)
+                    # Notify the user's contacts (batched, debounced) that this user is offline
+                    self.presence.user_offline(user_email)
                     
                     logger.info(f"User {user_email} disconnected")
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('disconnect')
                 logger.error(f"Disconnection error: {e}")
         
-        @self.sio.event
+        @self._event
         async def send_message(sid, data):
             """Handle sending a message"""
             try:
                 # Get sender info from connected users
-                sender_email = None
-                for email, socket_id in connected_users.items():
-                    if socket_id == sid:
-                        sender_email = email
-                        break
+                session = session_registry.get(sid)
                 
-                if not sender_email:
+                if not session:
                     await self.sio.emit('error', {'message': 'User not authenticated'}, room=sid)
                     return
                 
-                # Get sender user info
-                sender_user = await ChatService.get_user_by_email(sender_email)
-                if not sender_user:
-                    await self.sio.emit('error', {'message': 'Sender not found'}, room=sid)
-                    return
+                sender_email = session.email
+                sender_name = session.name
+                
+                # Get sender user info if the session has no display name yet
+                if sender_name is None:
+                    sender_user = await ChatService.get_user_by_email(sender_email)
+                    if not sender_user:
+                        await self.sio.emit('error', {'message': 'Sender not found'}, room=sid)
+                        return
+                    sender_name = session.name = sender_user.name
                 
                 # Validate message data
                 message_request = MessageRequest(**data)
                 
-                # Create or get conversation
-                conversation_id = await ChatService.create_or_get_conversation(
-                    sender_email, message_request.to_email
-                )
+                # Create or get the direct conversation, or check the sender is in
+                # the given one
+                if message_request.conversation_id:
+                    conversation_id = message_request.conversation_id
+                    conversation_type = await ChatService.get_member_conversation_type(conversation_id, sender_email)
+                    if conversation_type is None:
+                        await self.sio.emit('error', {'message': 'Conversation not found'}, room=sid)
+                        return
+                else:
+                    conversation_id = await ChatService.create_or_get_conversation(
+                        sender_email, message_request.to_email
+                    )
+                    conversation_type = "direct"
                 
                 # Send message
                 message = await ChatService.send_message(
                     conversation_id=conversation_id,
                     sender_email=sender_email,
-                    sender_name=sender_user.name,
+                    sender_name=sender_name,
                     message_content=message_request.message,
                     message_type=message_request.message_type,
                     reply_to=message_request.reply_to
@@ -123,43 +241,66 @@ class SocketHandler:
                     'id': str(message.id),
                     'conversation_id': conversation_id,
                     'sender_email': sender_email,
-                    'sender_name': sender_user.name,
+                    'sender_name': sender_name,
                     'message': message_request.message,
                     'timestamp': message.timestamp.isoformat(),
                     'message_type': message_request.message_type,
                     'reply_to': message_request.reply_to
                 }
                 
-                # Broadcast to conversation room
-                await self.sio.emit('new_message', message_data, room=f"conversation:{conversation_id}")
+                # Sending ends the sender's typing indicator
+                self.typing.stop_typing(conversation_id, sender_email, count_event=False)
                 
-                # Send notification to recipient if they're online
-                recipient_socket_id = connected_users.get(message_request.to_email)
-                if recipient_socket_id:
-                    await self.sio.emit('message_notification', {
-                        'conversation_id': conversation_id,
-                        'sender_email': sender_email,
-                        'sender_name': sender_user.name,
-                        'message': message_request.message
-                    }, room=recipient_socket_id)
+                # The sender subscribes to the conversation on demand
+                conversation_room = f"conversation:{conversation_id}"
+                await self.sio.enter_room(sid, conversation_room)
+                
+                if conversation_type == "group":
+                    # Members are in the group room; messages to it are batched
+                    # per tick and no per-member notification is sent
+                    self.group_fanout.add(conversation_id, message_data)
+                    return
+                
+                # Broadcast to the conversation room and the participants' user rooms
+                # (sockets that have not joined the conversation room yet)
+                await self.sio.emit('new_message', message_data, room=[conversation_room] + [
+                    f"user:{participant}" for participant in message.participants
+                ])
+                
+                # Send notification to every session of each recipient, on any worker
+                recipients = [p for p in message.participants if p != sender_email] or [
+                    email for email in [message_request.to_email] if email
+                ]
+                await self.sio.emit('message_notification', {
+                    'conversation_id': conversation_id,
+                    'sender_email': sender_email,
+                    'sender_name': sender_name,
+                    'message': message_request.message
+                }, room=[f"user:{recipient}" for recipient in recipients])
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('send_message')
                 logger.error(f"Send message error: {e}")
                 await self.sio.emit('error', {'message': 'Failed to send message'}, room=sid)
         
-        @self.sio.event
+        @self._event
         async def join_conversation(sid, data):
             """Join a conversation room"""
             try:
+                user_email = session_registry.get_email(sid)
                 conversation_id = data.get('conversation_id')
-                if conversation_id:
+                if conversation_id and user_email:
+                    if await ChatService.get_member_conversation_type(conversation_id, user_email) is None:
+                        await self.sio.emit('error', {'message': 'Conversation not found'}, room=sid)
+                        return
                     await self.sio.enter_room(sid, f"conversation:{conversation_id}")
                     await self.sio.emit('joined_conversation', {'conversation_id': conversation_id}, room=sid)
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('join_conversation')
                 logger.error(f"Join conversation error: {e}")
         
-        @self.sio.event
+        @self._event
         async def leave_conversation(sid, data):
             """Leave a conversation room"""
             try:
@@ -169,89 +310,104 @@ class SocketHandler:
                     await self.sio.emit('left_conversation', {'conversation_id': conversation_id}, room=sid)
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('leave_conversation')
                 logger.error(f"Leave conversation error: {e}")
         
-        @self.sio.event
+        @self._event
         async def mark_as_read(sid, data):
             """Mark conversation as read"""
             try:
                 # Get user info from connected users
-                user_email = None
-                for email, socket_id in connected_users.items():
-                    if socket_id == sid:
-                        user_email = email
-                        break
+                user_email = session_registry.get_email(sid)
                 
                 if not user_email:
                     return
                 
                 conversation_id = data.get('conversation_id')
                 if conversation_id:
-                    await ChatService.mark_conversation_as_read(conversation_id, user_email)
+                    if await ChatService.get_member_conversation_type(conversation_id, user_email) is None:
+                        await self.sio.emit('error', {'message': 'Conversation not found'}, room=sid)
+                        return
+                    read_state = await ChatService.mark_conversation_as_read(conversation_id, user_email)
+                    # Receipts go to the conversation, except in groups where only
+                    # the reader's other sessions are told
+                    room = f"conversation:{conversation_id}"
+                    if read_state and read_state['conversation_type'] == "group":
+                        room = f"user:{user_email}"
                     await self.sio.emit('marked_as_read', {
                         'conversation_id': conversation_id,
-                        'user_email': user_email
-                    }, room=f"conversation:{conversation_id}")
+                        'user_email': user_email,
+                        'last_read_message_id': read_state['last_read_message_id'] if read_state else None,
+                        'last_read_at': read_state['last_read_at'].isoformat() if read_state else None
+                    }, room=room)
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('mark_as_read')
                 logger.error(f"Mark as read error: {e}")
         
-        @self.sio.event
+        @self._event
         async def typing_start(sid, data):
             """Handle typing start event"""
             try:
                 # Get user info from connected users
-                user_email = None
-                for email, socket_id in connected_users.items():
-                    if socket_id == sid:
-                        user_email = email
-                        break
+                user_email = session_registry.get_email(sid)
                 
                 if not user_email:
                     return
                 
                 conversation_id = data.get('conversation_id')
                 if conversation_id:
-                    await self.sio.emit('user_typing', {
-                        'conversation_id': conversation_id,
-                        'user_email': user_email,
-                        'typing': True
-                    }, room=f"conversation:{conversation_id}", skip_sid=sid)
+                    # Coalesced and flushed to the room on the next typing tick
+                    self.typing.start_typing(conversation_id, user_email)
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('typing_start')
                 logger.error(f"Typing start error: {e}")
         
-        @self.sio.event
+        @self._event
         async def typing_stop(sid, data):
             """Handle typing stop event"""
             try:
                 # Get user info from connected users
-                user_email = None
-                for email, socket_id in connected_users.items():
-                    if socket_id == sid:
-                        user_email = email
-                        break
+                user_email = session_registry.get_email(sid)
                 
                 if not user_email:
                     return
                 
                 conversation_id = data.get('conversation_id')
                 if conversation_id:
-                    await self.sio.emit('user_typing', {
-                        'conversation_id': conversation_id,
-                        'user_email': user_email,
-                        'typing': False
-                    }, room=f"conversation:{conversation_id}", skip_sid=sid)
+                    self.typing.stop_typing(conversation_id, user_email)
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('typing_stop')
                 logger.error(f"Typing stop error: {e}")
         
-        @self.sio.event
-        async def get_online_users(sid):
-            """Get list of online users"""
+        @self._event
+        async def get_online_users(sid, data=None):
+            """Get which of the given emails (default: the user's contacts) are
+            online. Only contacts are answered for, like presence updates"""
             try:
-                online_users = list(connected_users.keys())
+                user_email = session_registry.get_email(sid)
+                
+                if not user_email:
+                    return
+                
+                emails = data.get('emails') if isinstance(data, dict) else None
+                if emails is not None and (
+                    not isinstance(emails, list) or len(emails) > settings.ONLINE_USERS_MAX_EMAILS
+                ):
+                    await self.sio.emit('error', {
+                        'message': f'emails must be a list of at most {settings.ONLINE_USERS_MAX_EMAILS} emails'
+                    }, room=sid)
+                    return
+                
+                contacts = await ChatService.get_user_contacts(user_email)
+                if emails is not None:
+                    contact_set = set(contacts)
+                    contacts = [email for email in emails if isinstance(email, str) and email in contact_set]
+                online_users = await presence_store.online_emails(contacts)
                 await self.sio.emit('online_users', {'users': online_users}, room=sid)
                 
             except Exception as e:
+                metrics.SOCKET_HANDLER_ERRORS.inc('get_online_users')
                 logger.error(f"Get online users error: {e}") 
\ No newline at end of file
@@ -0,0 +1,29 @@
+"""
+Shared fixtures: ChatService running on the in-memory stand-in from
+benchmarks/memory_mongo.py, with empty caches for every test
+"""
+import asyncio
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+@pytest.fixture
+def memory_db():
+    import chat_service
+    import database
+    from cache import LRUCache
+    from indexes import build_indexes
+    from memory_mongo import MemoryDatabase
+
+    for value in vars(chat_service).values():
+        if isinstance(value, LRUCache):
+            value.clear()
+    database.db.database = MemoryDatabase()
+    asyncio.run(build_indexes(database.db.database))
+    yield database.db.database
+    database.db.database = None
@@ -0,0 +1,126 @@
+"""
+Tests for the in-process caches (cache.py) and the direct conversation
+lookup built on them
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache, SingleFlight
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # a is now the most recent
+    cache.set("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert len(cache) == 2
+
+def test_lru_counts_hits_and_misses():
+    cache = LRUCache(10)
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("missing")
+    cache.get("missing", "default")
+
+    assert cache.stats() == {"size": 1, "maxsize": 10, "hits": 1, "misses": 2, "hit_ratio": 0.3333}
+
+def test_lru_pop_and_clear():
+    cache = LRUCache(10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+
+    assert cache.pop("a") == 1
+    assert cache.pop("a", "gone") == "gone"
+    cache.clear()
+    assert len(cache) == 0
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def lookup():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "conversation"
+
+    async def scenario():
+        return await asyncio.gather(*[flight.run("pair", lookup) for _ in range(5)])
+
+    assert asyncio.run(scenario()) == ["conversation"] * 5
+    assert len(calls) == 1
+
+def test_single_flight_error_reaches_every_caller_and_is_not_cached():
+    flight = SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("mongo down")
+
+    async def working():
+        return "ok"
+
+    async def scenario():
+        results = await asyncio.gather(*[flight.run("pair", failing) for _ in range(3)], return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert len(calls) == 1
+        # The failure is not remembered: the next call runs again
+        return await flight.run("pair", working)
+
+    assert asyncio.run(scenario()) == "ok"
+
+def test_single_flight_keys_are_independent():
+    flight = SingleFlight()
+
+    async def value(v):
+        await asyncio.sleep(0.01)
+        return v
+
+    async def scenario():
+        return await asyncio.gather(flight.run("a", lambda: value(1)), flight.run("b", lambda: value(2)))
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+def test_direct_conversation_is_found_by_either_participant(memory_db):
+    from chat_service import ChatService
+
+    first = asyncio.run(ChatService.create_or_get_conversation("a@example.com", "b@example.com"))
+    second = asyncio.run(ChatService.create_or_get_conversation("b@example.com", "a@example.com"))
+
+    assert first == second
+    assert asyncio.run(memory_db.conversations.count_documents({})) == 1
+
+def test_direct_conversation_id_is_served_from_cache(memory_db):
+    from chat_service import ChatService
+
+    conversation_id = asyncio.run(ChatService.create_or_get_conversation("a@example.com", "b@example.com"))
+    lookups = []
+    find_one = memory_db.conversations.find_one
+
+    async def counting_find_one(*args, **kwargs):
+        lookups.append(args)
+        return await find_one(*args, **kwargs)
+
+    memory_db.conversations.find_one = counting_find_one
+    assert asyncio.run(ChatService.create_or_get_conversation("b@example.com", "a@example.com")) == conversation_id
+    assert lookups == []
+
+def test_legacy_conversation_gets_its_pair_key(memory_db):
+    from chat_service import ChatService
+
+    legacy = asyncio.run(memory_db.conversations.insert_one({
+        "participants": ["a@example.com", "b@example.com"], "conversation_type": "direct"
+    }))
+
+    conversation_id = asyncio.run(ChatService.create_or_get_conversation("b@example.com", "a@example.com"))
+
+    assert conversation_id == str(legacy.inserted_id)
+    stored = asyncio.run(memory_db.conversations.find_one({"_id": legacy.inserted_id}))
+    assert stored["pair_key"] == ChatService.direct_pair_key("a@example.com", "b@example.com")
@@ -0,0 +1,55 @@
+"""
+Tests for who can read a conversation's history
+(GET /api/conversations/{conversation_id}/messages)
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException, Response
+
+import routes
+from chat_service import ChatService
+
+ALICE, BOB, CAROL = "alice@example.com", "bob@example.com", "carol@example.com"
+
+def run(coro):
+    return asyncio.run(coro)
+
+def history(conversation_id, user):
+    return run(routes.get_conversation_messages(
+        conversation_id, Response(), skip=0, limit=50, before=None, after=None, current_user=user
+    ))
+
+def message_texts(result):
+    if isinstance(result, Response):  # FAST_JSON_RESPONSES
+        return [message["message"] for message in json.loads(result.body)]
+    return [message["message"] for message in result]
+
+@pytest.fixture
+def group_id(memory_db):
+    group = run(ChatService.create_group(ALICE, "Study group", [BOB]))
+    run(ChatService.send_message(group["conversation_id"], ALICE, "Alice", "Exam on Friday"))
+    return group["conversation_id"]
+
+def test_member_reads_group_history(group_id):
+    assert message_texts(history(group_id, BOB)) == ["Exam on Friday"]
+
+def test_non_member_gets_403_for_group_history(group_id):
+    with pytest.raises(HTTPException) as error:
+        history(group_id, CAROL)
+    assert error.value.status_code == 403
+
+def test_former_member_gets_403(group_id):
+    assert run(ChatService.leave_group(group_id, BOB))
+
+    with pytest.raises(HTTPException) as error:
+        history(group_id, BOB)
+    assert error.value.status_code == 403
+
+def test_non_member_gets_403_for_direct_history(memory_db):
+    conversation_id = run(ChatService.create_or_get_conversation(ALICE, BOB))
+
+    with pytest.raises(HTTPException) as error:
+        history(conversation_id, CAROL)
+    assert error.value.status_code == 403
@@ -0,0 +1,76 @@
+"""
+Tests for batched delivery of group messages (group_fanout.GroupFanout)
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from group_fanout import GroupFanout
+
+def run_with_fanout(scenario, emit=None, **kwargs):
+    """Run scenario(fanout, emitted) with flushes driven by the test only"""
+    emitted = []
+
+    async def record(conversation_id, messages):
+        emitted.append((conversation_id, [message["id"] for message in messages]))
+
+    async def main():
+        # Long enough that the background tick never fires during a test
+        fanout = GroupFanout(emit or record, flush_interval_ms=60_000, **kwargs)
+        await scenario(fanout, emitted)
+        await fanout.stop()
+
+    asyncio.run(main())
+    return emitted
+
+def test_messages_of_a_tick_go_out_as_one_event_per_room():
+    async def scenario(fanout, emitted):
+        for i in range(3):
+            fanout.add("g1", {"id": i})
+        fanout.add("g2", {"id": 9})
+        await fanout.flush()
+
+        assert emitted == [("g1", [0, 1, 2]), ("g2", [9])]
+        assert fanout.stats()["messages_per_emit"] == 2
+
+    run_with_fanout(scenario)
+
+def test_large_backlog_is_split_into_max_batch_events():
+    async def scenario(fanout, emitted):
+        for i in range(5):
+            fanout.add("g1", {"id": i})
+        await fanout.flush()
+
+        assert emitted == [("g1", [0, 1]), ("g1", [2, 3]), ("g1", [4])]
+        assert fanout.metrics["largest_batch"] == 2
+
+    run_with_fanout(scenario, max_batch=2)
+
+def test_failed_emit_does_not_drop_other_rooms():
+    emitted = []
+
+    async def emit(conversation_id, messages):
+        if conversation_id == "broken":
+            raise RuntimeError("socket write failed")
+        emitted.append(conversation_id)
+
+    async def scenario(fanout, _):
+        fanout.add("g1", {"id": 1})
+        fanout.add("broken", {"id": 2})
+        fanout.add("g2", {"id": 3})
+        await fanout.flush()
+
+        assert emitted == ["g1", "g2"]
+        assert fanout.metrics["emit_errors"] == 1
+        assert fanout.stats()["pending_rooms"] == 0
+
+    run_with_fanout(scenario, emit=emit)
+
+def test_stop_delivers_pending_messages():
+    async def scenario(fanout, emitted):
+        fanout.add("g1", {"id": 1})
+        fanout.add("g1", {"id": 2})
+
+    assert run_with_fanout(scenario) == [("g1", [1, 2])]
@@ -0,0 +1,28 @@
+"""
+Tests for the index spec (indexes.py) on a database created with the
+original schema
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indexes import build_indexes, index_drift
+from memory_mongo import MemoryDatabase
+
+def test_original_schema_is_brought_to_the_spec():
+    database = MemoryDatabase()
+
+    async def scenario():
+        # The indexes the service created before indexes.py
+        await database.chat_messages.create_index([("conversation_id", 1), ("timestamp", -1)])
+        await database.conversations.create_index([("participants", 1)])
+        await database.conversations.create_index([("last_message_time", -1)])
+        await database.users.create_index([("email", 1)], unique=True)
+
+        assert await build_indexes(database) == {}
+        return await index_drift(database)
+
+    drift = asyncio.run(scenario())
+    assert all(not changes["missing"] and not changes["unexpected"] for changes in drift.values()), drift
@@ -0,0 +1,101 @@
+"""
+Tests for write-behind batching of message inserts (message_batcher.WriteBehindBatcher)
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from message_batcher import WriteBehindBatcher
+
+class Writer:
+    def __init__(self):
+        self.batches = []
+
+    async def __call__(self, items):
+        self.batches.append(list(items))
+        return [f"id-{item}" for item in items]
+
+def test_full_batch_commits_without_waiting_for_the_delay():
+    writer = Writer()
+    # A delay long enough that only the size limit can flush in time
+    batcher = WriteBehindBatcher(writer, max_batch_size=3, max_delay_ms=10_000)
+
+    async def scenario():
+        results = await asyncio.wait_for(asyncio.gather(*[batcher.submit(i) for i in range(3)]), 1)
+        await batcher.stop()
+        return results
+
+    assert asyncio.run(scenario()) == ["id-0", "id-1", "id-2"]
+    assert writer.batches == [[0, 1, 2]]
+
+def test_partial_batch_commits_after_the_delay():
+    writer = Writer()
+    batcher = WriteBehindBatcher(writer, max_batch_size=100, max_delay_ms=20)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"))
+        waited = loop.time() - started
+        await batcher.stop()
+        return results, waited
+
+    results, waited = asyncio.run(scenario())
+    assert results == ["id-a", "id-b"]
+    assert writer.batches == [["a", "b"]]
+    assert waited >= 0.015
+
+def test_stop_flushes_pending_submissions():
+    writer = Writer()
+    batcher = WriteBehindBatcher(writer, max_batch_size=100, max_delay_ms=10_000)
+
+    async def scenario():
+        pending = [asyncio.create_task(batcher.submit(i)) for i in range(5)]
+        await asyncio.sleep(0)  # let every submission reach the queue
+        await asyncio.wait_for(batcher.stop(), 1)
+        assert all(task.done() for task in pending)
+        return [task.result() for task in pending]
+
+    assert asyncio.run(scenario()) == [f"id-{i}" for i in range(5)]
+    assert writer.batches == [[0, 1, 2, 3, 4]]
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["items"] == 5
+
+def test_failed_batch_fails_every_item_and_the_writer_keeps_going():
+    calls = []
+
+    async def write_batch(items):
+        calls.append(items)
+        if len(calls) == 1:
+            raise RuntimeError("mongo down")
+        return items
+
+    batcher = WriteBehindBatcher(write_batch, max_batch_size=2, max_delay_ms=10_000)
+
+    async def scenario():
+        failed = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in failed)
+        # The next batch is written normally
+        assert await asyncio.gather(batcher.submit(3), batcher.submit(4)) == [3, 4]
+        await batcher.stop()
+
+    asyncio.run(scenario())
+    assert calls == [[1, 2], [3, 4]]
+
+def test_per_item_error_fails_only_that_item():
+    async def write_batch(items):
+        return [ValueError("duplicate") if item == "bad" else item for item in items]
+
+    batcher = WriteBehindBatcher(write_batch, max_batch_size=3, max_delay_ms=10_000)
+
+    async def scenario():
+        results = await asyncio.gather(
+            batcher.submit("a"), batcher.submit("bad"), batcher.submit("c"), return_exceptions=True
+        )
+        await batcher.stop()
+        return results
+
+    first, bad, last = asyncio.run(scenario())
+    assert (first, last) == ("a", "c")
+    assert isinstance(bad, ValueError)
@@ -0,0 +1,155 @@
+"""
+Tests for history pages of the bucketed layout (message_store.BucketedMessageStore)
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+
+import message_store
+from message_store import BucketedMessageStore
+from pagination import encode_cursor
+
+T0 = datetime(2024, 1, 1)
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        for field, direction in reversed(keys):
+            self.docs.sort(key=lambda doc: doc[field], reverse=direction < 0)
+        return self
+
+    def batch_size(self, _size):
+        return self
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+    def __aiter__(self):
+        return self._iterate()
+
+class FakeBuckets:
+    """Just the find filters history pages issue"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def find(self, query):
+        def matches(bucket):
+            if bucket["conversation_id"] != query["conversation_id"]:
+                return False
+            if "start" in query and bucket["start"] > query["start"]["$lte"]:
+                return False
+            if "end" in query and bucket["end"] < query["end"]["$gte"]:
+                return False
+            return True
+        return FakeCursor([bucket for bucket in self.buckets if matches(bucket)])
+
+def message(n, minute):
+    return {"_id": ObjectId(f"{n:024x}"), "timestamp": T0 + timedelta(minutes=minute), "message": f"m{n}"}
+
+def bucket(messages):
+    return {
+        "conversation_id": "c",
+        "start": min(m["timestamp"] for m in messages),
+        "end": max(m["timestamp"] for m in messages),
+        "messages": messages,
+    }
+
+def overlapping_buckets():
+    """Three buckets whose time ranges overlap, with several messages on
+    the same timestamp"""
+    first = bucket([message(0, 0), message(1, 1), message(2, 2), message(3, 3), message(5, 4), message(6, 5)])
+    second = bucket([message(4, 4), message(7, 6), message(8, 6), message(9, 8)])
+    third = bucket([message(10, 2), message(11, 5), message(12, 7)])
+    return FakeBuckets([first, second, third])
+
+@pytest.fixture
+def buckets(monkeypatch):
+    collection = overlapping_buckets()
+
+    async def get_collection():
+        return collection
+
+    monkeypatch.setattr(message_store, "get_message_buckets_collection", get_collection)
+    return collection
+
+def expected_order(collection):
+    unique = {m["_id"]: m for b in collection.buckets for m in b["messages"]}
+    return [m["_id"] for m in sorted(unique.values(), key=lambda m: (m["timestamp"], m["_id"]))]
+
+def ids(page):
+    return [m["_id"] for m in page]
+
+def page(skip=0, limit=3, before=None, after=None):
+    return asyncio.run(BucketedMessageStore().page("c", skip, limit, before, after))
+
+def cursor(message):
+    return encode_cursor(message["timestamp"], message["_id"])
+
+def test_newest_first_pages_cover_history_once(buckets):
+    order = expected_order(buckets)
+
+    pages, before = [], None
+    while True:
+        current = page(limit=3, before=before)
+        if not current:
+            break
+        pages.append(ids(current))
+        before = cursor(current[0])
+
+    # Each page is chronological and pages go back in time
+    assert [m for p in reversed(pages) for m in p] == order
+    assert pages[0] == order[-3:]
+
+def test_oldest_first_pages_cover_history_once(buckets):
+    order = expected_order(buckets)
+
+    pages, after = [], encode_cursor(T0 - timedelta(minutes=1), ObjectId("0" * 24))
+    while True:
+        current = page(limit=4, after=after)
+        if not current:
+            break
+        pages.append(ids(current))
+        after = cursor(current[-1])
+
+    assert [m for p in pages for m in p] == order
+    assert pages[0] == order[:4]
+
+def test_tied_timestamps_are_split_by_id(buckets):
+    order = expected_order(buckets)
+    # Messages 4 and 5 share a minute, in different buckets
+    tied = order.index(ObjectId(f"{4:024x}"))
+    position = encode_cursor(T0 + timedelta(minutes=4), order[tied])
+
+    assert ids(page(limit=2, before=position)) == order[tied - 2:tied]
+    assert ids(page(limit=2, after=position)) == order[tied + 1:tied + 3]
+
+def test_offset_pages_match_slices(buckets):
+    order = expected_order(buckets)
+
+    for skip in range(len(order)):
+        newest = list(reversed(order))[skip:skip + 3]
+        assert ids(page(skip=skip, limit=3)) == list(reversed(newest))
+
+def test_message_in_two_buckets_counts_once(buckets):
+    # A re-run archive or bucket migration can leave a message in two
+    # overlapping buckets
+    buckets.buckets[1]["messages"].insert(0, message(3, 3))
+    buckets.buckets[1]["start"] = T0 + timedelta(minutes=3)
+    order = expected_order(buckets)
+
+    newest = [m for skip in range(0, len(order), 3) for m in reversed(ids(page(skip=skip, limit=3)))]
+    oldest = ids(page(limit=len(order), after=encode_cursor(T0 - timedelta(minutes=1), ObjectId("0" * 24))))
+
+    assert newest == list(reversed(order))
+    assert oldest == order
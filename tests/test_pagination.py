@@ -0,0 +1,84 @@
+"""
+Tests for history cursors, search cursors and sync tokens (pagination.py)
+"""
+import base64
+import os
+import sys
+from datetime import datetime
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson import ObjectId
+
+from pagination import (
+    decode_cursor, decode_search_cursor, decode_sync_token,
+    encode_cursor, encode_search_cursor, encode_sync_token, keyset_filter
+)
+
+def raw_token(raw: str) -> str:
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def test_cursor_round_trip():
+    timestamp, message_id = datetime(2024, 5, 17, 8, 30, 15, 123000), ObjectId()
+
+    assert decode_cursor(encode_cursor(timestamp, message_id)) == (timestamp, message_id)
+
+@pytest.mark.parametrize("cursor", [
+    "",
+    raw_token("123"),
+    raw_token("abc." + str(ObjectId())),
+    raw_token("123.not-an-id"),
+    raw_token("9" * 30 + "." + str(ObjectId())),
+])
+def test_bad_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+def test_keyset_filter_breaks_ties_by_id():
+    timestamp, message_id = datetime(2024, 1, 1), ObjectId()
+
+    assert keyset_filter(encode_cursor(timestamp, message_id), "before") == {
+        "$or": [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "_id": {"$lt": message_id}}
+        ]
+    }
+
+def test_search_cursor_round_trip():
+    score, timestamp, message_id = 1.2345678901234567, datetime(2024, 5, 17, 8, 30, 15, 1000), ObjectId()
+
+    assert decode_search_cursor(encode_search_cursor(score, timestamp, message_id)) == (score, timestamp, message_id)
+
+@pytest.mark.parametrize("cursor", [
+    raw_token("1.5"),
+    raw_token("x_123." + str(ObjectId())),
+    raw_token("1.5_" + "9" * 30 + "." + str(ObjectId())),
+])
+def test_bad_search_cursors_raise_value_error(cursor):
+    with pytest.raises(ValueError):
+        decode_search_cursor(cursor)
+
+def test_sync_token_round_trip():
+    timestamp = datetime(2024, 5, 17, 8, 30, 15, 123000)
+
+    assert decode_sync_token(encode_sync_token(timestamp)) == timestamp
+
+def test_sync_token_truncates_to_milliseconds():
+    timestamp = datetime(2024, 5, 17, 8, 30, 15, 123456)
+
+    assert decode_sync_token(encode_sync_token(timestamp)) == timestamp.replace(microsecond=123000)
+
+@pytest.mark.parametrize("token", [
+    "",
+    "not base64!",
+    raw_token("12345"),          # no "s" prefix
+    raw_token("sabc"),
+    raw_token("s" + "9" * 30),   # past datetime.max
+    raw_token("s-" + "9" * 30),
+    encode_cursor(datetime(2024, 1, 1), ObjectId()),
+])
+def test_bad_sync_tokens_raise_value_error(token):
+    with pytest.raises(ValueError):
+        decode_sync_token(token)
@@ -0,0 +1,122 @@
+"""
+Tests for batched presence diffs (presence.PresenceBroadcaster) and the
+single-worker presence store it is fed from
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import presence
+from presence import LocalPresenceStore, PresenceBroadcaster
+from session_registry import SessionRegistry
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+CONTACTS = {
+    "a@example.com": ["c@example.com", "d@example.com"],
+    "b@example.com": ["c@example.com"],
+}
+
+def run_with_broadcaster(scenario, monkeypatch):
+    """Run scenario(broadcaster, emitted, clock) with flushes driven by the test only"""
+    clock = Clock()
+    monkeypatch.setattr(presence.time, "monotonic", clock)
+    emitted = []
+
+    async def emit(contact, diff):
+        emitted.append((contact, diff))
+
+    async def get_contacts(email):
+        return CONTACTS.get(email, [])
+
+    async def main():
+        # Long enough that the background tick never fires during a test
+        broadcaster = PresenceBroadcaster(emit, get_contacts, flush_interval_ms=60_000, debounce_seconds=5)
+        try:
+            await scenario(broadcaster, emitted, clock)
+        finally:
+            await broadcaster.stop()
+
+    asyncio.run(main())
+
+def test_changes_are_coalesced_into_one_diff_per_contact(monkeypatch):
+    async def scenario(broadcaster, emitted, clock):
+        broadcaster.user_online("a@example.com")
+        broadcaster.user_online("b@example.com")
+        await broadcaster.flush()
+
+        assert sorted(emitted) == [
+            ("c@example.com", {"online": ["a@example.com", "b@example.com"], "offline": []}),
+            ("d@example.com", {"online": ["a@example.com"], "offline": []}),
+        ]
+        assert broadcaster.stats()["emits"] == 2
+
+    run_with_broadcaster(scenario, monkeypatch)
+
+def test_offline_is_announced_only_after_the_debounce(monkeypatch):
+    async def scenario(broadcaster, emitted, clock):
+        broadcaster.user_offline("b@example.com")
+
+        clock.now += 4
+        await broadcaster.flush()
+        assert emitted == []
+
+        clock.now += 1
+        await broadcaster.flush()
+        assert emitted == [("c@example.com", {"online": [], "offline": ["b@example.com"]})]
+        assert broadcaster.stats()["pending"] == 0
+
+    run_with_broadcaster(scenario, monkeypatch)
+
+def test_quick_reconnect_sends_nothing(monkeypatch):
+    async def scenario(broadcaster, emitted, clock):
+        broadcaster.user_offline("a@example.com")
+        clock.now += 2
+        broadcaster.user_online("a@example.com")
+
+        clock.now += 10
+        await broadcaster.flush()
+
+        assert emitted == []
+        assert broadcaster.metrics["flaps_absorbed"] == 1
+
+    run_with_broadcaster(scenario, monkeypatch)
+
+def test_user_with_another_session_stays_online():
+    registry = SessionRegistry()
+    store = LocalPresenceStore(registry)
+
+    async def scenario():
+        registry.add("s1", "a@example.com")
+        assert await store.add("s1", "a@example.com") is True
+        registry.add("s2", "a@example.com")
+        assert await store.add("s2", "a@example.com") is False
+
+        # Closing one tab is not going offline
+        registry.remove("s1")
+        assert await store.remove("s1", "a@example.com") is False
+        assert await store.is_online("a@example.com")
+
+        registry.remove("s2")
+        assert await store.remove("s2", "a@example.com") is True
+        assert await store.online_emails(["a@example.com", "b@example.com"]) == []
+
+    asyncio.run(scenario())
+
+def test_new_conversation_refreshes_cached_contacts(memory_db):
+    from chat_service import ChatService
+
+    asyncio.run(ChatService.create_or_get_conversation("a@example.com", "b@example.com"))
+    assert asyncio.run(ChatService.get_user_contacts("a@example.com")) == ["b@example.com"]
+
+    asyncio.run(ChatService.create_or_get_conversation("c@example.com", "a@example.com"))
+
+    assert sorted(asyncio.run(ChatService.get_user_contacts("a@example.com"))) == ["b@example.com", "c@example.com"]
+    assert asyncio.run(ChatService.get_user_contacts("c@example.com")) == ["a@example.com"]
@@ -0,0 +1,97 @@
+"""
+Tests for the shared presence store (presence.MongoPresenceStore): expiring
+and stopping only touch the users whose sessions they remove
+"""
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import presence
+from presence import MongoPresenceStore
+
+def session_matches(session, condition):
+    for field, value in condition.items():
+        if isinstance(value, dict):
+            if not session[field] < value["$lt"]:
+                return False
+        elif session[field] != value:
+            return False
+    return True
+
+class FakePresence:
+    """Presence documents, matching just the filters MongoPresenceStore
+    issues, and a log of every filter"""
+
+    def __init__(self, docs):
+        self.docs = {doc["_id"]: doc for doc in docs}
+        self.filters = []
+
+    def _matching(self, query):
+        self.filters.append(query)
+        found = []
+        for doc in self.docs.values():
+            if "_id" in query and doc["_id"] not in query["_id"]["$in"]:
+                continue
+            if "sessions" in query and len(doc["sessions"]) != query["sessions"]["$size"]:
+                continue
+            nested = {key.split(".", 1)[1]: value for key, value in query.items() if key.startswith("sessions.")}
+            if nested and not any(session_matches(session, nested) for session in doc["sessions"]):
+                continue
+            found.append(doc)
+        return found
+
+    async def distinct(self, field, query):
+        return [doc[field] for doc in self._matching(query)]
+
+    async def update_many(self, query, update):
+        condition = update["$pull"]["sessions"]
+        for doc in self._matching(query):
+            doc["sessions"] = [s for s in doc["sessions"] if not session_matches(s, condition)]
+
+    async def delete_many(self, query):
+        for doc in self._matching(query):
+            del self.docs[doc["_id"]]
+
+@pytest.fixture
+def collection(monkeypatch):
+    now = datetime.utcnow()
+    stale = now - timedelta(minutes=10)
+    collection = FakePresence([
+        {"_id": "a@example.com", "sessions": [{"sid": "1", "host": "me", "seen": now}]},
+        {"_id": "b@example.com", "sessions": [
+            {"sid": "2", "host": "me", "seen": now}, {"sid": "3", "host": "other", "seen": now}
+        ]},
+        {"_id": "c@example.com", "sessions": [{"sid": "4", "host": "dead", "seen": stale}]},
+        {"_id": "d@example.com", "sessions": [{"sid": "5", "host": "other", "seen": now}]},
+    ])
+
+    async def get_collection():
+        return collection
+
+    monkeypatch.setattr(presence, "get_presence_collection", get_collection)
+    return collection
+
+def assert_no_unindexed_sweep(collection):
+    for query in collection.filters:
+        assert "_id" in query or any(key.startswith("sessions.") for key in query), query
+
+def test_stop_removes_only_this_workers_sessions(collection):
+    asyncio.run(MongoPresenceStore(host_id="me").stop())
+
+    assert sorted(collection.docs) == ["b@example.com", "c@example.com", "d@example.com"]
+    assert [s["sid"] for s in collection.docs["b@example.com"]["sessions"]] == ["3"]
+    assert_no_unindexed_sweep(collection)
+
+def test_expiry_removes_stale_sessions(collection):
+    store = MongoPresenceStore(host_id="me")
+    cutoff = datetime.utcnow() - timedelta(seconds=store.ttl)
+
+    asyncio.run(store._pull_sessions(collection, {"sessions.seen": {"$lt": cutoff}}, {"seen": {"$lt": cutoff}}))
+
+    assert sorted(collection.docs) == ["a@example.com", "b@example.com", "d@example.com"]
+    assert_no_unindexed_sweep(collection)
@@ -0,0 +1,44 @@
+"""
+Tests for read watermarks and receipts: only members of a conversation can
+move or see them
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+import routes
+from chat_service import ChatService
+
+ALICE, BOB, CAROL = "alice@example.com", "bob@example.com", "carol@example.com"
+
+def run(coro):
+    return asyncio.run(coro)
+
+@pytest.fixture
+def conversation_id(memory_db):
+    conversation_id = run(ChatService.create_or_get_conversation(ALICE, BOB))
+    run(ChatService.send_message(conversation_id, ALICE, "Alice", "Hi Bob"))
+    return conversation_id
+
+def test_member_moves_watermark(conversation_id):
+    read_state = run(ChatService.mark_conversation_as_read(conversation_id, BOB))
+
+    assert read_state["user_email"] == BOB
+    assert read_state["conversation_type"] == "direct"
+    assert [receipt.user_email for receipt in run(ChatService.get_read_receipts(conversation_id))] == [BOB]
+
+def test_non_member_cannot_mark_read(memory_db, conversation_id):
+    assert run(ChatService.mark_conversation_as_read(conversation_id, CAROL)) is None
+
+    assert run(memory_db.read_states.count_documents({"user_email": CAROL})) == 0
+    assert run(ChatService.get_read_receipts(conversation_id)) == []
+
+def test_non_member_gets_403_from_routes(conversation_id):
+    for call in (routes.mark_conversation_read, routes.get_read_receipts):
+        with pytest.raises(HTTPException) as error:
+            run(call(conversation_id, current_user=CAROL))
+        assert error.value.status_code == 403
+
+def test_invalid_conversation_id_is_not_a_membership(memory_db):
+    assert run(ChatService.mark_conversation_as_read("not-an-id", ALICE)) is None
@@ -0,0 +1,73 @@
+"""
+Tests for the reconnect replay buffer (replay_buffer.py)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from replay_buffer import ReplayBuffer
+
+def seqs(events):
+    return [seq for seq, _, _ in events]
+
+def test_record_numbers_events_and_replays_the_gap():
+    buffer = ReplayBuffer()
+    first = buffer.record("a", "new_message", {"id": 1})
+    buffer.record("b", "new_message", {"id": 2})
+    buffer.record("a", "user_typing", {"id": 3})
+
+    assert first == {"id": 1, "seq": 1}
+    assert seqs(buffer.since(["a", "b"], 1)) == [2, 3]
+    assert seqs(buffer.since(["a"], 0)) == [1, 3]
+    assert buffer.since(["a", "b"], 3) == []
+
+def test_seq_ahead_of_buffer_is_incomplete():
+    buffer = ReplayBuffer()
+    buffer.record("a", "new_message", {})
+
+    # A seq from another worker or before a restart
+    assert buffer.since(["a"], 5) is None
+    assert buffer.metrics["replays_incomplete"] == 1
+
+def test_per_conversation_cap_raises_floor():
+    buffer = ReplayBuffer(max_events_per_conversation=2)
+    for i in range(4):
+        buffer.record("a", "new_message", {"i": i})
+
+    assert buffer.stats()["events"] == 2
+    assert buffer.metrics["evictions"] == 2
+    # seqs 1 and 2 were evicted: replaying from before them is incomplete
+    assert buffer.since(["a"], 1) is None
+    assert seqs(buffer.since(["a"], 2)) == [3, 4]
+
+def test_global_cap_evicts_least_recently_written_conversation():
+    buffer = ReplayBuffer(max_events=3)
+    buffer.record("a", "new_message", {})  # 1
+    buffer.record("b", "new_message", {})  # 2
+    buffer.record("a", "new_message", {})  # 3
+    buffer.record("c", "new_message", {})  # 4, evicts b
+
+    assert buffer.stats()["conversations"] == 2
+    assert buffer._evicted_through == 2
+    assert buffer.since(["b"], 1) is None
+    assert buffer.since(["b"], 2) == []
+    assert seqs(buffer.since(["a", "c"], 1)) == [3, 4]
+
+def test_new_conversation_inherits_evicted_floor():
+    buffer = ReplayBuffer(max_events=1)
+    buffer.record("a", "new_message", {})  # 1
+    buffer.record("b", "new_message", {})  # 2, evicts a
+    buffer.record("a", "new_message", {})  # 3, evicts b
+
+    # a's new buffer cannot tell whether seq 1 was one of its events
+    assert buffer.since(["a"], 0) is None
+    assert seqs(buffer.since(["a"], 2)) == [3]
+
+def test_stamp_only_records_conversation_rooms():
+    buffer = ReplayBuffer()
+
+    assert buffer.stamp("new_message", {"id": 1}, "user:x@example.com") == {"id": 1}
+    assert buffer.stamp("error", {"id": 1}, "conversation:a") == {"id": 1}
+    assert buffer.stamp("new_message", {"id": 1}, ["user:x", "conversation:a"]) == {"id": 1, "seq": 1}
+    assert seqs(buffer.since(["a"], 0)) == [1]
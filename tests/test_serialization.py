@@ -0,0 +1,70 @@
+"""
+Tests for the streamed NDJSON encoding (serialization.ndjson_chunks)
+"""
+import asyncio
+import gzip
+import json
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from serialization import ndjson_chunks
+
+async def records(items, pulled=None):
+    for item in items:
+        if pulled is not None:
+            pulled.append(item["n"])
+        yield item
+
+def collect(chunks):
+    async def run():
+        return [chunk async for chunk in chunks]
+    return asyncio.run(run())
+
+def test_records_become_lines():
+    items = [{"n": i, "timestamp": datetime(2024, 1, 1, 12, 0, i)} for i in range(3)]
+
+    body = b"".join(collect(ndjson_chunks(records(items))))
+
+    lines = body.decode().splitlines()
+    assert [json.loads(line)["n"] for line in lines] == [0, 1, 2]
+    assert json.loads(lines[0])["timestamp"].startswith("2024-01-01T12:00:00")
+    assert body.endswith(b"\n")
+
+def test_chunks_are_about_chunk_bytes():
+    items = [{"n": i, "text": "x" * 100} for i in range(50)]
+
+    chunks = collect(ndjson_chunks(records(items), chunk_bytes=1000))
+
+    assert len(chunks) > 1
+    # A chunk is cut at the first record that reaches the size
+    assert all(1000 <= len(chunk) < 1200 for chunk in chunks[:-1])
+    assert len(b"".join(chunks).splitlines()) == 50
+
+def test_compressed_stream_is_gzip():
+    items = [{"n": i, "text": "study notes"} for i in range(200)]
+
+    chunks = collect(ndjson_chunks(records(items), compress=True, chunk_bytes=512))
+
+    lines = gzip.decompress(b"".join(chunks)).splitlines()
+    assert [json.loads(line)["n"] for line in lines] == list(range(200))
+
+def test_no_records_no_chunks():
+    assert collect(ndjson_chunks(records([]))) == []
+    assert gzip.decompress(b"".join(collect(ndjson_chunks(records([]), compress=True)))) == b""
+
+def test_records_are_pulled_lazily():
+    pulled = []
+    items = [{"n": i, "text": "x" * 100} for i in range(50)]
+
+    async def first_chunk():
+        chunks = ndjson_chunks(records(items, pulled), chunk_bytes=1000)
+        chunk = await chunks.__anext__()
+        await chunks.aclose()
+        return chunk
+
+    chunk = asyncio.run(first_chunk())
+
+    assert len(pulled) == len(chunk.splitlines()) < 50
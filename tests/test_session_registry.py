@@ -0,0 +1,60 @@
+"""
+Tests for the sid <-> email socket index (session_registry.SessionRegistry)
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from session_registry import SessionRegistry
+
+def test_first_session_of_a_user():
+    registry = SessionRegistry()
+
+    assert registry.add("s1", "a@example.com", "Alice") is True
+    assert registry.add("s2", "a@example.com") is False
+    assert registry.add("s3", "b@example.com") is True
+
+    assert registry.get_sids("a@example.com") == {"s1", "s2"}
+    assert registry.get("s1").name == "Alice"
+    assert registry.get_email("s3") == "b@example.com"
+    assert registry.session_count() == 3 and registry.user_count() == 2
+
+def test_user_stays_online_until_last_session_leaves():
+    registry = SessionRegistry()
+    registry.add("s1", "a@example.com")
+    registry.add("s2", "a@example.com")
+
+    assert registry.remove("s1").email == "a@example.com"
+    assert registry.is_online("a@example.com")
+    assert registry.sid_count("a@example.com") == 1
+
+    registry.remove("s2")
+    assert not registry.is_online("a@example.com")
+    assert registry.online_emails() == []
+    assert registry.get_sids("a@example.com") == set()
+
+def test_unknown_sid():
+    registry = SessionRegistry()
+
+    assert registry.remove("missing") is None
+    assert registry.get_email("missing") is None
+    assert "missing" not in registry
+
+def test_reused_sid_moves_to_the_new_user():
+    registry = SessionRegistry()
+    registry.add("s1", "a@example.com")
+
+    assert registry.add("s1", "b@example.com") is True
+
+    assert not registry.is_online("a@example.com")
+    assert registry.get_email("s1") == "b@example.com"
+    assert len(registry) == 1
+
+def test_get_sids_returns_a_copy():
+    registry = SessionRegistry()
+    registry.add("s1", "a@example.com")
+
+    registry.get_sids("a@example.com").add("s2")
+
+    assert registry.get_sids("a@example.com") == {"s1"}
@@ -0,0 +1,76 @@
+"""
+Tests for delta sync (ChatService.sync): it returns only what changed after
+the token, and finds changed read states without listing every conversation
+of the user
+"""
+import asyncio
+import time
+from datetime import datetime
+
+from chat_service import ChatService
+
+ALICE, BOB, CAROL = "alice@example.com", "bob@example.com", "carol@example.com"
+
+def run(coro):
+    return asyncio.run(coro)
+
+def record_finds(collection):
+    filters = []
+    find = collection.find
+
+    def recording_find(filter=None, *args, **kwargs):
+        filters.append(filter)
+        return find(filter, *args, **kwargs)
+
+    collection.find = recording_find
+    return filters
+
+def test_only_the_changed_conversation_is_synced(memory_db):
+    old = []
+    for i in range(30):
+        contact = f"contact{i}@example.com"
+        conversation_id = run(ChatService.create_or_get_conversation(ALICE, contact))
+        run(ChatService.send_message(conversation_id, contact, "Contact", "Old news"))
+        run(ChatService.mark_conversation_as_read(conversation_id, ALICE))
+        run(ChatService.mark_conversation_as_read(conversation_id, contact))
+        old.append(conversation_id)
+    time.sleep(0.01)
+    since = datetime.utcnow()
+    time.sleep(0.01)
+
+    changed = old[7]
+    run(ChatService.send_message(changed, ALICE, "Alice", "Still there?"))
+    run(ChatService.mark_conversation_as_read(changed, "contact7@example.com"))
+
+    filters = record_finds(memory_db.read_states)
+    result = run(ChatService.sync(ALICE, since))
+
+    assert result["reset"] is False
+    assert [conv["conversation_id"] for conv in result["conversations"]] == [changed]
+    assert [message["message"] for message in result["messages"]] == ["Still there?"]
+    assert [(state["conversation_id"], state["user_email"]) for state in result["read_states"]] == [
+        (changed, "contact7@example.com")
+    ]
+    # Changes are found by user, not by the ids of all 30 conversations;
+    # only the unread count of the changed one looks up its id
+    changes = [f for f in filters if "updated_at" in f]
+    assert len(changes) == 1 and "conversation_id" not in changes[0]
+    assert all(f["conversation_id"] == {"$in": [changed]} for f in filters if f not in changes)
+
+def test_group_read_states_are_the_users_own(memory_db):
+    group = run(ChatService.create_group(ALICE, "Study group", [BOB]))
+    group_id = group["conversation_id"]
+    time.sleep(0.01)
+    since = datetime.utcnow()
+    time.sleep(0.01)
+
+    run(ChatService.send_message(group_id, BOB, "Bob", "Notes attached"))
+    run(ChatService.mark_conversation_as_read(group_id, BOB))
+    run(ChatService.mark_conversation_as_read(group_id, ALICE))
+
+    alice = run(ChatService.sync(ALICE, since))
+    assert [(state["conversation_id"], state["user_email"]) for state in alice["read_states"]] == [
+        (group_id, ALICE)
+    ]
+    # Carol is in neither conversation
+    assert run(ChatService.sync(CAROL, since))["read_states"] == []
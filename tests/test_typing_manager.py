@@ -0,0 +1,127 @@
+"""
+Tests for server-side typing indicator state (typing_manager.TypingManager)
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import typing_manager
+from typing_manager import TypingManager
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def run_with_manager(scenario, **kwargs):
+    """Run scenario(manager, emitted) with flushes driven by the test only"""
+    emitted = []
+
+    async def emit(conversation_id, user_email, typing):
+        emitted.append((conversation_id, user_email, typing))
+
+    async def main():
+        # Long enough that the background tick never fires during a test
+        manager = TypingManager(emit, flush_interval_ms=60_000, **kwargs)
+        try:
+            await scenario(manager, emitted)
+        finally:
+            await manager.stop()
+
+    asyncio.run(main())
+
+def test_repeated_starts_emit_once():
+    async def scenario(manager, emitted):
+        for _ in range(10):
+            manager.start_typing("c1", "a@example.com")
+        await manager.flush()
+        await manager.flush()
+
+        assert emitted == [("c1", "a@example.com", True)]
+        assert manager.metrics["events_deduped"] == 9
+
+    run_with_manager(scenario)
+
+def test_start_then_stop_within_a_tick_emits_nothing():
+    async def scenario(manager, emitted):
+        manager.start_typing("c1", "a@example.com")
+        manager.stop_typing("c1", "a@example.com")
+        await manager.flush()
+
+        assert emitted == []
+
+    run_with_manager(scenario)
+
+def test_typing_expires_after_the_timeout(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(typing_manager.time, "monotonic", clock)
+
+    async def scenario(manager, emitted):
+        manager.start_typing("c1", "a@example.com")
+        await manager.flush()
+
+        clock.now += 4
+        await manager.flush()
+        assert emitted == [("c1", "a@example.com", True)]
+
+        clock.now += 2
+        await manager.flush()
+        assert emitted[-1] == ("c1", "a@example.com", False)
+        assert manager.metrics["timeouts"] == 1
+        assert manager.stats()["active_typers"] == 0
+
+    run_with_manager(scenario, timeout_seconds=5)
+
+def test_restart_extends_the_timeout(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(typing_manager.time, "monotonic", clock)
+
+    async def scenario(manager, emitted):
+        manager.start_typing("c1", "a@example.com")
+        clock.now += 4
+        manager.start_typing("c1", "a@example.com")
+        clock.now += 4
+        await manager.flush()
+
+        assert emitted == [("c1", "a@example.com", True)]
+
+    run_with_manager(scenario, timeout_seconds=5)
+
+def test_emits_over_the_room_cap_are_deferred_to_the_next_tick():
+    async def scenario(manager, emitted):
+        for i in range(5):
+            manager.start_typing("c1", f"user{i}@example.com")
+        manager.start_typing("c2", "other@example.com")
+
+        await manager.flush()
+        assert len([e for e in emitted if e[0] == "c1"]) == 2
+        assert ("c2", "other@example.com", True) in emitted
+
+        await manager.flush()
+        await manager.flush()
+        c1 = sorted(email for conversation_id, email, _ in emitted if conversation_id == "c1")
+        assert c1 == [f"user{i}@example.com" for i in range(5)]
+        # 3 waited after the first tick, 1 after the second
+        assert manager.metrics["emits_deferred"] == 4
+
+    run_with_manager(scenario, max_emits_per_room=2)
+
+def test_clear_user_stops_typing_everywhere():
+    async def scenario(manager, emitted):
+        manager.start_typing("c1", "a@example.com")
+        manager.start_typing("c2", "a@example.com")
+        manager.start_typing("c2", "b@example.com")
+        await manager.flush()
+        emitted.clear()
+
+        manager.clear_user("a@example.com")
+        await manager.flush()
+
+        assert sorted(emitted) == [("c1", "a@example.com", False), ("c2", "a@example.com", False)]
+        assert manager.stats()["active_conversations"] == 1
+
+    run_with_manager(scenario)
@@ -0,0 +1,111 @@
+"""
+Tests for TTLCache and the user profile cache in front of
+ChatService.get_user_by_email
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+from cache import TTLCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def test_ttl_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    ttl = TTLCache(10, ttl=30)
+    ttl.set("a", 1)
+
+    clock.now += 29
+    assert ttl.get("a") == 1
+    clock.now += 2
+    assert ttl.get("a") is None
+    assert ttl.stats()["expirations"] == 1 and "a" not in ttl
+
+def test_ttl_update_keeps_expiry_and_counts_no_lookup(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    ttl = TTLCache(10, ttl=30)
+    ttl.set("a", {"online": False})
+
+    clock.now += 20
+    assert ttl.update("a", lambda value: dict(value, online=True)) is True
+    assert ttl.update("missing", lambda value: value) is False
+    assert ttl.stats()["hits"] == 0 and ttl.stats()["misses"] == 0
+
+    assert ttl.get("a") == {"online": True}
+    # Patching does not extend the entry's life
+    clock.now += 11
+    assert ttl.get("a") is None
+
+def test_ttl_pop_returns_value():
+    ttl = TTLCache(10, ttl=30)
+    ttl.set("a", 1)
+
+    assert ttl.pop("a") == 1
+    assert ttl.pop("a") is None
+
+def count_finds(collection):
+    finds = []
+    find_one = collection.find_one
+
+    async def counting_find_one(*args, **kwargs):
+        finds.append(args)
+        return await find_one(*args, **kwargs)
+
+    collection.find_one = counting_find_one
+    return finds
+
+def test_profile_is_read_once(memory_db):
+    from chat_service import ChatService
+
+    asyncio.run(memory_db.users.insert_one({"email": "a@example.com", "name": "Alice"}))
+    finds = count_finds(memory_db.users)
+
+    assert asyncio.run(ChatService.get_user_by_email("a@example.com")).name == "Alice"
+    assert asyncio.run(ChatService.get_user_by_email("a@example.com")).name == "Alice"
+    assert len(finds) == 1
+
+def test_created_user_is_cached(memory_db):
+    from chat_service import ChatService
+
+    asyncio.run(ChatService.create_user("a@example.com", "Alice"))
+    finds = count_finds(memory_db.users)
+
+    assert asyncio.run(ChatService.get_user_by_email("a@example.com")).name == "Alice"
+    assert finds == []
+
+def test_presence_write_patches_cached_profile(memory_db):
+    from chat_service import ChatService
+
+    asyncio.run(ChatService.create_user("a@example.com", "Alice"))
+    finds = count_finds(memory_db.users)
+
+    asyncio.run(ChatService.update_user_online_status("a@example.com", True, "sid-1"))
+    user = asyncio.run(ChatService.get_user_by_email("a@example.com"))
+    assert (user.is_online, user.socket_id) == (True, "sid-1")
+
+    asyncio.run(ChatService.update_user_online_status("a@example.com", False))
+    user = asyncio.run(ChatService.get_user_by_email("a@example.com"))
+    assert (user.is_online, user.socket_id) == (False, None)
+    # Served from the patched entry, never re-read
+    assert finds == []
+    stored = asyncio.run(memory_db.users.find_one({"email": "a@example.com"}))
+    assert stored["is_online"] is False
+
+def test_presence_write_for_uncached_user_is_read_fresh(memory_db):
+    from chat_service import ChatService
+
+    asyncio.run(memory_db.users.insert_one({"email": "a@example.com", "name": "Alice", "is_online": False}))
+    asyncio.run(ChatService.update_user_online_status("a@example.com", True, "sid-1"))
+
+    user = asyncio.run(ChatService.get_user_by_email("a@example.com"))
+    assert (user.is_online, user.socket_id) == (True, "sid-1")
@@ -0,0 +1,46 @@
+"""
+Tests for the local message bus broker (worker_bus.LocalBusBroker)
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker_bus import LocalBusBroker, _encode, _open_connection, _read_frame
+
+def test_relays_to_other_workers_and_stops_cleanly(tmp_path):
+    url = f"unix://{tmp_path}/bus.sock"
+    errors = []
+
+    async def scenario():
+        asyncio.get_running_loop().set_exception_handler(lambda loop, context: errors.append(context))
+        broker = LocalBusBroker(url)
+        await broker.start()
+
+        # Keep the writers referenced: a collected writer closes its socket
+        own_reader, own_writer = await _open_connection(url, "listen", "w1")
+        other_reader, other_writer = await _open_connection(url, "listen", "w2")
+        _, publisher = await _open_connection(url, "publish", "w1")
+        await asyncio.sleep(0.05)
+        publisher.write(_encode({"method": "emit", "event": "ping"}))
+        await publisher.drain()
+
+        relayed = await asyncio.wait_for(_read_frame(other_reader), 1)
+        assert b"ping" in relayed
+        # A worker does not hear its own events back
+        own = asyncio.ensure_future(_read_frame(own_reader))
+        await asyncio.sleep(0.05)
+        assert not own.done()
+        own.cancel()
+
+        clients = set(broker._clients)
+        assert len(clients) == 3
+        await broker.stop()
+        assert all(task.done() for task in clients)
+        assert not broker._clients and not broker._listeners
+        # The workers see their connections closed
+        assert await other_reader.read() == b""
+
+    asyncio.run(scenario())
+    assert errors == []
@@ -0,0 +1,141 @@
+"""
+Server-side typing indicator state.
+
+Clients send typing_start/typing_stop as often as they like; the manager only
+records the latest state and, once per tick, emits the difference between
+what each conversation was last told and who is typing now. Repeated starts
+are absorbed, typing stops on its own after a timeout, and at most
+`max_emits_per_room` user_typing events go to a conversation per tick.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# emit(conversation_id, user_email, typing)
+EmitTyping = Callable[[str, str, bool], Awaitable[None]]
+
+class TypingManager:
+    def __init__(self, emit: EmitTyping, flush_interval_ms: float = 250,
+                 timeout_seconds: float = 5, max_emits_per_room: int = 5):
+        self.emit = emit
+        self.flush_interval = flush_interval_ms / 1000
+        self.timeout = timeout_seconds
+        self.max_emits_per_room = max_emits_per_room
+
+        self._typing: Dict[str, Dict[str, float]] = {}     # conversation -> {email: expires_at}
+        self._announced: Dict[str, Set[str]] = {}          # conversation -> emails clients see typing
+        self._conversations_by_user: Dict[str, Set[str]] = {}
+        self._dirty: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+        self.metrics = {
+            "events_received": 0,
+            "events_deduped": 0,
+            "emits": 0,
+            "emits_deferred": 0,
+            "timeouts": 0,
+            "ticks": 0,
+        }
+
+    def start_typing(self, conversation_id: str, user_email: str):
+        self.metrics["events_received"] += 1
+        typers = self._typing.setdefault(conversation_id, {})
+        if user_email in typers:
+            self.metrics["events_deduped"] += 1
+        else:
+            self._conversations_by_user.setdefault(user_email, set()).add(conversation_id)
+            self._dirty.add(conversation_id)
+        typers[user_email] = time.monotonic() + self.timeout
+        self._ensure_running()
+
+    def stop_typing(self, conversation_id: str, user_email: str, count_event: bool = True):
+        if count_event:
+            self.metrics["events_received"] += 1
+        typers = self._typing.get(conversation_id)
+        if not typers or user_email not in typers:
+            if count_event:
+                self.metrics["events_deduped"] += 1
+            return
+        self._remove(conversation_id, user_email)
+        self._dirty.add(conversation_id)
+
+    def clear_user(self, user_email: str):
+        """Stop typing everywhere (e.g. the user disconnected)"""
+        for conversation_id in list(self._conversations_by_user.get(user_email, ())):
+            self.stop_typing(conversation_id, user_email, count_event=False)
+
+    def _remove(self, conversation_id: str, user_email: str):
+        typers = self._typing[conversation_id]
+        del typers[user_email]
+        if not typers:
+            del self._typing[conversation_id]
+        conversations = self._conversations_by_user.get(user_email)
+        if conversations is not None:
+            conversations.discard(conversation_id)
+            if not conversations:
+                del self._conversations_by_user[user_email]
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Typing flush error: {e}")
+            if not self._typing and not self._dirty and not self._announced:
+                self._task = None
+                return
+
+    async def flush(self):
+        """Expire stale typers and emit pending changes, capped per room"""
+        self.metrics["ticks"] += 1
+        now = time.monotonic()
+        for conversation_id, typers in list(self._typing.items()):
+            for user_email, expires_at in list(typers.items()):
+                if expires_at <= now:
+                    self._remove(conversation_id, user_email)
+                    self._dirty.add(conversation_id)
+                    self.metrics["timeouts"] += 1
+
+        dirty, self._dirty = self._dirty, set()
+        for conversation_id in dirty:
+            current = set(self._typing.get(conversation_id, ()))
+            announced = self._announced.setdefault(conversation_id, set())
+            changes = [(email, True) for email in current - announced]
+            changes += [(email, False) for email in announced - current]
+
+            sent = changes[:self.max_emits_per_room]
+            for user_email, typing in sent:
+                await self.emit(conversation_id, user_email, typing)
+                if typing:
+                    announced.add(user_email)
+                else:
+                    announced.discard(user_email)
+            self.metrics["emits"] += len(sent)
+
+            if len(changes) > len(sent):
+                # Over the per-room cap: the rest goes out on the next tick
+                self.metrics["emits_deferred"] += len(changes) - len(sent)
+                self._dirty.add(conversation_id)
+            if not announced:
+                del self._announced[conversation_id]
+
+    def stats(self) -> dict:
+        return {
+            **self.metrics,
+            "active_conversations": len(self._typing),
+            "active_typers": len(self._conversations_by_user),
+            "max_emits_per_room_per_second": round(self.max_emits_per_room / self.flush_interval, 2),
+        }
@@ -0,0 +1,262 @@
+"""
+Inter-worker message bus for Socket.IO.
+
+When the backend runs with several uvicorn workers every process has its own
+Socket.IO rooms, so an emit made in one worker never reaches sockets held by
+another. A pub/sub client manager forwards every emit (and room/disconnect
+operation) to the other workers.
+
+Supported SOCKETIO_MESSAGE_QUEUE values:
+    ""                      single process, no bus (default)
+    redis://host:port/db    socketio.AsyncRedisManager (needs the redis package)
+    unix:///path/to/sock    local broker over a Unix domain socket (mode 0600)
+    tcp://host:port         local broker over TCP, loopback addresses only
+
+The local broker speaks length-prefixed JSON frames. Every worker opens one
+connection to publish and one to listen, each starting with a hello frame
+naming its role and worker, and the broker relays published frames to the
+listeners of every other worker.
+"""
+import asyncio
+import ipaddress
+import json
+import logging
+import os
+import struct
+import threading
+from typing import Dict, Optional, Set
+from urllib.parse import urlparse
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!I")
+# Larger frames are treated as a broken connection
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+
+async def _read_frame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(_HEADER.size)
+    (length,) = _HEADER.unpack(header)
+    if length > MAX_FRAME_BYTES:
+        raise ConnectionError(f"Message bus frame of {length} bytes is too large")
+    return await reader.readexactly(length)
+
+def _frame(payload: bytes) -> bytes:
+    return _HEADER.pack(len(payload)) + payload
+
+def _encode(message: dict) -> bytes:
+    return _frame(json.dumps(message, separators=(",", ":")).encode("utf-8"))
+
+def _check_tcp_host(host: Optional[str]):
+    """The bus is unauthenticated, so it never listens beyond this machine"""
+    if host == "localhost":
+        return
+    try:
+        loopback = ipaddress.ip_address(host or "").is_loopback
+    except ValueError:
+        loopback = False
+    if not loopback:
+        raise ValueError(f"Message bus TCP address must be a loopback address, not {host!r}")
+
+async def _open_connection(url: str, role: str, worker: str):
+    """Connect to the broker and introduce the connection"""
+    parsed = urlparse(url)
+    if parsed.scheme == "unix":
+        reader, writer = await asyncio.open_unix_connection(parsed.path)
+    elif parsed.scheme == "tcp":
+        _check_tcp_host(parsed.hostname)
+        reader, writer = await asyncio.open_connection(parsed.hostname, parsed.port)
+    else:
+        raise ValueError(f"Unsupported message bus URL: {url}")
+    writer.write(_encode({"role": role, "worker": worker}))
+    await writer.drain()
+    return reader, writer
+
+def is_local_bus_url(url: Optional[str]) -> bool:
+    return bool(url) and urlparse(url).scheme in ("unix", "tcp")
+
+class LocalBusBroker:
+    """Relays every frame a worker publishes to the listeners of all other
+    workers"""
+
+    def __init__(self, url: str):
+        self.url = url
+        # listening connection -> its worker
+        self._listeners: Dict[asyncio.StreamWriter, str] = {}
+        # One task per connected worker connection, cancelled on stop
+        self._clients: Set[asyncio.Task] = set()
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self):
+        parsed = urlparse(self.url)
+        if parsed.scheme == "unix":
+            if os.path.exists(parsed.path):
+                os.unlink(parsed.path)
+            # Only this user may connect; the socket is created 0600
+            umask = os.umask(0o177)
+            try:
+                self._server = await asyncio.start_unix_server(self._handle_client, parsed.path)
+            finally:
+                os.umask(umask)
+        elif parsed.scheme == "tcp":
+            _check_tcp_host(parsed.hostname)
+            self._server = await asyncio.start_server(self._handle_client, parsed.hostname, parsed.port)
+        else:
+            raise ValueError(f"Unsupported message bus URL: {self.url}")
+        logger.info(f"Message bus broker listening on {self.url}")
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+        clients = list(self._clients)
+        for task in clients:
+            task.cancel()
+        await asyncio.gather(*clients, return_exceptions=True)
+        if self._server:
+            await self._server.wait_closed()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            hello = json.loads(await _read_frame(reader))
+            worker = str(hello["worker"])
+            if hello["role"] == "listen":
+                self._listeners[writer] = worker
+                # Listeners only receive; wait until the worker goes away
+                await reader.read()
+                return
+            while True:
+                frame = _frame(await _read_frame(reader))
+                targets = [other for other, owner in list(self._listeners.items()) if owner != worker]
+                for other in targets:
+                    other.write(frame)
+                # Apply backpressure from the slowest worker
+                for other in targets:
+                    try:
+                        await other.drain()
+                    except ConnectionError:
+                        self._listeners.pop(other, None)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, KeyError, TypeError):
+            pass
+        except asyncio.CancelledError:
+            # stop(): end normally, since asyncio logs the cancellation of a
+            # client_connected_cb task as an error
+            pass
+        finally:
+            self._clients.discard(task)
+            self._listeners.pop(writer, None)
+            writer.close()
+
+def start_broker_thread(url: str) -> threading.Thread:
+    """Run a LocalBusBroker in a daemon thread (used by run.py before forking workers)"""
+    ready = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        broker = LocalBusBroker(url)
+        loop.run_until_complete(broker.start())
+        ready.set()
+        loop.run_until_complete(broker.serve_forever())
+
+    thread = threading.Thread(target=run, name="socketio-bus-broker", daemon=True)
+    thread.start()
+    ready.wait(timeout=5)
+    return thread
+
+class LocalBusManager(AsyncPubSubManager):
+    """Socket.IO client manager that shares events through a LocalBusBroker.
+
+    Publishing and listening use separate connections, so a reconnect of
+    one never leaves the other reading from or writing to a dead socket.
+    """
+
+    name = "localbus"
+
+    def __init__(self, url: str, channel: str = "socketio", write_only: bool = False, logger=None):
+        parsed = urlparse(url)
+        if parsed.scheme == "tcp":
+            _check_tcp_host(parsed.hostname)
+        self.url = url
+        self._writer: Optional[asyncio.StreamWriter] = None  # publishing connection
+        self._connect_lock: Optional[asyncio.Lock] = None
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+
+    async def _connect(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                _, self._writer = await _open_connection(self.url, "publish", self.host_id)
+
+    async def _publish(self, data):
+        try:
+            frame = _encode(data)
+        except (TypeError, ValueError) as e:
+            self._get_logger().error(f"Cannot publish {data.get('method')} to message bus: {e}")
+            return
+        for attempt in range(2):
+            try:
+                await self._connect()
+                self._writer.write(frame)
+                await self._writer.drain()
+                return
+            except (ConnectionError, OSError) as e:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+                if attempt:
+                    self._get_logger().error(f"Cannot publish to message bus: {e}")
+
+    async def _listen(self):
+        retry_sleep = 1
+        while True:
+            writer = None
+            try:
+                reader, writer = await _open_connection(self.url, "listen", self.host_id)
+                retry_sleep = 1
+                while True:
+                    payload = await _read_frame(reader)
+                    try:
+                        message = json.loads(payload)
+                    except ValueError:
+                        self._get_logger().error("Ignoring a malformed message bus frame")
+                        continue
+                    if isinstance(message, dict):
+                        yield message
+            except (asyncio.IncompleteReadError, ConnectionError, OSError) as e:
+                self._get_logger().error(f"Message bus connection lost ({e}), retrying in {retry_sleep}s")
+                await asyncio.sleep(retry_sleep)
+                retry_sleep = min(retry_sleep * 2, 30)
+            finally:
+                if writer is not None:
+                    writer.close()
+
+def create_client_manager(url: Optional[str]) -> Optional[socketio.AsyncManager]:
+    """Build the Socket.IO client manager for the configured message queue"""
+    if not url:
+        return None
+    if url.startswith(("redis://", "rediss://")):
+        return socketio.AsyncRedisManager(url)
+    if is_local_bus_url(url):
+        return LocalBusManager(url)
+    raise ValueError(f"Unsupported SOCKETIO_MESSAGE_QUEUE: {url}")
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Standalone Socket.IO message bus broker")
+    parser.add_argument("url", help="unix:///path/to/sock or tcp://host:port")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(LocalBusBroker(args.url).serve_forever())